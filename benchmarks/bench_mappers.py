@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""bench_mappers.py
+
+Micro-benchmark for the entity-to-message copy on list endpoints:
+the old per-field loops versus the precompiled mappers in mappers.py.
+
+usage: GAE_SDK=/path/to/google_appengine python benchmarks/bench_mappers.py [N]
+
+Builds N (default 10000) in-memory Conference, Session and Profile
+entities, checks both copies give identical messages and prints the
+per-item cost of each. No datastore is touched.
+
+"""
+
+import sys
+import time
+from datetime import date, time as dtime
+
+import harness
+
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from models import Conference, ConferenceForm
+from models import Session, SessionForm
+from models import Profile, ProfileForm, TeeShirtSize
+
+
+# - - - the copies as they were before mappers.py - - - - - - - -
+
+def legacyConference(conf, displayName):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    if displayName:
+        setattr(cf, 'organizerDisplayName', displayName)
+    cf.check_initialized()
+    return cf
+
+
+def legacySession(session):
+    cf = SessionForm()
+    for field in cf.all_fields():
+        if hasattr(session, field.name):
+            if field.name == "date":
+                setattr(cf, field.name, str(getattr(session, field.name)))
+            elif field.name == "startTime":
+                setattr(cf, field.name, str(getattr(session, field.name)))
+            elif field.name == "c_websafeKey":
+                setattr(cf, field.name, getattr(session, field.name))
+            elif getattr(session, field.name) == None:
+                setattr(cf, field.name, 'Default')
+            else:
+                setattr(cf, field.name, getattr(session, field.name))
+    cf.check_initialized()
+    return cf
+
+
+def legacyProfile(prof):
+    pf = ProfileForm()
+    for field in pf.all_fields():
+        if hasattr(prof, field.name):
+            if field.name == 'teeShirtSize':
+                setattr(pf, field.name,
+                        getattr(TeeShirtSize, getattr(prof, field.name)))
+            else:
+                setattr(pf, field.name, getattr(prof, field.name))
+    pf.check_initialized()
+    return pf
+
+
+# - - - synthetic entities - - - - - - - - - - - - - - - - - - -
+
+def makeEntities(n):
+    confs, sessions, profiles = [], [], []
+    for i in range(n):
+        p_key = ndb.Key(Profile, 'user%d' % i)
+        c_key = ndb.Key(Conference, i + 1, parent=p_key)
+        s_key = ndb.Key(Session, i + 1, parent=c_key)
+        confs.append(Conference(
+            key=c_key, name='Conference %d' % i, description='x' * 200,
+            organizerUserId='user%d' % i, topics=['Web', 'Cloud'],
+            city='London', startDate=date(2016, 1 + i % 12, 1), month=1 + i % 12,
+            endDate=date(2016, 1 + i % 12, 3), maxAttendees=100,
+            seatsAvailable=50))
+        sessions.append(Session(
+            key=s_key, sessionName='Session %d' % i, highlights=None,
+            duration='60', speaker='Speaker %d' % (i % 50),
+            sessionType='LECTURE', startTime=dtime(9 + i % 8, 30),
+            date=date(2016, 1, 2), c_websafeKey=c_key.urlsafe(),
+            sessionWebSafeKey=s_key.urlsafe()))
+        profiles.append(Profile(
+            key=p_key, displayName='User %d' % i,
+            mainEmail='user%d@example.com' % i, teeShirtSize='M_M'))
+    return confs, sessions, profiles
+
+
+def timeit(fn, items):
+    start = time.time()
+    out = [fn(item) for item in items]
+    return (time.time() - start) / len(items) * 1e6, out
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    api = ConferenceApi()
+    confs, sessions, profiles = makeEntities(n)
+
+    cases = [
+        ('Conference', confs,
+         lambda c: legacyConference(c, 'Organizer'),
+         lambda c: api._copyConferenceToForm(c, 'Organizer')),
+        ('Session', sessions, legacySession, api._copySessionToForm),
+        ('Profile', profiles, legacyProfile, api._copyProfileToForm),
+    ]
+    print '%d entities per kind' % n
+    print '%-12s %14s %14s %8s' % ('kind', 'before us/item', 'after us/item',
+                                   'speedup')
+    for kind, items, before, after in cases:
+        t_before, old = timeit(before, items)
+        t_after, new = timeit(after, items)
+        assert old == new, '%s copies differ' % kind
+        print '%-12s %14.2f %14.2f %7.1fx' % (kind, t_before, t_after,
+                                              t_before / t_after)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""bench_session_snapshot.py
+
+Latency of session queries on one large conference: querySessions on
+the memcache session snapshot (warm, and cold after the snapshot is
+dropped) against the datastore ancestor queries it replaces.
+
+usage: GAE_SDK=/path/to/google_appengine python benchmarks/bench_session_snapshot.py [N]
+
+Creates one conference with N (default 1000) sessions through
+createSessions, then times each case and prints p50/p95 latency and
+datastore RPCs per call.
+
+"""
+
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import harness
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import conference
+from conference import ConferenceApi
+from models import ConferenceForm, Session, SessionForm
+import seed
+import session_snapshot
+
+CALLS = 50
+PREDICATES = [
+    'NOT sessionType = WORKSHOP AND startTime < 19:00',
+    'speaker = "Speaker 3" OR (duration >= 90 AND date >= 2016-06-01)',
+    'sessionType = LECTURE',
+]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[int(round(pct / 100.0 * (len(values) - 1)))]
+
+
+def timeit(env, fn, before=None):
+    latencies, rpcs = [], []
+    for _ in range(CALLS):
+        if before:
+            before()
+        env.counter.reset()
+        start = time.time()
+        fn()
+        latencies.append((time.time() - start) * 1000)
+        rpcs.append(env.counter.datastoreCalls())
+    return (percentile(latencies, 50), percentile(latencies, 95),
+            float(sum(rpcs)) / len(rpcs))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rng = random.Random(42)
+    env = harness.Environment()
+    try:
+        api = ConferenceApi()
+        env.login('organizer@example.com')
+        wsck = api.createConference(ConferenceForm(
+            name='Big conference', city='London', startDate='2016-01-01',
+            endDate='2016-12-31', maxAttendees=1000)).websafeKey
+        c_key = ndb.Key(urlsafe=wsck)
+        for first in range(0, n, conference.MAX_SESSION_BATCH):
+            size = min(conference.MAX_SESSION_BATCH, n - first)
+            api.createSessions(conference.SESSION_BATCH_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck,
+                items=[SessionForm(
+                    sessionName='Session %d' % (first + i),
+                    highlights='Highlights of session %d' % (first + i),
+                    duration=str(rng.choice([30, 45, 60, 90])),
+                    speaker='Speaker %d' % rng.randint(0, 49),
+                    sessionType=rng.choice(seed.SESSION_TYPES),
+                    startTime='%02d:%02d' % (rng.randint(8, 20), rng.choice([0, 30])),
+                    date=str(date(2016, 1, 1) + timedelta(days=rng.randint(0, 365))))
+                    for i in range(size)]))
+        env.runTasks()
+
+        request = conference.SESSION_QUERY_REQUEST.combined_message_class
+        drop = lambda: memcache.delete(session_snapshot.MEMCACHE_SNAPSHOT_KEY % wsck)
+        cases = [
+            ('datastore: all sessions',
+             lambda: Session.query(ancestor=c_key).fetch(), None),
+            ('datastore: by type',
+             lambda: Session.query(ancestor=c_key).filter(
+                 Session.sessionType == 'LECTURE').fetch(), None),
+        ]
+        for predicate in PREDICATES:
+            call = lambda p=predicate: api.querySessions(
+                request(websafeConferenceKey=wsck, where=p))
+            cases.append(('snapshot cold: %s' % predicate, call, drop))
+            cases.append(('snapshot warm: %s' % predicate, call, None))
+
+        print '%d sessions, %d calls per case' % (n, CALLS)
+        print '%-80s %8s %8s %6s' % ('case', 'p50 ms', 'p95 ms', 'rpcs')
+        for name, fn, before in cases:
+            p50, p95, rpcs = timeit(env, fn, before)
+            print '%-80s %8.2f %8.2f %6.1f' % (name[:80], p50, p95, rpcs)
+    finally:
+        env.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""bench_user_id.py
+
+Latency of utils.getUserId for oauth and custom user ids: a token
+verified locally against the (stub) signing keys, then found in memcache,
+then in the instance cache; and an email mapped to its id for the first
+time, from the datastore and from the instance cache.
+
+usage: GAE_SDK=/path/to/google_appengine python benchmarks/bench_user_id.py [N]
+
+Uses N (default 200) users and prints p50/p95 latency, RPCs per call and
+how often the signing keys were fetched.
+
+"""
+
+import sys
+import time
+
+import harness
+
+from google.appengine.api import memcache
+from google.appengine.api import users
+
+import utils
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[int(round(pct / 100.0 * (len(values) - 1)))]
+
+
+def timeit(env, calls, before=None):
+    latencies, rpcs = [], []
+    for fn in calls:
+        if before:
+            before()
+        env.counter.reset()
+        start = time.time()
+        fn()
+        latencies.append((time.time() - start) * 1000)
+        rpcs.append(sum(env.counter.calls.values()))
+    return (percentile(latencies, 50), percentile(latencies, 95),
+            float(sum(rpcs)) / len(rpcs))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    env = harness.Environment()
+    try:
+        certificates = env.useStubCertificates()
+        tokens = [certificates.idToken('sub-%d' % i, 'user%d@example.com' % i)
+                  for i in range(n)]
+        emails = ['user%d@example.com' % i for i in range(n)]
+
+        def oauth(token):
+            def call():
+                env.sendIdToken(token)
+                assert utils.getUserId(None, id_type='oauth')
+            return call
+
+        def custom(email):
+            return lambda: utils.getUserId(users.User(email), id_type='custom')
+
+        cases = [
+            ('oauth: verified locally', [oauth(t) for t in tokens],
+             lambda: (utils._tokenUsers.clear(), memcache.flush_all())),
+            ('oauth: memcache', [oauth(t) for t in tokens],
+             utils._tokenUsers.clear),
+            ('oauth: instance cache', [oauth(t) for t in tokens], None),
+            ('custom: new mapping', [custom(e) for e in emails], None),
+            ('custom: datastore', [custom(e) for e in emails],
+             utils._emailUsers.clear),
+            ('custom: instance cache', [custom(e) for e in emails], None),
+        ]
+
+        print '%d users' % n
+        print '%-30s %8s %8s %6s' % ('case', 'p50 ms', 'p95 ms', 'rpcs')
+        for name, calls, before in cases:
+            p50, p95, rpcs = timeit(env, calls, before)
+            print '%-30s %8.2f %8.2f %6.1f' % (name, p50, p95, rpcs)
+        print 'signing key fetches: %d' % certificates.fetches
+    finally:
+        env.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""harness.py
+
+Offline App Engine environment for the benchmarks: puts the SDK and the
+app on sys.path, activates testbed datastore/memcache/taskqueue stubs,
+signs users in for endpoints calls, runs queued tasks through main.app
+and counts the RPCs each call makes. The stubs answer at once, and only
+when an RPC is waited on; setRpcLatency() makes each RPC finish no
+sooner than a fixed delay after it was issued, so RPCs issued together
+pay the delay once, as they would in production. StubCertificates
+stands in for
+Google's id_token signing keys, so oauth user ids resolve offline.
+
+Set GAE_SDK to the google_appengine SDK directory (default
+/usr/local/google_appengine).
+
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+
+SDK = os.environ.get('GAE_SDK', '/usr/local/google_appengine')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setupPaths():
+    """Make the SDK, its bundled libraries and the app importable."""
+    if ROOT in sys.path:
+        return
+    sys.path[0:0] = [SDK, ROOT]
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    os.environ.setdefault('APPLICATION_ID', 'dev~conference-bench')
+
+setupPaths()
+
+from google.appengine.api import apiproxy_rpc
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import webapp2
+
+
+class RpcCounter(object):
+    """Counts RPCs and the entities they move, per service and call."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.entitiesRead = 0
+        self.entitiesWritten = 0
+        self.memcacheHits = 0
+        self.memcacheMisses = 0
+        self.tasksAdded = 0
+
+    def datastoreCalls(self):
+        return sum(n for (service, call), n in self.calls.items()
+                   if service == 'datastore_v3')
+
+    def __call__(self, service, call, request, response):
+        self.calls[(service, call)] = self.calls.get((service, call), 0) + 1
+        if service == 'datastore_v3':
+            if call == 'Get':
+                self.entitiesRead += sum(1 for e in response.entity_list()
+                                         if e.has_entity())
+            elif call in ('RunQuery', 'Next'):
+                self.entitiesRead += response.result_size()
+            elif call == 'Put':
+                self.entitiesWritten += request.entity_size()
+            elif call == 'Delete':
+                self.entitiesWritten += request.key_size()
+        elif service == 'memcache' and call == 'Get':
+            hits = response.item_size()
+            self.memcacheHits += hits
+            self.memcacheMisses += request.key_size() - hits
+        elif service == 'taskqueue' and call == 'BulkAdd':
+            self.tasksAdded += request.add_request_size()
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _b64number(n):
+    hex_digits = '%x' % n
+    return _b64(('0' * (len(hex_digits) % 2) + hex_digits).decode('hex'))
+
+
+class StubCertificates(object):
+    """Certificate source for id_tokens.setCertificateSource() with a key
+    generated here; idToken() signs tokens that verify against it."""
+
+    KID = 'stub'
+
+    def __init__(self, max_age=3600):
+        from Crypto.PublicKey import RSA
+        self.key = RSA.generate(2048)
+        self.max_age = max_age
+        self.fetches = 0
+
+    def __call__(self):
+        self.fetches += 1
+        return {'keys': [{'kty': 'RSA', 'alg': 'RS256', 'use': 'sig',
+                          'kid': self.KID, 'n': _b64number(self.key.n),
+                          'e': _b64number(self.key.e)}]}, self.max_age
+
+    def idToken(self, sub, email, aud=None, lifetime=3600,
+                iss='accounts.google.com', kid=None):
+        """Return a signed id_token for the user."""
+        from Crypto.Hash import SHA256
+        from Crypto.Signature import PKCS1_v1_5
+        from settings import WEB_CLIENT_ID
+        now = int(time.time())
+        header = {'alg': 'RS256', 'kid': kid or self.KID, 'typ': 'JWT'}
+        claims = {'iss': iss, 'aud': aud or WEB_CLIENT_ID,
+                  'sub': sub, 'email': email, 'iat': now,
+                  'exp': now + lifetime}
+        signing_input = '%s.%s' % (_b64(json.dumps(header)),
+                                   _b64(json.dumps(claims)))
+        signature = PKCS1_v1_5.new(self.key).sign(SHA256.new(signing_input))
+        return '%s.%s' % (signing_input, _b64(signature))
+
+
+class Environment(object):
+    """An activated testbed with RPC counting; deactivate() when done."""
+
+    def __init__(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # every write is visible to queries at once, like the ancestor
+        # queries the app relies on
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_urlfetch_stub()
+        self.testbed.init_user_stub()
+        self.testbed.init_search_stub()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().set_cache_policy(False)
+
+        self.counter = RpcCounter()
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'benchmark_counter', self.counter.__call__)
+
+    def deactivate(self):
+        self.setRpcLatency(0)
+        self.testbed.deactivate()
+
+    def setRpcLatency(self, seconds):
+        """Make every stub RPC take at least seconds from issue to result;
+        0 turns the delay off again."""
+        rpc_class = apiproxy_rpc.RPC
+        if not hasattr(rpc_class, '_undelayedMakeCall'):
+            rpc_class._undelayedMakeCall = rpc_class._MakeCallImpl
+            rpc_class._undelayedWait = rpc_class._WaitImpl
+        if not seconds:
+            rpc_class._MakeCallImpl = rpc_class._undelayedMakeCall
+            rpc_class._WaitImpl = rpc_class._undelayedWait
+            return
+
+        def makeCall(rpc):
+            rpc._issued = time.time()
+            rpc._undelayedMakeCall()
+
+        def wait(rpc):
+            remaining = getattr(rpc, '_issued', 0) + seconds - time.time()
+            if remaining > 0:
+                time.sleep(remaining)
+            return rpc._undelayedWait()
+        rpc_class._MakeCallImpl = makeCall
+        rpc_class._WaitImpl = wait
+
+    def login(self, email):
+        """Make endpoints.get_current_user() return this user."""
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+        os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+        os.environ['USER_EMAIL'] = email
+        os.environ['USER_IS_ADMIN'] = '1'
+
+    def useStubCertificates(self):
+        """Verify id_tokens against a StubCertificates; returns it."""
+        import id_tokens
+        certificates = StubCertificates()
+        id_tokens.setCertificateSource(certificates)
+        return certificates
+
+    def sendIdToken(self, token):
+        """Send token as the bearer token of the next calls."""
+        os.environ['HTTP_AUTHORIZATION'] = 'Bearer %s' % token
+
+    def runTasks(self, app=None):
+        """Run queued push tasks through main.app until none are left."""
+        if app is None:
+            import main
+            app = main.app
+        ran = 0
+        while True:
+            tasks = self.taskqueue.get_filtered_tasks()
+            if not tasks:
+                return ran
+            for task in tasks:
+                # tasks read back from the stub only name their queue in
+                # a header
+                queue_name = dict(task.headers).get('X-AppEngine-QueueName',
+                                                    'default')
+                self.taskqueue.DeleteTask(queue_name, task.name)
+                url = task.url
+                body = task.payload or ''
+                if task.method in ('GET', 'DELETE') and body:
+                    url = '%s?%s' % (url, body)
+                    body = ''
+                request = webapp2.Request.blank(url, method=task.method,
+                                                body=body)
+                request.headers.update(dict(task.headers))
+                request.headers['X-AppEngine-TaskName'] = task.name
+                request.get_response(app)
+                ran += 1
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+
+"""run.py
+
+Endpoint benchmark: seeds a synthetic data set in the testbed stubs, calls
+every ConferenceApi method many times with realistic (Zipf-skewed)
+arguments and reports per method the p50/p95/p99 latency, datastore RPCs
+and entities read/written per call.
+
+usage: GAE_SDK=/path/to/google_appengine python benchmarks/run.py \\
+           [--calls 200] [--conferences 100] ... [--json out.json] \\
+           [--compare baseline.json] [--rpc-latency 5]
+
+With --compare, methods whose p95 latency or datastore RPCs per call grew
+by more than --tolerance over the baseline are listed and the exit status
+is 1, so the suite can guard hot paths such as queryConferences and
+registration.
+
+With --rpc-latency, every RPC takes that many ms from issue to result
+(the stubs otherwise answer at once), which shows what overlapping
+independent RPCs with futures saves.
+
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+
+import harness
+
+import endpoints
+from protorpc import message_types
+
+import conference
+from conference import ConferenceApi
+from models import ConferenceForm, ConferenceQueryForm, ConferenceQueryForms
+from models import ProfileMiniForm, SessionForm
+
+import seed
+
+
+def request(container, **kwargs):
+    """Build the combined request message of a ResourceContainer."""
+    return container.combined_message_class(**kwargs)
+
+
+# - - - what each benchmarked call does - - - - - - - - - - - - - - -
+# each scenario takes (api, data) and makes one call; the signed-in user
+# is picked by the scenario
+
+def _asUser(data):
+    data.env.login(data.user())
+
+
+def getConferencesToAttend(api, data):
+    _asUser(data)
+    api.getConferencesToAttend(message_types.VoidMessage())
+
+
+def registerForConference(api, data):
+    _asUser(data)
+    api.registerForConference(request(conference.CONF_GET_REQUEST,
+        websafeConferenceKey=data.conference()))
+
+
+def unregisterFromConference(api, data):
+    _asUser(data)
+    api.unregisterFromConference(request(conference.CONF_GET_REQUEST,
+        websafeConferenceKey=data.conference()))
+
+
+def getConferenceAttendees(api, data):
+    wsck = data.conference()
+    data.env.login(data.organizer(wsck))
+    api.getConferenceAttendees(request(conference.ATTENDEES_REQUEST,
+        websafeConferenceKey=wsck))
+
+
+def getWaitlistPosition(api, data):
+    data.env.login(data.waitingUser())
+    api.getWaitlistPosition(request(conference.CONF_GET_REQUEST,
+        websafeConferenceKey=data.waitlist[0]))
+
+
+def setConferenceCapacity(api, data):
+    wsck = data.conference()
+    data.env.login(data.organizer(wsck))
+    # more seats than any seeded conference has attendees, so the change
+    # never conflicts; new seats go to the waitlist first
+    api.setConferenceCapacity(request(conference.CAPACITY_REQUEST,
+        websafeConferenceKey=wsck, maxAttendees=data.rng.choice([500, 1000])))
+
+
+def getConference(api, data):
+    api.getConference(request(conference.CONF_GET_REQUEST,
+        websafeConferenceKey=data.conference()))
+
+
+def getProfile(api, data):
+    _asUser(data)
+    api.getProfile(message_types.VoidMessage())
+
+
+def saveProfile(api, data):
+    _asUser(data)
+    api.saveProfile(ProfileMiniForm(
+        displayName='Renamed %d' % data.rng.randint(0, 10 ** 6)))
+
+
+def createConference(api, data):
+    _asUser(data)
+    api.createConference(ConferenceForm(
+        name='Bench conference %d' % data.rng.randint(0, 10 ** 6),
+        city=data.rng.choice(seed.CITIES), topics=['Web'],
+        startDate='2016-06-01', endDate='2016-06-02', maxAttendees=100))
+
+
+def queryConferences(api, data):
+    filters = data.rng.choice([
+        [],
+        [ConferenceQueryForm(field='CITY', operator='EQ',
+                             value=data.rng.choice(seed.CITIES))],
+        [ConferenceQueryForm(field='CITY', operator='EQ',
+                             value=data.rng.choice(seed.CITIES)),
+         ConferenceQueryForm(field='MONTH', operator='EQ',
+                             value=str(data.rng.randint(1, 12))),
+         ConferenceQueryForm(field='TOPIC', operator='EQ',
+                             value=data.rng.choice(seed.TOPICS))],
+    ])
+    api.queryConferences(ConferenceQueryForms(filters=filters))
+
+
+def getConferencesCreated(api, data):
+    data.env.login(data.organizer(data.conference()))
+    api.getConferencesCreated(request(conference.CONF_CREATED_REQUEST))
+
+
+def createSession(api, data):
+    wsck = data.conference()
+    data.env.login(data.organizer(wsck))
+    api.createSession(SessionForm(
+        sessionName='Bench session', speaker=data.speaker(),
+        sessionType=data.rng.choice(seed.SESSION_TYPES), duration='60',
+        startTime='10:00', date='2016-06-01', c_websafeKey=wsck))
+
+
+def createSessions(api, data):
+    wsck = data.conference()
+    data.env.login(data.organizer(wsck))
+    api.createSessions(request(conference.SESSION_BATCH_REQUEST,
+        websafeConferenceKey=wsck,
+        items=[SessionForm(
+            sessionName='Bench session %d' % i, speaker=data.speaker(),
+            sessionType=data.rng.choice(seed.SESSION_TYPES), duration='60',
+            startTime='10:00', date='2016-06-01') for i in range(50)]))
+
+
+def getConferenceSessions(api, data):
+    api.getConferenceSessions(request(conference.SESSION_LIST_REQUEST,
+        websafeConferenceKey=data.conference()))
+
+
+def getConferenceSessionsByType(api, data):
+    api.getConferenceSessionsByType(request(conference.SES_TYPE_GET_REQUEST,
+        websafeConferenceKey=data.conference(),
+        type=data.rng.choice(seed.SESSION_TYPES)))
+
+
+def querySessions(api, data):
+    api.querySessions(request(conference.SESSION_QUERY_REQUEST,
+        websafeConferenceKey=data.conference(),
+        where='NOT sessionType = WORKSHOP AND startTime < 19:00'))
+
+
+def getSessionsBySpeaker(api, data):
+    api.getSessionsBySpeaker(request(conference.SES_SPEAKER_GET_REQUEST,
+        speaker=data.speaker()))
+
+
+def addSessionToWishlist(api, data):
+    email, s_key = data.user(), data.session()
+    data.env.login(email)
+    api.addSessionToWishlist(request(conference.SESSION_WISH_REQUEST,
+        sessionKey=s_key))
+    data.wishlists.append((email, s_key))
+
+
+def removeSessionFromWishlist(api, data):
+    # a session the user has on their wishlist, so it is really removed
+    email, s_key = data.wishlisted()
+    data.env.login(email)
+    api.removeSessionFromWishlist(request(conference.SESSION_WISH_REQUEST,
+        sessionKey=s_key))
+
+
+def getSessionsInWishList(api, data):
+    _asUser(data)
+    api.getSessionsInWishList(request(conference.WISHLIST_REQUEST))
+
+
+def sessionTypeBySpeaker(api, data):
+    _asUser(data)
+    api.sessionTypeBySpeaker(request(conference.SESSION_TYPE_SPEAKER,
+        sessionType=data.rng.choice(seed.SESSION_TYPES),
+        speakerName=data.speaker()))
+
+
+def allConferenceSessionsOfSpeaker(api, data):
+    _asUser(data)
+    api.allConferenceSessionsOfSpeaker(request(
+        conference.CONFERENCE_SESSION_SPEAKER,
+        conferencewebsafekey=data.conference(), speakerName=data.speaker()))
+
+
+def getFeaturedSpeaker(api, data):
+    api.getFeaturedSpeaker(request(conference.CONF_GET_REQUEST,
+        websafeConferenceKey=data.conference()))
+
+
+def searchConferences(api, data):
+    api.searchConferences(request(conference.SEARCH_REQUEST,
+        query=data.rng.choice(seed.TOPICS + seed.CITIES)))
+
+
+def searchSessions(api, data):
+    api.searchSessions(request(conference.SEARCH_REQUEST,
+        query=data.speaker()))
+
+
+def filterPlayground(api, data):
+    _asUser(data)
+    api.filterPlayground(message_types.VoidMessage())
+
+
+SCENARIOS = [
+    getConferencesToAttend,
+    registerForConference,
+    unregisterFromConference,
+    getConferenceAttendees,
+    getWaitlistPosition,
+    setConferenceCapacity,
+    getConference,
+    getProfile,
+    saveProfile,
+    createConference,
+    queryConferences,
+    getConferencesCreated,
+    createSession,
+    createSessions,
+    getConferenceSessions,
+    getConferenceSessionsByType,
+    querySessions,
+    getSessionsBySpeaker,
+    addSessionToWishlist,
+    removeSessionFromWishlist,
+    getSessionsInWishList,
+    sessionTypeBySpeaker,
+    allConferenceSessionsOfSpeaker,
+    getFeaturedSpeaker,
+    searchConferences,
+    searchSessions,
+    filterPlayground,
+]
+
+
+# - - - measuring and reporting - - - - - - - - - - - - - - - - - - -
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def measure(env, api, data, scenario, calls):
+    """Call one scenario repeatedly and summarise the calls."""
+    latencies, rpcs, reads, writes, errors = [], [], [], [], 0
+    for _ in range(calls):
+        env.counter.reset()
+        start = time.time()
+        try:
+            scenario(api, data)
+        except endpoints.ServiceException:
+            # conflicts (already registered, sold out, ...) are real
+            # traffic too; they are timed but also counted
+            errors += 1
+        latencies.append((time.time() - start) * 1000)
+        rpcs.append(env.counter.datastoreCalls())
+        reads.append(env.counter.entitiesRead)
+        writes.append(env.counter.entitiesWritten)
+        # tasks run outside the measured call, like on a real task queue
+        env.runTasks()
+    mean = lambda values: float(sum(values)) / len(values)
+    return {
+        'calls': calls,
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'datastore_rpcs': mean(rpcs),
+        'entities_read': mean(reads),
+        'entities_written': mean(writes),
+    }
+
+
+def report(results):
+    header = ('%-32s %6s %5s %8s %8s %8s %7s %7s %7s'
+              % ('method', 'calls', 'errs', 'p50 ms', 'p95 ms', 'p99 ms',
+                 'ds rpc', 'read', 'written'))
+    print header
+    print '-' * len(header)
+    for name in sorted(results):
+        r = results[name]
+        print ('%-32s %6d %5d %8.2f %8.2f %8.2f %7.1f %7.1f %7.1f'
+               % (name, r['calls'], r['errors'], r['p50_ms'], r['p95_ms'],
+                  r['p99_ms'], r['datastore_rpcs'], r['entities_read'],
+                  r['entities_written']))
+
+
+def compare(results, baseline, tolerance):
+    """Return descriptions of methods that got slower or chattier."""
+    regressions = []
+    for name, r in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ('p95_ms', 'datastore_rpcs'):
+            if r[metric] > base[metric] * (1 + tolerance) + 1e-9:
+                regressions.append('%s: %s %.2f -> %.2f'
+                                   % (name, metric, base[metric], r[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--profiles', type=int, default=200)
+    parser.add_argument('--conferences', type=int, default=100)
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--registrations', type=int, default=2000)
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', action='append',
+                        help='benchmark only this method (repeatable)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='baseline results (JSON) to check')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--rpc-latency', type=float, default=0,
+                        help='simulated ms per RPC, from issue to result')
+    args = parser.parse_args()
+
+    env = harness.Environment()
+    try:
+        random.seed(args.seed)
+        data = seed.seed(env, profiles=args.profiles,
+                         conferences=args.conferences,
+                         sessions=args.sessions,
+                         registrations=args.registrations,
+                         wishes=args.calls,
+                         zipf_s=args.zipf, rng_seed=args.seed)
+        env.setRpcLatency(args.rpc_latency / 1000.0)
+        api = ConferenceApi()
+        results = {}
+        for scenario in SCENARIOS:
+            if args.only and scenario.__name__ not in args.only:
+                continue
+            results[scenario.__name__] = measure(env, api, data, scenario,
+                                                 args.calls)
+    finally:
+        env.deactivate()
+
+    report(results)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print '\nregressions:'
+            for line in regressions:
+                print '  ' + line
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
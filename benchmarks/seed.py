@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""seed.py
+
+Synthetic data for the benchmarks. Profiles, conferences, sessions and
+registrations are created through ConferenceApi itself, so the seeded
+data has the same shape (shards, counters, ...) as production data.
+Conference popularity follows a Zipf distribution: a few conferences get
+most of the sessions and registrations, as during real ticket launches.
+Some sessions are on wishlists, and one more conference is sold out
+and has a waitlist. Everything seeded is written by the current code,
+so the backfills it would otherwise wait for are recorded as finished.
+
+"""
+
+import bisect
+import random
+from datetime import date, timedelta
+
+import harness
+
+import endpoints
+
+from conference import ConferenceApi, CONF_GET_REQUEST, SESSION_WISH_REQUEST
+from conference import ORGANIZER_NAMES_MIGRATION
+import migrations
+from models import ConferenceForm, ProfileMiniForm, SessionForm
+from speakers import MIGRATION as SPEAKERS_MIGRATION
+
+CITIES = ['London', 'Paris', 'Tokyo', 'Chicago', 'Berlin', 'Sydney',
+          'Toronto', 'Madrid']
+TOPICS = ['Web', 'Cloud', 'Mobile', 'Data', 'Security', 'Design',
+          'Python', 'Go']
+SESSION_TYPES = ['LECTURE', 'WORKSHOP', 'PANEL', 'KEYNOTE']
+
+
+class Zipf(object):
+    """Samples indexes 0..n-1 with probability proportional to 1/(i+1)**s."""
+
+    def __init__(self, n, s=1.1, rng=random):
+        self.rng = rng
+        total = 0.0
+        self.cumulative = []
+        for i in range(n):
+            total += 1.0 / (i + 1) ** s
+            self.cumulative.append(total)
+
+    def sample(self):
+        point = self.rng.random() * self.cumulative[-1]
+        return bisect.bisect_left(self.cumulative, point)
+
+
+class Dataset(object):
+    """What was seeded, and helpers to pick realistic call arguments."""
+
+    def __init__(self, env, rng):
+        self.env = env
+        self.rng = rng
+        self.users = []           # emails
+        self.conferences = []     # (websafe key, organizer email)
+        self.sessions = []        # (websafe key, conference websafe key)
+        self.speakers = []
+        self.popularity = None
+        # (websafe key, emails in the order they joined its waitlist)
+        self.waitlist = None
+        # (email, session websafe key) on that user's wishlist
+        self.wishlists = []
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def conference(self):
+        """A conference key, popular ones more often."""
+        return self.conferences[self.popularity.sample()][0]
+
+    def organizer(self, wsck):
+        return dict(self.conferences)[wsck]
+
+    def session(self):
+        return self.rng.choice(self.sessions)[0]
+
+    def speaker(self):
+        return self.rng.choice(self.speakers)
+
+    def waitingUser(self):
+        """A user on the waitlist of the sold-out conference."""
+        return self.rng.choice(self.waitlist[1])
+
+    def wishlisted(self):
+        """A user and a session on their wishlist, forgotten once picked."""
+        return self.wishlists.pop(self.rng.randrange(len(self.wishlists)))
+
+
+def seed(env, profiles=200, conferences=100, sessions=1000,
+         registrations=2000, speakers=150, waitlisted=50, wishes=200,
+         zipf_s=1.1, rng_seed=42):
+    """Create the data set and return a Dataset describing it."""
+    rng = random.Random(rng_seed)
+    data = Dataset(env, rng)
+    api = ConferenceApi()
+
+    for i in range(profiles):
+        email = 'user%d@example.com' % i
+        env.login(email)
+        api.saveProfile(ProfileMiniForm(displayName='User %d' % i))
+        data.users.append(email)
+
+    start = date(2016, 1, 1)
+    for i in range(conferences):
+        organizer = rng.choice(data.users)
+        env.login(organizer)
+        first = start + timedelta(days=rng.randint(0, 365))
+        form = api.createConference(ConferenceForm(
+            name='Conference %05d' % i,
+            description='Synthetic conference %d. ' % i * 5,
+            topics=rng.sample(TOPICS, 2),
+            city=rng.choice(CITIES),
+            startDate=str(first),
+            endDate=str(first + timedelta(days=rng.randint(0, 3))),
+            maxAttendees=rng.choice([50, 100, 500, 1000])))
+        data.conferences.append((form.websafeKey, organizer))
+    # most recently created conferences are not necessarily the popular
+    # ones: shuffle before ranking
+    rng.shuffle(data.conferences)
+    data.popularity = Zipf(len(data.conferences), zipf_s, rng)
+
+    data.speakers = ['Speaker %d' % i for i in range(speakers)]
+    speaker_popularity = Zipf(speakers, zipf_s, rng)
+    for i in range(sessions):
+        wsck = data.conference()
+        env.login(data.organizer(wsck))
+        form = api.createSession(SessionForm(
+            sessionName='Session %d' % i,
+            highlights='Highlights of session %d' % i,
+            duration=str(rng.choice([30, 45, 60, 90])),
+            speaker=data.speakers[speaker_popularity.sample()],
+            sessionType=rng.choice(SESSION_TYPES),
+            startTime='%02d:%02d' % (rng.randint(8, 20), rng.choice([0, 30])),
+            date=str(start + timedelta(days=rng.randint(0, 365))),
+            c_websafeKey=wsck))
+        data.sessions.append((form.sessionWebSafeKey, wsck))
+
+    request_class = CONF_GET_REQUEST.combined_message_class
+    for i in range(registrations):
+        env.login(data.user())
+        try:
+            api.registerForConference(
+                request_class(websafeConferenceKey=data.conference()))
+        except endpoints.ServiceException:
+            # already registered or sold out; both happen in real traffic
+            pass
+
+    wishes = min(wishes, len(data.users) * len(data.sessions))
+    while len(data.wishlists) < wishes:
+        email, s_key = data.user(), data.session()
+        if (email, s_key) not in data.wishlists:
+            env.login(email)
+            api.addSessionToWishlist(
+                SESSION_WISH_REQUEST.combined_message_class(sessionKey=s_key))
+            data.wishlists.append((email, s_key))
+
+    # a sold-out conference with a waitlist; it is not in data.conferences,
+    # so registration traffic never promotes anyone off it
+    waiting = data.users[:waitlisted + 1]
+    env.login(waiting[0])
+    form = api.createConference(ConferenceForm(
+        name='Sold out', topics=['Web'], city=CITIES[0],
+        startDate=str(start), endDate=str(start), maxAttendees=1))
+    for email in waiting:
+        env.login(email)
+        api.registerForConference(
+            request_class(websafeConferenceKey=form.websafeKey))
+    data.waitlist = (form.websafeKey, waiting[1:])
+
+    env.runTasks()
+    for name in (ORGANIZER_NAMES_MIGRATION, SPEAKERS_MIGRATION):
+        migrations.finish(name)
+    return data
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+"""build_static.py
+
+Builds the web client's static assets for deployment:
+
+- the stylesheets and scripts between <!-- build:css --> or
+  <!-- build:js --> and <!-- endbuild --> in templates/index.src.html are
+  concatenated and minified into one file each;
+- the Angular partials are put into $templateCache by the script bundle,
+  so views and the login modal need no request of their own;
+- the bundles are written to static/dist with a hash of their content in
+  the file name, which app.yaml serves with a far-future expiration;
+- templates/index.html is written from the source template, loading the
+  bundles instead of the separate files.
+
+usage: python build_static.py
+
+Prints the bytes (and gzipped bytes) and requests for local assets before
+and after. The minifiers are deliberately conservative: they drop
+comments and indentation but keep line breaks, so the scripts never
+depend on semicolon insertion working differently.
+
+"""
+
+from __future__ import print_function
+
+import glob
+import gzip
+import hashlib
+import io
+import json
+import os
+import posixpath
+import re
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE_TEMPLATE = 'templates/index.src.html'
+TEMPLATE = 'templates/index.html'
+DIST_DIR = 'static/dist'
+DIST_URL = '/dist'
+PARTIALS = 'static/partials/*.html'
+PARTIALS_URL = '/partials'
+# url prefixes of the static_dir handlers in app.yaml
+STATIC_DIRS = {
+    '/css/': 'static/bootstrap/css/',
+    '/js/': 'static/js/',
+    '/partials/': 'static/partials/',
+}
+
+BLOCK = re.compile(r'[ \t]*<!-- build:(css|js) -->\n(.*?)[ \t]*<!-- endbuild -->\n',
+                   re.S)
+ASSET = re.compile(r'(?:href|src)="(/[^/][^"]*)"')
+SOURCE_NOTE = re.compile(r'<!-- Source of templates/index.html:.*?-->')
+
+
+def _path(url):
+    """Return the file served at a local static url."""
+    for prefix, directory in STATIC_DIRS.items():
+        if url.startswith(prefix):
+            return os.path.join(ROOT, directory, url[len(prefix):])
+    raise ValueError('not a static file: %s' % url)
+
+
+def _read(path):
+    with io.open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def _gzipped(data):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as f:
+        f.write(data)
+    return len(out.getvalue())
+
+
+# - - - minifiers - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+# a / after one of these starts a regular expression, not a division
+_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^\n')
+
+
+def minifyJs(text):
+    """Drop comments, indentation and blank lines, leaving strings and
+    regular expressions alone."""
+    out, i, n = [], 0, len(text)
+    last = '\n'
+    while i < n:
+        c = text[i]
+        if c in '"\'':
+            end = i + 1
+            while end < n and text[end] != c:
+                end += 2 if text[end] == '\\' else 1
+            out.append(text[i:end + 1])
+            i = end + 1
+        elif text.startswith('//', i):
+            i = text.find('\n', i)
+            i = n if i < 0 else i
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            out.append(' ')
+        elif c == '/' and last in _REGEX_PRECEDERS:
+            end, in_class = i + 1, False
+            while end < n and (text[end] != '/' or in_class):
+                if text[end] == '\\':
+                    end += 1
+                elif text[end] == '[':
+                    in_class = True
+                elif text[end] == ']':
+                    in_class = False
+                end += 1
+            out.append(text[i:end + 1])
+            i = end + 1
+        else:
+            out.append(c)
+            i += 1
+        if out and out[-1].strip():
+            last = out[-1].rstrip()[-1]
+        elif out and '\n' in out[-1]:
+            last = '\n'
+    lines = (line.strip() for line in ''.join(out).split('\n'))
+    return '\n'.join(line for line in lines if line) + '\n'
+
+
+def minifyCss(text, url):
+    """Drop comments and extra whitespace; relative url()s are made
+    absolute, as the bundle is served from another directory."""
+    base = posixpath.dirname(url)
+
+    def absolute(match):
+        quote, target = match.group(1), match.group(2)
+        if re.match(r'^(/|data:|[a-z]+:)', target):
+            return match.group(0)
+        path = re.split(r'[?#]', target, 1)[0]
+        return 'url(%s%s%s%s)' % (quote, posixpath.normpath(
+            posixpath.join(base, path)), target[len(path):], quote)
+
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'''url\((['"]?)([^'")]+)\1\)''', absolute, text)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r' ?([{};,]) ?', r'\1', text)
+    text = re.sub(r': ', ':', text)
+    text = text.replace(';}', '}')
+    return text.strip() + '\n'
+
+
+def minifyHtml(text):
+    """Drop comments and indentation from a partial."""
+    text = re.sub(r'<!--.*?-->', '', text, flags=re.S)
+    lines = (line.strip() for line in text.split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+# - - - bundles - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def cssBundle(urls):
+    parts = [minifyCss(_read(_path(url)), url) for url in urls]
+    css = ''.join(parts)
+    # @import only works at the top of a stylesheet
+    imports = re.findall(r'@import [^;]+;', css)
+    return ''.join(imports) + re.sub(r'@import [^;]+;', '', css)
+
+
+def partialsScript(paths):
+    """Return a script putting the partials into Angular's $templateCache,
+    under the urls the routes and the login modal ask for."""
+    puts = ['$templateCache.put(%s,%s);' % (
+        json.dumps('%s/%s' % (PARTIALS_URL, os.path.basename(path))),
+        json.dumps(minifyHtml(_read(path))))
+        for path in paths]
+    return ("angular.module('conferenceApp').run(['$templateCache',"
+            "function($templateCache){\n%s\n}]);\n" % '\n'.join(puts))
+
+
+def jsBundle(urls, partials):
+    return ''.join(minifyJs(_read(_path(url))) for url in urls) + \
+        partialsScript(partials)
+
+
+def _write(name, ext, content):
+    data = content.encode('utf-8')
+    digest = hashlib.sha1(data).hexdigest()[:12]
+    filename = '%s.%s.%s' % (name, digest, ext)
+    with open(os.path.join(ROOT, DIST_DIR, filename), 'wb') as f:
+        f.write(data)
+    return '%s/%s' % (DIST_URL, filename), data
+
+
+def build():
+    """Write the bundles and index.html; return the size report."""
+    source = _read(os.path.join(ROOT, SOURCE_TEMPLATE))
+    partials = sorted(glob.glob(os.path.join(ROOT, PARTIALS)))
+
+    dist = os.path.join(ROOT, DIST_DIR)
+    if not os.path.isdir(dist):
+        os.makedirs(dist)
+    for old in glob.glob(os.path.join(dist, 'app.*')):
+        os.remove(old)
+
+    before, after = [], []
+    for path in partials:
+        with open(path, 'rb') as f:
+            before.append(f.read())
+
+    def replace(match):
+        kind, urls = match.group(1), ASSET.findall(match.group(2))
+        for url in urls:
+            with open(_path(url), 'rb') as f:
+                before.append(f.read())
+        indent = re.match(r'[ \t]*', match.group(0)).group(0)
+        if kind == 'css':
+            url, data = _write('app', 'css', cssBundle(urls))
+            tag = '<link rel="stylesheet" href="%s">' % url
+        else:
+            url, data = _write('app', 'js', jsBundle(urls, partials))
+            tag = '<script src="%s"></script>' % url
+        after.append(data)
+        return '%s%s\n' % (indent, tag)
+
+    html = BLOCK.sub(replace, source)
+    html = SOURCE_NOTE.sub('<!-- Generated from templates/index.src.html by '
+                           'build_static.py; do not edit. -->', html)
+    with io.open(os.path.join(ROOT, TEMPLATE), 'w', encoding='utf-8') as f:
+        f.write(html)
+
+    return [(label, len(files), sum(len(data) for data in files),
+             sum(_gzipped(data) for data in files))
+            for label, files in (('before', before), ('after', after))]
+
+
+def main():
+    print('%-8s %9s %10s %10s' % ('', 'requests', 'bytes', 'gzipped'))
+    for label, requests, size, gzipped in build():
+        print('%-8s %9d %10d %10d' % (label, requests, size, gzipped))
+
+
+if __name__ == '__main__':
+    main()
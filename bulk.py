@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+
+"""bulk.py
+
+Admin bulk import and export of Conference and Session entities, as
+JSONL (one JSON object per line) or CSV with a header row; CSV topics
+are separated by ';'.
+
+An upload is parsed as it is read into BulkChunk entities of a BulkJob,
+each written once it holds CHUNK_BYTES of JSON (or CHUNK_ROWS rows), so
+no chunk nears the 1MB entity limit. A task then imports the rows,
+BATCH_SIZE per put_multi. After each batch the job records the next row
+to import, so when the task nears its deadline it queues itself again
+and carries on from there; a job whose chunk has gone missing fails
+rather than being retried forever. Rows get the same defaults and date
+parsing as the createConference and createSession endpoints, and keys
+derived from the job and row number (or the websafe key of an exported
+row, which must be a key of this app, of the right kind and with the
+right parent), so a retried batch never imports a row twice.
+
+Exports walk a query with a cursor, EXPORT_LIMIT rows per request, and
+hand back the cursor of the next page.
+
+"""
+
+import csv
+import json
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from models import BulkChunk, BulkJob, Conference, Profile, Session
+import query_cache
+import search_index
+import seats
+
+KINDS = {'Conference': Conference, 'Session': Session}
+FORMATS = ('jsonl', 'csv')
+FIELDS = {
+    'Conference': ('websafeKey', 'name', 'description', 'organizerUserId',
+                   'topics', 'city', 'startDate', 'endDate', 'maxAttendees',
+                   'seatsAvailable'),
+    'Session': ('sessionWebSafeKey', 'c_websafeKey', 'sessionName',
+                'highlights', 'duration', 'speaker', 'sessionType', 'date',
+                'startTime'),
+}
+INTEGER_FIELDS = ('maxAttendees', 'seatsAvailable')
+
+# rows are compressed once stored, but a chunk must stay under the 1MB
+# entity limit even if they don't compress
+CHUNK_BYTES = 512 * 1024
+CHUNK_ROWS = 500
+BATCH_SIZE = 100
+# task requests may run for 10 minutes; leave room for the last batch
+TIME_BUDGET = 480
+MAX_ERRORS = 100
+EXPORT_BATCH = 200
+EXPORT_LIMIT = 5000
+
+
+# - - - import - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def parseRows(body, fmt):
+    """Yield the rows of an upload (a file-like object) as dicts;
+    ValueError for a bad line."""
+    if fmt == 'jsonl':
+        for n, line in enumerate(body, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise ValueError('line %d is not valid JSON' % n)
+            if not isinstance(row, dict):
+                raise ValueError('line %d is not a JSON object' % n)
+            yield row
+    else:
+        for row in csv.DictReader(body):
+            row = dict((k, v.decode('utf-8')) for k, v in row.items()
+                       if k and v not in (None, ''))
+            if 'topics' in row:
+                row['topics'] = [t.strip() for t in row['topics'].split(';')
+                                 if t.strip()]
+            yield row
+
+
+def startImport(kind, fmt, body):
+    """Store an upload (a file-like object) as a BulkJob with its chunks
+    and queue its import."""
+    job = BulkJob(kind=kind)
+    job.put()
+    chunk_keys = []
+
+    def putChunk(rows):
+        chunk_keys.append(BulkChunk(id=len(chunk_keys) + 1, parent=job.key,
+                                    first=job.rows, rows=rows).put())
+        job.rows += len(rows)
+
+    rows, size = [], 0
+    try:
+        for n, row in enumerate(parseRows(body, fmt), 1):
+            row_size = len(json.dumps(row))
+            if row_size > CHUNK_BYTES:
+                raise ValueError('row %d is larger than %d bytes'
+                                 % (n, CHUNK_BYTES))
+            if rows and (size + row_size > CHUNK_BYTES
+                         or len(rows) == CHUNK_ROWS):
+                putChunk(rows)
+                rows, size = [], 0
+            rows.append(row)
+            size += row_size
+        if rows:
+            putChunk(rows)
+    except ValueError:
+        # a rejected upload leaves nothing behind
+        ndb.delete_multi(chunk_keys + [job.key])
+        raise
+    job.put()
+    taskqueue.add(params={'job': job.key.id()}, url='/tasks/bulk_import')
+    return job
+
+
+def runImport(job_id):
+    """Import a job from its checkpoint until done or out of time."""
+    job = BulkJob.get_by_id(job_id)
+    if not job or job.status != 'running':
+        return
+    deadline = time.time() + TIME_BUDGET
+    chunk = None
+    while job.nextRow < job.rows:
+        if time.time() > deadline:
+            taskqueue.add(params={'job': job_id}, url='/tasks/bulk_import')
+            return
+        if chunk is None or chunk.key.id() != job.nextChunk:
+            chunk = BulkChunk.get_by_id(job.nextChunk, parent=job.key)
+            if chunk is None:
+                # retrying cannot bring it back
+                _fail(job, None, 'chunk %d is missing' % job.nextChunk)
+                job.status = 'failed'
+                job.put()
+                return
+        first = _firstRow(chunk)
+        if job.nextRow >= first + len(chunk.rows):
+            job.nextChunk += 1
+            continue
+        start = job.nextRow - first
+        rows = chunk.rows[start:start + BATCH_SIZE]
+        _importBatch(job, rows, job.nextRow)
+        # checkpoint; a batch redone after a crash only finds existing keys
+        job.nextRow += len(rows)
+        job.put()
+
+    job.status = 'done'
+    job.put()
+    ndb.delete_multi(BulkChunk.query(ancestor=job.key).fetch(keys_only=True))
+
+
+def _firstRow(chunk):
+    # chunks stored before they were sized by bytes all held CHUNK_ROWS rows
+    if chunk.first is None:
+        return (chunk.key.id() - 1) * CHUNK_ROWS
+    return chunk.first
+
+
+def _websafeKey(field, websafe, model, parent=None):
+    """Return the key of an exported row; ValueError unless it is a key of
+    this app, of model and, if given, with parent as its parent."""
+    try:
+        key = ndb.Key(urlsafe=websafe)
+    except Exception:
+        raise ValueError('%r is not a valid %s' % (websafe, field))
+    local = ndb.Key(model, 1)
+    if (key.app(), key.namespace()) != (local.app(), local.namespace()):
+        raise ValueError("'%s' is a key of another app" % field)
+    if key.kind() != local.kind():
+        raise ValueError("'%s' is not a %s key" % (field, local.kind()))
+    if parent is not None and key.parent() != parent:
+        raise ValueError("'%s' does not belong to %s"
+                         % (field, parent.urlsafe()))
+    return key
+
+
+def _rowKey(job, row_no, parent, model, field, websafe):
+    if websafe:
+        return _websafeKey(field, websafe, model, parent)
+    return ndb.Key(model, 'bulk-%d-%d' % (job.key.id(), row_no), parent=parent)
+
+
+def _fail(job, row_no, error):
+    job.failed += 1
+    if len(job.errors) < MAX_ERRORS:
+        if row_no is not None:
+            error = 'row %d: %s' % (row_no + 1, error)
+        job.errors.append(unicode(error))
+
+
+def _importBatch(job, rows, first):
+    """Import one batch of rows, updating the job's counts."""
+    entities = []
+    for i, row in enumerate(rows):
+        try:
+            if job.kind == 'Conference':
+                entities.append(_conference(job, first + i, row))
+            else:
+                entities.append(_session(job, first + i, row))
+        except Exception as e:
+            # a bad row must not stop the job; it is reported instead
+            _fail(job, first + i, e)
+
+    # only new entities are written, so a redone batch changes nothing
+    existing = ndb.get_multi([entity.key for entity in entities])
+    entities = [entity for entity, found in zip(entities, existing) if not found]
+    job.skipped += len(existing) - len(entities)
+    if job.kind == 'Conference':
+        _putConferences(entities)
+    else:
+        entities = _putSessions(job, entities)
+    job.imported += len(entities)
+
+
+def _conference(job, row_no, row):
+    data = dict((field, row.get(field)) for field in FIELDS['Conference'])
+    for field in INTEGER_FIELDS:
+        if data[field] is not None:
+            data[field] = int(data[field])
+    if not data['name']:
+        raise ValueError("'name' is required")
+    if not data['organizerUserId']:
+        raise ValueError("'organizerUserId' is required")
+    seats_left = data.pop('seatsAvailable')
+    p_key = ndb.Key(Profile, data['organizerUserId'])
+    key = _rowKey(job, row_no, p_key, Conference, 'websafeKey',
+                  data.pop('websafeKey'))
+    data = ConferenceApi._conferenceData(data)
+    if seats_left is not None:
+        # exported rows carry the seats left, not the capacity
+        data['seatsAvailable'] = seats_left
+    return Conference(key=key, **data)
+
+
+def _putConferences(conferences):
+    profiles = ndb.get_multi([conf.key.parent() for conf in conferences])
+    shards = []
+    for conf, prof in zip(conferences, profiles):
+        conf.organizerDisplayName = getattr(prof, 'displayName', None) or ''
+        shards += seats.newShards(conf)
+    ndb.put_multi(conferences + shards)
+    if conferences:
+        query_cache.bump()
+        search_index.indexQuietly(search_index.indexConferences, conferences)
+
+
+def _session(job, row_no, row):
+    data = dict((field, row.get(field)) for field in FIELDS['Session'])
+    if not data['sessionName']:
+        raise ValueError("'sessionName' is required")
+    if not data['c_websafeKey']:
+        raise ValueError("'c_websafeKey' is required")
+    c_key = _websafeKey('c_websafeKey', data['c_websafeKey'], Conference)
+    key = _rowKey(job, row_no, c_key, Session, 'sessionWebSafeKey',
+                  data['sessionWebSafeKey'])
+    data = ConferenceApi._sessionData(data)
+    data['c_websafeKey'] = c_key.urlsafe()
+    data['sessionWebSafeKey'] = key.urlsafe()
+    return Session(key=key, **data)
+
+
+def _putSessions(job, sessions):
+    """Write sessions with their speaker counts, one transaction per
+    conference; returns the sessions written."""
+    by_conference = {}
+    for ses in sessions:
+        by_conference.setdefault(ses.key.parent(), []).append(ses)
+    c_keys = by_conference.keys()
+    written = []
+    for c_key, conf in zip(c_keys, ndb.get_multi(c_keys)):
+        if not conf:
+            for ses in by_conference[c_key]:
+                _fail(job, None, 'no conference %s' % ses.c_websafeKey)
+            continue
+        ConferenceApi._putSessionsAndCountSpeakers(c_key, by_conference[c_key])
+        ConferenceApi._afterSessionsWritten(c_key, by_conference[c_key])
+        written += by_conference[c_key]
+    return written
+
+
+# - - - export - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _conferenceRow(conf, seats_left):
+    return {
+        'websafeKey': conf.key.urlsafe(),
+        'name': conf.name,
+        'description': conf.description,
+        'organizerUserId': conf.organizerUserId,
+        'topics': conf.topics,
+        'city': conf.city,
+        'startDate': conf.startDate.isoformat() if conf.startDate else None,
+        'endDate': conf.endDate.isoformat() if conf.endDate else None,
+        'maxAttendees': conf.maxAttendees,
+        'seatsAvailable': seats_left,
+    }
+
+
+def _sessionRow(ses):
+    return {
+        'sessionWebSafeKey': ses.key.urlsafe(),
+        'c_websafeKey': ses.key.parent().urlsafe(),
+        'sessionName': ses.sessionName,
+        'highlights': ses.highlights,
+        'duration': ses.duration,
+        'speaker': ses.speaker,
+        'sessionType': ses.sessionType,
+        'date': ses.date.isoformat() if ses.date else None,
+        'startTime': ses.startTime.strftime('%H:%M') if ses.startTime else None,
+    }
+
+
+def _rows(kind, entities):
+    if kind == 'Conference':
+        seats_left = seats.getSeatsAvailable([conf.key for conf in entities])
+        return [_conferenceRow(conf, seats_left.get(conf.key))
+                for conf in entities]
+    return [_sessionRow(ses) for ses in entities]
+
+
+def _csvValue(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        value = ';'.join(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def exportPage(kind, fmt, out, cursor=None):
+    """Write up to EXPORT_LIMIT rows of kind to the file-like out; return
+    the cursor of the next page, or None after the last one."""
+    start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+    it = KINDS[kind].query().iter(start_cursor=start_cursor,
+                                  batch_size=EXPORT_BATCH,
+                                  produce_cursors=True)
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, FIELDS[kind])
+        if not cursor:
+            writer.writeheader()
+
+    def write(entities):
+        for row in _rows(kind, entities):
+            if writer:
+                writer.writerow(dict((k, _csvValue(v)) for k, v in row.items()))
+            else:
+                out.write(json.dumps(row) + '\n')
+
+    batch, written = [], 0
+    for entity in it:
+        batch.append(entity)
+        written += 1
+        if len(batch) == EXPORT_BATCH:
+            write(batch)
+            batch = []
+        if written == EXPORT_LIMIT:
+            break
+    write(batch)
+    if written == EXPORT_LIMIT and it.has_next():
+        return it.cursor_after().urlsafe()
+    return None
@@ -15,6 +15,7 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 from datetime import datetime
 import json
+import logging
 import os
 import time
 
@@ -23,32 +24,64 @@ from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import urlfetch
 from google.appengine.ext import ndb
 
 from models import Profile
 from models import ProfileMiniForm
-from models import ProfileForm
+from models import ProfileForm, ProfileForms
 from models import TeeShirtSize
 
 from models import Conference, Session
+from models import SpeakerSessionCount, FeaturedSpeaker
+from models import Registration, WaitlistEntry, WishListItem
 from models import ConferenceForm, ConferenceForms, SessionForm, SessionForms
+from models import SessionResultForm, SessionResultForms
 from models import ConferenceQueryForm, ConferenceQueryForms
 
 from models import BooleanMessage
+from models import WaitlistPositionForm
+from models import EndpointStatsForm, EndpointStatsForms
 from models import FeaturedSpeakerMessage
 from models import ConflictException
 
 from google.appengine.api import taskqueue
 from google.appengine.api import memcache
 
-MEMCAHE_KEY = "FEATURED_SPEAKER"
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER:%s"
 
 
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
+#Request container for listing the sessions of a conference, optionally
+#with only some of the SessionForm fields
+SESSION_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    fields=messages.StringField(2, repeated=True),
+)
+#Request container for the admin endpoint stats, over the last minutes
+STATS_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    minutes=messages.IntegerField(1),
+)
+#Request container for full-text search, optionally of one conference's sessions
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    cursor=messages.StringField(3),
+    websafeConferenceKey=messages.StringField(4),
+)
+#Request container for paging through the conferences created by the user
+CONF_CREATED_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    cursor=messages.StringField(2),
+)
 #Request Container for getting session of a particular type within a conference
 SES_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
@@ -66,6 +99,37 @@ SESSION_WISH_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     sessionKey=messages.StringField(1),
 )
+#Request container for paging through the attendees of a conference
+ATTENDEES_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    cursor=messages.StringField(3),
+)
+#Request container for changing the number of seats of a conference
+CAPACITY_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    maxAttendees=messages.IntegerField(2),
+)
+#Request container for creating many sessions of one conference
+SESSION_BATCH_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(3),
+)
+#Request container for querying a conference's sessions with a predicate
+SESSION_QUERY_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    where=messages.StringField(2),
+    fields=messages.StringField(3, repeated=True),
+)
+#Request container for paging through the user's wishlist
+WISHLIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    cursor=messages.StringField(2),
+)
 #Request container to a given type of session for a given speaker
 SESSION_TYPE_SPEAKER = endpoints.ResourceContainer(
     message_types.VoidMessage,
@@ -73,11 +137,6 @@ SESSION_TYPE_SPEAKER = endpoints.ResourceContainer(
     speakerName = messages.StringField(2),
 )
 
-#Request Container for getiing the featured apeaker.
-FEATURED_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
-    message_types.VoidMessage,
-    speaker=messages.StringField(1),
-    )
 #Request container to get all sessions by a speaker in a conference
 CONFERENCE_SESSION_SPEAKER = endpoints.ResourceContainer(
     message_types.VoidMessage,
@@ -86,8 +145,22 @@ CONFERENCE_SESSION_SPEAKER = endpoints.ResourceContainer(
 )
 
 from settings import WEB_CLIENT_ID
-
-
+from settings import ADMIN_EMAILS
+
+
+from instrumentation import instrumented
+import etags
+import instrumentation
+import jobs
+import mappers
+import migrations
+import planner
+import profile_cache
+import query_cache
+import search_index
+import session_snapshot
+import speakers
+import seats
 import utils
 
 
@@ -113,21 +186,62 @@ SESSION_FIELDS = {
     'SPEAKER': 'speaker',
 }
 
-OPERATORS = {
-            'EQ':   '=',
-            'GT':   '>',
-            'GTEQ': '>=',
-            'LT':   '<',
-            'LTEQ': '<=',
-            'NE':   '!='
-            }
-
-FIELDS =    {
-            'CITY': 'city',
-            'TOPIC': 'topics',
-            'MONTH': 'month',
-            'MAX_ATTENDEES': 'maxAttendees',
-            }
+def _defaultIfNone(value):
+    """Session fields with no value are shown as 'Default'."""
+    return 'Default' if value is None else value
+
+# entity -> message copy plans, built once at import time
+CONFERENCE_MAPPER = mappers.Mapper(Conference, ConferenceForm,
+    # convert Date to date string; just copy others
+    converters={'startDate': str, 'endDate': str},
+    computed={'websafeKey': mappers.urlsafeKey})
+
+SESSION_MAPPER = mappers.Mapper(Session, SessionForm,
+    # convert date and time to strings and show missing values as 'Default';
+    # the websafe keys are taken from the key when a projection lacks them
+    converters={'date': str, 'startTime': str},
+    otherwise=_defaultIfNone,
+    computed={'sessionWebSafeKey': mappers.storedKey('sessionWebSafeKey'),
+              'c_websafeKey': mappers.storedKey(
+                  'c_websafeKey', lambda session: session.key.parent())})
+
+PROFILE_MAPPER = mappers.Mapper(Profile, ProfileForm,
+    # convert t-shirt string to Enum; just copy others
+    converters={'teeShirtSize': lambda size: getattr(TeeShirtSize, size)})
+
+# properties loaded by projection queries when a list request only asks for
+# fields among them; each tuple has a matching composite index in index.yaml
+CONFERENCE_LIST_PROJECTION = ('city', 'startDate', 'maxAttendees',
+                              'seatsAvailable', 'organizerDisplayName', 'name')
+# recorded by /tasks/backfill_organizer_names once every Conference stores
+# organizerDisplayName; until then a projection on it would skip the rest
+ORGANIZER_NAMES_MIGRATION = 'organizer_names'
+SESSION_LIST_PROJECTION = ('sessionName', 'speaker', 'sessionType',
+                           'date', 'startTime')
+
+# page size used when the client does not ask for one, and the most
+# results a single list request may return regardless of what is asked
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# minutes getEndpointStats adds up when the client does not say, and the
+# most it will; each minute is a memcache key per name and counter
+DEFAULT_STATS_MINUTES = 15
+MAX_STATS_MINUTES = 60
+
+# conferences updated per task when an organizer's display name changes
+ORGANIZER_NAME_BATCH = 100
+MAX_SESSION_BATCH = 200
+
+# waitlisted users promoted per transaction; with the seat shard that is
+# the most entity groups a cross-group transaction may touch
+PROMOTE_BATCH = 24
+# seconds a promotion task works before handing over to the next one
+PROMOTE_TIME_BUDGET = 60
+# seconds to let the waitlist index catch up with added or removed entries
+PROMOTE_RETRY_DELAY = 5
+# runs in a row that may find only removed entries before promotion gives up
+PROMOTE_MAX_RETRIES = 5
 
 
 
@@ -145,24 +259,84 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
-        """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+    def _copyConferenceToForm(self, conf, displayName, seatsAvailable=None, fields=None):
+        """Copy relevant fields (or only those in fields) from Conference to ConferenceForm."""
+        cf = CONFERENCE_MAPPER.copy(conf, fields)
+        if displayName and (fields is None or 'organizerDisplayName' in fields):
+            cf.organizerDisplayName = displayName
+        # the live seat count is kept in the seat shards, not the Conference
+        if seatsAvailable is not None and (fields is None or 'seatsAvailable' in fields):
+            cf.seatsAvailable = seatsAvailable
         return cf
 
 
+    def _ifNoneMatch(self):
+        """Return the If-None-Match header of the request, if any."""
+        # there is no request state when a method is called directly
+        if self.request_state is None:
+            return None
+        return self.request_state.headers.get('If-None-Match')
+
+
+    def _legacyOrganizerNames(self, conferences):
+        """Return {conference key: organizer name} for conferences that do
+        not store organizerDisplayName yet, with one get_multi for all."""
+        legacy = [conf.key for conf in conferences if conf.organizerDisplayName is None]
+        if not legacy:
+            return {}
+        # the organizer Profile is the parent of the conference key
+        profiles = ndb.get_multi([key.parent() for key in legacy])
+        return dict((key, getattr(prof, 'displayName', None))
+                    for key, prof in zip(legacy, profiles))
+
+
+    def _checkFields(self, mapper, fields):
+        """Return requested sparse fieldset as a set, or None for all fields."""
+        if not fields:
+            return None
+        fields = frozenset(fields)
+        unknown = fields - mapper.fieldNames
+        if unknown:
+            raise endpoints.BadRequestException(
+                "Unknown fields requested: %s" % ', '.join(sorted(unknown)))
+        return fields
+
+
+    def _projectionFor(self, mapper, fields, projection):
+        """Return projection if the requested fields can be served by it."""
+        if fields and fields & mapper.propertyNames <= set(projection):
+            return projection
+        return None
+
+
+    @staticmethod
+    def _conferenceData(data):
+        """Apply defaults and convert the dates of new Conference fields (from
+        a ConferenceForm or an imported row), returning the dict."""
+        # add default values for those missing
+        for df in DEFAULTS:
+            if data.get(df) in (None, []):
+                data[df] = DEFAULTS[df]
+
+        # convert dates from strings to Date objects; set month based on start_date
+        try:
+            if data.get('startDate'):
+                data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
+                data['month'] = data['startDate'].month
+            else:
+                data['month'] = 0
+            if data.get('endDate'):
+                data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Conference dates must be YYYY-MM-DD")
+
+        # set seatsAvailable to be same as maxAttendees on creation
+        if data["maxAttendees"] > 0:
+            data["seatsAvailable"] = data["maxAttendees"]
+        return data
+
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
@@ -177,28 +351,13 @@ class ConferenceApi(remote.Service):
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
-        del data['organizerDisplayName']
-
-        # add default values for those missing (both data model & outbound Message)
-        for df in DEFAULTS:
-            if data[df] in (None, []):
-                data[df] = DEFAULTS[df]
-                setattr(request, df, DEFAULTS[df])
-
-        # convert dates from strings to Date objects; set month based on start_date
-        if data['startDate']:
-            data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
-            data['month'] = data['startDate'].month
-        else:
-            data['month'] = 0
-        if data['endDate']:
-            data['endDate'] = datetime.strptime(data['endDate'][:10], "%Y-%m-%d").date()
+        del data['etag']
+        del data['notModified']
+        data = self._conferenceData(data)
 
-        # set seatsAvailable to be same as maxAttendees on creation
-        # both for data model & outbound Message
-        if data["maxAttendees"] > 0:
-            data["seatsAvailable"] = data["maxAttendees"]
-            setattr(request, "seatsAvailable", data["maxAttendees"])
+        # defaults and seatsAvailable go to the outbound Message too
+        for field in DEFAULTS.keys() + ['seatsAvailable']:
+            setattr(request, field, data[field])
 
         # make Profile Key from user ID
         p_key = ndb.Key(Profile, user_id)
@@ -207,10 +366,17 @@ class ConferenceApi(remote.Service):
         # make Conference key from ID
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
+        request.websafeKey = c_key.urlsafe()
         data['organizerUserId'] = request.organizerUserId = user_id
+        # store the organizer's name so list endpoints need not look it up
+        prof = self._getProfileFromUser()
+        data['organizerDisplayName'] = request.organizerDisplayName = prof.displayName
 
-        # create Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        # create Conference with its seat shards & return (modified) ConferenceForm
+        conf = Conference(**data)
+        ndb.put_multi([conf] + seats.newShards(conf))
+        query_cache.bump()
+        search_index.indexQuietly(search_index.indexConferences, [conf])
 
         return request
 
@@ -218,21 +384,17 @@ class ConferenceApi(remote.Service):
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return PROFILE_MAPPER.copy(prof)
 
 
     def _getProfileFromUser(self):
         """Return user Profile from datastore, creating new one if non-existent."""
+        return self._getProfileFromUserAsync().get_result()
+
+
+    @ndb.tasklet
+    def _getProfileFromUserAsync(self):
+        """Tasklet version of _getProfileFromUser."""
         
         #make sure user is authenticated
         user = endpoints.get_current_user() 
@@ -245,8 +407,8 @@ class ConferenceApi(remote.Service):
         #generate a p_key for this user using the user_id
         p_key = ndb.Key(Profile, user_id)
 
-        #get the profile associated with this p_key
-        profile = p_key.get()
+        #get the profile associated with this p_key, through the cache
+        profile = yield profile_cache.getAsync(p_key)
         if not profile:
             profile = Profile(
                 key = p_key,
@@ -254,10 +416,11 @@ class ConferenceApi(remote.Service):
                 mainEmail= user.email(),
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put() #save profile to datastore
+            yield profile.put_async() #save profile to datastore
+            yield profile_cache.invalidateAsync(p_key)
         
 
-        return profile      # return Profile
+        raise ndb.Return(profile)      # return Profile
 
 
     def _doProfile(self, save_request=None):
@@ -267,160 +430,588 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
-            for field in ('displayName', 'teeShirtSize'):
-                if hasattr(save_request, field):
-                    val = getattr(save_request, field)
-                    if val:
-                        setattr(prof, field, str(val))
-            prof.put()            
+            prof = self._updateProfile(prof.key, save_request)
+            profile_cache.invalidate(prof.key)
+            # conferences that show this profile's name get new etags
+            etags.organizerChanged(prof.key)
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+    @ndb.transactional
+    def _updateProfile(self, p_key, save_request):
+        """Copy user-modifyable fields onto the stored Profile and save it."""
+        # the cached profile may be stale, so modify a fresh copy
+        prof = p_key.get()
+        oldName = prof.displayName
+        for field in ('displayName', 'teeShirtSize'):
+            if hasattr(save_request, field):
+                val = getattr(save_request, field)
+                if val:
+                    setattr(prof, field, str(val))
+        prof.put()
+        # the name is copied onto the user's conferences; update them in
+        # the background, only if this transaction commits
+        if prof.displayName != oldName:
+            taskqueue.add(params={'userId': p_key.id()},
+                          url='/tasks/update_organizer_name',
+                          transactional=True)
+        return prof
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
 
+    @staticmethod
+    def _updateOrganizerDisplayName(user_id, cursor=None):
+        """Copy a user's display name onto one batch of their conferences,
+        queueing a task for the next batch."""
+        p_key = ndb.Key(Profile, user_id)
+        prof = p_key.get()
+        start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+        conferences, next_cursor, more = Conference.query(ancestor=p_key) \
+            .fetch_page(ORGANIZER_NAME_BATCH, start_cursor=start_cursor)
 
-    def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
-        formatted_filters = []
-        inequality_field = None
+        changed = [conf for conf in conferences
+                   if conf.organizerDisplayName != prof.displayName]
+        for conf in changed:
+            conf.organizerDisplayName = prof.displayName
+        ndb.put_multi(changed)
+        if changed:
+            query_cache.bump()
+            etags.conferencesChanged(changed)
 
-        for f in filters:
-            filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
+        if more and next_cursor:
+            taskqueue.add(params={'userId': user_id,
+                                  'cursor': next_cursor.urlsafe()},
+                          url='/tasks/update_organizer_name')
 
-            try:
-                filtr["field"] = FIELDS[filtr["field"]]
-                filtr["operator"] = OPERATORS[filtr["operator"]]
-            except KeyError:
-                raise endpoints.BadRequestException("Filter contains invalid field or operator.")
-
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
 
-            formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+    @staticmethod
+    def _backfillOrganizerDisplayNames(cursor=None):
+        """Store organizerDisplayName on one batch of conferences created
+        before it existed, queueing a task for the next batch."""
+        start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+        conferences, next_cursor, more = Conference.query() \
+            .fetch_page(ORGANIZER_NAME_BATCH, start_cursor=start_cursor)
+
+        legacy = [conf for conf in conferences if conf.organizerDisplayName is None]
+        profiles = ndb.get_multi([conf.key.parent() for conf in legacy])
+        for conf, prof in zip(legacy, profiles):
+            conf.organizerDisplayName = getattr(prof, 'displayName', None) or ''
+        ndb.put_multi(legacy)
+        if legacy:
+            query_cache.bump()
+            etags.conferencesChanged(legacy)
+
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/backfill_organizer_names')
+        else:
+            migrations.finish(ORGANIZER_NAMES_MIGRATION)
+
+    def _fetchFilteredPage(self, plan, pageSize, cursor):
+        """Fetch one page of conferences for a plan with post-filters,
+        returning (results, nextPageToken)."""
+        pageSize = self._pageSize(pageSize)
+        try:
+            start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+            it = plan.query().iter(start_cursor=start_cursor,
+                                   produce_cursors=True,
+                                   batch_size=pageSize)
+            results, scanned = [], 0
+            for conf in it:
+                scanned += 1
+                if plan.matches(conf):
+                    results.append(conf)
+                # a short page with a cursor is fine; reading on isn't
+                if len(results) == pageSize or scanned == planner.MAX_SCAN:
+                    if it.has_next():
+                        return results, it.cursor_after().urlsafe()
+                    break
+        except (datastore_errors.BadValueError, datastore_errors.BadRequestError):
+            raise endpoints.BadRequestException("Invalid page cursor.")
+        return results, None
+
+
+    def _pageSize(self, pageSize):
+        """Check a requested page size, applying the default and maximum."""
+        if pageSize is None:
+            return DEFAULT_PAGE_SIZE
+        if pageSize < 1:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        return min(pageSize, MAX_PAGE_SIZE)
+
+
+    def _fetchPage(self, query, pageSize, cursor, **options):
+        """Fetch one page of query results, returning (results, nextPageToken)."""
+        pageSize = self._pageSize(pageSize)
+
+        try:
+            start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+            results, next_cursor, more = query.fetch_page(
+                pageSize, start_cursor=start_cursor, **options)
+        except (datastore_errors.BadValueError, datastore_errors.BadRequestError):
+            raise endpoints.BadRequestException("Invalid page cursor.")
+
+        nextPageToken = None
+        if more and next_cursor:
+            nextPageToken = next_cursor.urlsafe()
+        return results, nextPageToken
 
     
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @instrumented
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # registrations are keyed by conference, so a keys-only ancestor
+        # query lists them; include any not yet moved off the Profile
+        wscks = [reg_key.id() for reg_key in
+                 Registration.query(ancestor=prof.key).fetch(keys_only=True)]
+        wscks += [wsck for wsck in prof.conferenceKeysToAttend
+                  if wsck not in wscks]
+        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in wscks]
+
+        # the conferences and their seat counts load in parallel; organizer
+        # names are stored on the conferences
+        conf_futures = ndb.get_multi_async(conf_keys)
+        seats_future = seats.getSeatsAvailableAsync(conf_keys)
+
+        conferences = [conf for conf in
+                       (future.get_result() for future in conf_futures) if conf]
+        seats_left = seats_future.get_result()
+        names = self._legacyOrganizerNames(conferences)
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
+        return ConferenceForms(items=[self._copyConferenceToForm(conf,
+            names.get(conf.key), seats_left[conf.key]) for conf in conferences]
         )
         # - - - Registration - - - - - - - - - - - - - - - - - - - -
-    @ndb.transactional(xg=True)    
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
-        prof = self._getProfileFromUser() # get user Profile
+        return self._conferenceRegistrationAsync(request, reg).get_result()
+
 
-        # check if conf exists given websafeConfKey
-        # get conference; check that it exists
+    @ndb.tasklet
+    def _conferenceRegistrationAsync(self, request, reg):
+        """Tasklet version of _conferenceRegistration."""
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        c_key = ndb.Key(urlsafe=wsck)
+
+        # user Profile, conference, its seat shards and whether anyone is
+        # waiting for a seat are independent, so look them up in parallel
+        prof, conf, shards, waiting = yield (
+            self._getProfileFromUserAsync(),
+            c_key.get_async(),
+            seats.loadShardsAsync(c_key),
+            self._waitlistQuery(c_key).get_async(keys_only=True))
+        reg_key = ndb.Key(Registration, wsck, parent=prof.key)
+        wait_key = ndb.Key(WaitlistEntry, wsck, parent=prof.key)
+        # check that the conference exists
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        registered, waitlisted = yield ndb.get_multi_async([reg_key, wait_key])
+
+        # unregister: leave the waitlist, or give the seat back to any
+        # shard; the transaction queues a promotion check, as the waitlist
+        # query may not show everyone waiting yet
+        if not reg:
+            if waitlisted:
+                left = yield self._leaveWaitlistAsync(wait_key)
+                if left:
+                    raise ndb.Return(BooleanMessage(data=True))
+            retval = yield self._releaseSeatAsync(reg_key, seats.anyShard(conf))
+            if retval:
+                yield (profile_cache.invalidateAsync(prof.key),
+                       seats.seatReleasedAsync(c_key),
+                       query_cache.bumpAsync())
+            raise ndb.Return(BooleanMessage(data=retval))
+
+        if registered or wsck in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+        # a retry from a user already waiting costs no transaction
+        if waitlisted:
+            raise ndb.Return(BooleanMessage(data=False))
+
+        # register: try the shards that looked non-empty, in random order,
+        # so concurrent registrations rarely write the same shard; seats
+        # freed while others wait are theirs, not a newcomer's
+        if not waiting:
+            for shard_key in seats.candidateShards(shards):
+                taken = yield self._takeSeatAsync(reg_key, shard_key)
+                if taken:
+                    yield (profile_cache.invalidateAsync(prof.key),
+                           seats.seatTakenAsync(c_key),
+                           query_cache.bumpAsync())
+                    raise ndb.Return(BooleanMessage(data=True))
+
+        # full: join the waitlist rather than fail, so clients have no
+        # reason to keep retrying; seats that still look free go to the
+        # waitlist in order, which may well be this user
+        yield self._joinWaitlistAsync(
+            reg_key, wait_key,
+            any(shard.seatsAvailable > 0 for shard in shards or ()))
+        raise ndb.Return(BooleanMessage(data=False))
 
-        # register
+
+    @staticmethod
+    def _waitlistQuery(c_key):
+        """Return the query for a conference's waitlist, oldest first."""
+        return WaitlistEntry.query(
+            WaitlistEntry.conference == c_key).order(WaitlistEntry.joined)
+
+
+    @ndb.transactional_tasklet
+    def _joinWaitlistAsync(self, reg_key, wait_key, seats_free=False):
+        """Put the user on a conference's waitlist, queueing a promotion
+        if seats_free."""
+        reg, entry = yield ndb.get_multi_async([reg_key, wait_key])
+        # promoted since the registration started
         if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
-                raise ConflictException(
-                    "You have already registered for this conference")
-
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
-
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
-
-        # unregister
-        else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            raise ConflictException(
+                "You have already registered for this conference")
+        if not entry:
+            c_key = ndb.Key(urlsafe=wait_key.id())
+            yield WaitlistEntry(key=wait_key, conference=c_key).put_async()
+            if seats_free:
+                # give the waitlist query time to show the new entry
+                self._queuePromotion(c_key, transactional=True,
+                                     countdown=PROMOTE_RETRY_DELAY)
+
+
+    @ndb.transactional_tasklet
+    def _leaveWaitlistAsync(self, wait_key):
+        """Take the user off a waitlist; False if they were promoted first."""
+        entry = yield wait_key.get_async()
+        if not entry:
+            raise ndb.Return(False)
+        yield wait_key.delete_async()
+        raise ndb.Return(True)
+
+
+    @staticmethod
+    def _queuePromotion(c_key, transactional=False, countdown=None, retries=0):
+        """Have free seats of a conference given to its waitlist; retries
+        counts the runs before that found only removed entries."""
+        taskqueue.add(params={'websafeConferenceKey': c_key.urlsafe(),
+                              'retries': retries},
+                      url='/tasks/promote_waitlist', countdown=countdown,
+                      transactional=transactional)
+
+
+    @staticmethod
+    def _promoteWaitlist(c_key, retries=0):
+        """Give a conference's free seats to its waitlist, oldest first and
+        one batch per transaction, until either runs out."""
+        deadline = time.time() + PROMOTE_TIME_BUDGET
+        while time.time() < deadline:
+            wait_keys = ConferenceApi._waitlistQuery(c_key).fetch(
+                PROMOTE_BATCH, keys_only=True)
+            if not wait_keys:
+                return
+            shards = seats.loadShardsAsync(c_key).get_result()
+            if not shards:
+                return
+            shard = max(shards, key=lambda shard: shard.seatsAvailable)
+            if shard.seatsAvailable <= 0:
+                return
+            promoted, removed = ConferenceApi._promoteBatch(shard.key, wait_keys)
+            for p_key in promoted:
+                profile_cache.invalidate(p_key)
+            if promoted:
+                seats.seatTakenAsync(c_key, len(promoted)).get_result()
+                query_cache.bump()
+            if not removed:
+                # the query still lists entries that are gone; wait for it
+                # to catch up, but not forever
+                if retries < PROMOTE_MAX_RETRIES:
+                    ConferenceApi._queuePromotion(
+                        c_key, countdown=PROMOTE_RETRY_DELAY,
+                        retries=retries + 1)
+                else:
+                    logging.warning('waitlist of %s lists only removed '
+                                    'entries; giving up', c_key.urlsafe())
+                return
+        ConferenceApi._queuePromotion(c_key)
+
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _promoteBatch(shard_key, wait_keys):
+        """Register waitlisted users, in order, with seats from one shard.
+        Returns the Profile keys promoted and the number of entries removed."""
+        reg_keys = [ndb.Key(Registration, key.id(), parent=key.parent())
+                    for key in wait_keys]
+        entities = ndb.get_multi([shard_key] + wait_keys + reg_keys +
+                                 [key.parent() for key in wait_keys])
+        n = len(wait_keys)
+        shard, entries = entities[0], entities[1:n + 1]
+        regs, profiles = entities[n + 1:2 * n + 1], entities[2 * n + 1:]
+
+        promoted, regs_new, removed = [], [], []
+        for wait_key, reg_key, entry, reg, prof in zip(
+                wait_keys, reg_keys, entries, regs, profiles):
+            if not entry:
+                continue
+            if reg or wait_key.id() in prof.conferenceKeysToAttend:
+                # registered some other way meanwhile
+                removed.append(wait_key)
+            elif shard.seatsAvailable > 0:
+                shard.seatsAvailable -= 1
+                regs_new.append(Registration(key=reg_key, conference=entry.conference))
+                removed.append(wait_key)
+                promoted.append(wait_key.parent())
             else:
-                retval = False
+                break
+        ndb.put_multi(regs_new + [shard])
+        ndb.delete_multi(removed)
+        return promoted, len(removed)
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _setCapacity(c_key, maxAttendees):
+        """Change a conference's maxAttendees, adding or taking away seats
+        across its shards, and adding shards for a larger conference;
+        returns the conference and the seats added."""
+        conf = c_key.get()
+        shards = ndb.get_multi(seats.shardKeys(conf))
+        delta = maxAttendees - (conf.maxAttendees or 0)
+        if delta > 0:
+            shards += seats.addShards(conf, maxAttendees)
+        if not seats.resize(shards, delta):
+            raise ConflictException(
+                "Too many attendees are registered to lower maxAttendees to %d"
+                % maxAttendees)
+        conf.maxAttendees = maxAttendees
+        ndb.put_multi([conf] + shards)
+        return conf, delta
+
+
+    @staticmethod
+    def _migrateRegistrations(prof):
+        """Return the entities that move a Profile's legacy
+        conferenceKeysToAttend into Registrations, emptying the list."""
+        if not prof.conferenceKeysToAttend:
+            return []
+        regs = [Registration(id=wsck, parent=prof.key,
+                             conference=ndb.Key(urlsafe=wsck))
+                for wsck in set(prof.conferenceKeysToAttend)]
+        prof.conferenceKeysToAttend = []
+        return regs + [prof]
+
+
+    @staticmethod
+    def _migrateLegacyRegistrations():
+        """Move one batch of Profiles' conferenceKeysToAttend into
+        Registrations, queueing a task for the next batch."""
+        # migrated profiles drop out of this query, so no cursor is needed
+        p_keys = Profile.query(Profile.conferenceKeysToAttend > '').fetch(
+            ORGANIZER_NAME_BATCH, keys_only=True)
+        for p_key in p_keys:
+            ConferenceApi._migrateProfileRegistrations(p_key)
+            profile_cache.invalidate(p_key)
+        if len(p_keys) == ORGANIZER_NAME_BATCH:
+            taskqueue.add(url='/tasks/migrate_registrations')
+
+
+    @staticmethod
+    @ndb.transactional
+    def _migrateProfileRegistrations(p_key):
+        """Move one Profile's legacy registrations into Registrations."""
+        ndb.put_multi(ConferenceApi._migrateRegistrations(p_key.get()))
+
+
+    @ndb.transactional_tasklet(xg=True)
+    def _takeSeatAsync(self, reg_key, shard_key):
+        """Register the user with a seat from one shard; False if it is empty."""
+        prof, reg, shard = yield ndb.get_multi_async(
+            [reg_key.parent(), reg_key, shard_key])
+        # the Registration shares the Profile's entity group, so legacy
+        # registrations can move over in the same transaction
+        migrated = self._migrateRegistrations(prof)
+        # check if user already registered otherwise add
+        if reg or reg_key in [e.key for e in migrated]:
+            raise ConflictException(
+                "You have already registered for this conference")
+        if shard.seatsAvailable <= 0:
+            yield ndb.put_multi_async(migrated)
+            raise ndb.Return(False)
+
+        # register user, take away one seat
+        reg = Registration(key=reg_key, conference=ndb.Key(urlsafe=reg_key.id()))
+        shard.seatsAvailable -= 1
+        yield ndb.put_multi_async(migrated + [reg, shard])
+        raise ndb.Return(True)
+
+
+    @ndb.transactional_tasklet(xg=True)
+    def _releaseSeatAsync(self, reg_key, shard_key):
+        """Unregister the user, adding the seat back to one shard."""
+        prof, reg, shard = yield ndb.get_multi_async(
+            [reg_key.parent(), reg_key, shard_key])
+        migrated = self._migrateRegistrations(prof)
+        # check if user already registered
+        if not reg and reg_key not in [e.key for e in migrated]:
+            raise ndb.Return(False)
+
+        # unregister user, add back one seat for whoever waits longest
+        shard.seatsAvailable += 1
+        yield (ndb.put_multi_async([e for e in migrated if e.key != reg_key] +
+                                   [shard]),
+               reg_key.delete_async())
+        self._queuePromotion(ndb.Key(urlsafe=reg_key.id()), transactional=True)
+        raise ndb.Return(True)
+
+
+    @endpoints.method(ATTENDEES_REQUEST, ProfileForms,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    @instrumented
+    def getConferenceAttendees(self, request):
+        """Return the attendees of a conference, one page at a time
+        (organizer only)."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if conf.organizerUserId != utils.getUserId(user):
+            raise endpoints.ForbiddenException(
+                'Only the organizer can see the attendees')
+
+        # a keys-only query on the conference property reads index entries
+        # only; the parent of each Registration is the attendee's Profile
+        reg_keys, nextPageToken = self._fetchPage(
+            Registration.query(Registration.conference == c_key),
+            request.pageSize, request.cursor, keys_only=True)
+        profiles = ndb.get_multi([reg_key.parent() for reg_key in reg_keys])
+        return ProfileForms(
+            items=[self._copyProfileToForm(prof) for prof in profiles if prof],
+            nextPageToken=nextPageToken
+        )
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @instrumented
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
 
     
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}',
+            http_method='DELETE', name='unregisterFromConference')
+    @instrumented
+    def unregisterFromConference(self, request):
+        """Unregister user from selected conference, or take them off its
+        waitlist."""
+        return self._conferenceRegistration(request, reg=False)
+
+
+    @endpoints.method(CONF_GET_REQUEST, WaitlistPositionForm,
+            path='conference/{websafeConferenceKey}/waitlist',
+            http_method='GET', name='getWaitlistPosition')
+    @instrumented
+    def getWaitlistPosition(self, request):
+        """Return the user's place on the waitlist of a full conference."""
+        wsck = request.websafeConferenceKey
+        prof = self._getProfileFromUser()
+        entry = ndb.Key(WaitlistEntry, wsck, parent=prof.key).get()
+        if not entry:
+            raise endpoints.NotFoundException(
+                'You are not on the waitlist of conference: %s' % wsck)
+        # count the users who joined earlier from index entries only
+        ahead = WaitlistEntry.query(WaitlistEntry.conference == entry.conference,
+                                    WaitlistEntry.joined < entry.joined).count()
+        return WaitlistPositionForm(websafeConferenceKey=wsck, position=ahead + 1)
+
+
+    @endpoints.method(CAPACITY_REQUEST, ConferenceForm,
+            path='conference/{websafeConferenceKey}/capacity',
+            http_method='POST', name='setConferenceCapacity')
+    @instrumented
+    def setConferenceCapacity(self, request):
+        """Change a conference's maxAttendees (organizer only); new seats
+        go to its waitlist first."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        if request.maxAttendees is None or request.maxAttendees < 0:
+            raise endpoints.BadRequestException(
+                "'maxAttendees' must be zero or more")
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf = c_key.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if conf.organizerUserId != utils.getUserId(user):
+            raise endpoints.ForbiddenException(
+                'Only the organizer can change the conference capacity')
+
+        # create the shards of an unsharded conference first
+        seats.loadShardsAsync(c_key).get_result()
+        conf, delta = self._setCapacity(c_key, request.maxAttendees)
+        seats.forget(c_key)
+        etags.conferencesChanged([conf])
+        query_cache.bump()
+        if delta > 0:
+            self._queuePromotion(c_key)
+        organizer_version = etags.organizerVersionAsync(c_key.parent()).get_result()
+        names = self._legacyOrganizerNames([conf])
+        seats_left = seats.getSeatsAvailable([c_key])[c_key]
+        cf = self._copyConferenceToForm(conf, names.get(c_key), seats_left)
+        cf.etag = etags.conferenceTagFor(conf, seats_left, organizer_version)
+        return cf
+
+
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
+    @instrumented
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:                                                                                                                                                               raise endpoints.NotFoundException(
+        """Return requested conference (by websafeConferenceKey); just its
+        etag, flagged notModified, if If-None-Match holds that etag."""
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        # a client polling an unchanged conference is answered from memcache
+        ifNoneMatch = self._ifNoneMatch()
+        if ifNoneMatch:
+            tag = etags.cachedConferenceTagAsync(c_key).get_result()
+            if etags.matches(ifNoneMatch, tag):
+                return ConferenceForm(etag=tag, notModified=True)
+
+        # get Conference object from request and its seat count in parallel;
+        # bail if not found
+        conf_future = c_key.get_async()
+        seats_future = seats.getSeatsAvailableAsync([c_key])
+        version_future = etags.organizerVersionAsync(c_key.parent())
+        conf = conf_future.get_result()
+        if not conf:
+            raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        # the organizer version must be read before the organizer name
+        organizer_version = version_future.get_result()
+        names = self._legacyOrganizerNames([conf])
+        seats_left = seats_future.get_result()[c_key]
+        cf = self._copyConferenceToForm(conf, names.get(c_key), seats_left)
+        cf.etag = etags.conferenceTagFor(conf, seats_left, organizer_version)
+        if etags.matches(ifNoneMatch, cf.etag):
+            return ConferenceForm(etag=cf.etag, notModified=True)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return cf
 
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @instrumented
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
@@ -428,6 +1019,7 @@ class ConferenceApi(remote.Service):
     #ProfileMiniForm is the request class and we pass the request to the _doProfile(..) method.
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @instrumented
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
@@ -435,6 +1027,7 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @instrumented
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -444,20 +1037,64 @@ class ConferenceApi(remote.Service):
                 path='queryConferences',
                 http_method='POST',
                 name='queryConferences')
+    @instrumented
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time. With explain set,
+        return only the query plan, without running it."""
+        fields = self._checkFields(CONFERENCE_MAPPER, request.fields)
+        plan = planner.plan(request.filters)
+        if request.explain:
+            return ConferenceForms(plan=plan.explain())
+
+        # the same few filter sets are asked for over and over
+        pageSize = self._pageSize(request.pageSize)
+        cache_key = query_cache.queryKey(plan, pageSize, request.cursor, fields)
+        forms, generation = query_cache.get(cache_key)
+        if forms is not None:
+            return forms
+        forms = self._runConferenceQuery(plan, fields, pageSize, request.cursor)
+        query_cache.put(cache_key, generation, forms,
+                        first_page=not request.cursor)
+        return forms
+
+
+    def _runConferenceQuery(self, plan, fields, pageSize, cursor):
+        """Run a planned conference query, returning one page of ConferenceForms."""
+        if plan.empty:
+            conferences, nextPageToken = [], None
+        elif plan.postFilters:
+            conferences, nextPageToken = self._fetchFilteredPage(
+                plan, pageSize, cursor)
+        else:
+            # unfiltered lists of indexed fields are served by a projection query
+            options = {}
+            if plan.unfiltered and migrations.done(ORGANIZER_NAMES_MIGRATION):
+                projection = self._projectionFor(
+                    CONFERENCE_MAPPER, fields, CONFERENCE_LIST_PROJECTION)
+                if projection:
+                    options['projection'] = projection
+            conferences, nextPageToken = self._fetchPage(
+                plan.query(), pageSize, cursor, **options)
+        seats_left = {}
+        if fields is None or 'seatsAvailable' in fields:
+            seats_left = seats.getSeatsAvailable([conf.key for conf in conferences])
+        names = {}
+        if fields is None or 'organizerDisplayName' in fields:
+            names = self._legacyOrganizerNames(conferences)
 
          # return individual ConferenceForm object per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") \
-            for conf in conferences]
+            items=[self._copyConferenceToForm(conf, names.get(conf.key),
+                seats_left.get(conf.key), fields) \
+            for conf in conferences],
+            nextPageToken=nextPageToken
         )
     
      # all conferences created by logged in user   
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForms,
+    @endpoints.method(CONF_CREATED_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @instrumented
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
@@ -467,91 +1104,186 @@ class ConferenceApi(remote.Service):
 
         # make profile key
         p_key = ndb.Key(Profile, utils.getUserId(user))
-        # create ancestor query for this user
-        conferences = Conference.query(ancestor=p_key)
-        # get the user profile and display name
-        prof = p_key.get()
-        displayName = getattr(prof, 'displayName')
+        # create ancestor query for this user (key order, so pages are stable)
+        query = Conference.query(ancestor=p_key)
+        conferences, nextPageToken = self._fetchPage(
+            query, request.pageSize, request.cursor)
+        # organizer names are stored on the conferences; get the seat counts
+        seats_left = seats.getSeatsAvailable([conf.key for conf in conferences])
+        names = self._legacyOrganizerNames(conferences)
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, displayName) for conf in conferences]
+            items=[self._copyConferenceToForm(conf, names.get(conf.key), seats_left[conf.key])
+                for conf in conferences],
+            nextPageToken=nextPageToken
         )
 
 
 
      #----------Sessions -----
      
-    #create a session object
-    def _createSessionObject(self, request):
-        """Create or update Session object, returning SessionForm/request."""
-        # preload necessary data items
+    def _ownConference(self, wsck):
+        """Return the conference for wsck, checking the current user organizes it."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
-        user_id = utils.getUserId(user)
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        #check if current user is owner of conference 
+        if conf.organizerUserId != utils.getUserId(user):
+            raise ConflictException('Unauthorised to create this session')
+        return conf
 
-        if not request.sessionName:
-            raise endpoints.BadRequestException("Conference 'name' field required")
 
-       
+    @staticmethod
+    def _sessionData(data):
+        """Convert the date and time of new Session fields (from a SessionForm
+        or an imported row), returning the dict."""
+        # convert dates and time from strings to Date and time formatted  objects 
+        try:
+            if data.get('startTime'):
+                data['startTime'] = datetime.strptime(data['startTime'][:5], "%H:%M").time()
+            if data.get('date'):
+                data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Session 'date' must be YYYY-MM-DD and 'startTime' HH:MM")
+        return data
+
+
+    def _sessionFromForm(self, form, s_key):
+        """Build a Session from a SessionForm, setting its websafe key on the
+        form; raises BadRequestException for invalid fields."""
+        if not form.sessionName:
+            raise endpoints.BadRequestException("Session 'sessionName' field required")
+
+        # copy SessionForm/ProtoRPC Message into dict
+        data = {field.name: getattr(form, field.name) for field in form.all_fields()}
+        data = self._sessionData(data)
+
+        #save the session websafe key
+        data['c_websafeKey'] = form.c_websafeKey = s_key.parent().urlsafe()
+        data['sessionWebSafeKey'] = form.sessionWebSafeKey = s_key.urlsafe()
+        data['key'] = s_key
+        return Session(**data)
+
+
+    #create a session object
+    def _createSessionObject(self, request):
+        """Create or update Session object, returning SessionForm/request."""
         wsck = request.c_websafeKey
-        conf = ndb.Key(urlsafe=wsck).get() # get the conference
-        #check if current user is owner of conference 
-        if conf.organizerUserId == user_id:
+        c_key = ndb.Key(urlsafe=wsck)
+        # allocate the session id while the conference loads; an id
+        # allocated for a rejected request is simply never used
+        ids_future = Session.allocate_ids_async(size=1, parent=c_key)
+        self._ownConference(wsck)
+
+        #auto-generated id for the session using parent as the conference key
+        s_key = ndb.Key(Session, ids_future.get_result()[0], parent=c_key)
+        session = self._sessionFromForm(request, s_key)
+
+        # create session & return (modified) SessionForm
+        self._putSessionsAndCountSpeakers(c_key, [session])
+        self._afterSessionsWritten(c_key, [session])
+        return request
 
 
-            # copy SessionForm/ProtoRPC Message into dict
-            data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+    def _createSessionObjects(self, request):
+        """Create a batch of sessions in one conference, returning a
+        SessionResultForm per item."""
+        if len(request.items) > MAX_SESSION_BATCH:
+            raise endpoints.BadRequestException(
+                "At most %d sessions can be created at once." % MAX_SESSION_BATCH)
+        wsck = request.websafeConferenceKey
+        c_key = ndb.Key(urlsafe=wsck)
+        # one ownership check and one id allocation for the whole batch
+        ids_future = Session.allocate_ids_async(
+            size=max(len(request.items), 1), parent=c_key)
+        self._ownConference(wsck)
+        first_id = ids_future.get_result()[0]
+
+        sessions, results = [], []
+        for i, form in enumerate(request.items):
+            try:
+                sessions.append(self._sessionFromForm(
+                    form, ndb.Key(Session, first_id + i, parent=c_key)))
+                results.append(SessionResultForm(session=form))
+            except endpoints.BadRequestException as e:
+                results.append(SessionResultForm(session=form, error=str(e)))
 
+        # one transaction writes every valid session and speaker counter
+        if sessions:
+            self._putSessionsAndCountSpeakers(c_key, sessions)
+            self._afterSessionsWritten(c_key, sessions)
+        return SessionResultForms(items=results)
 
-            # convert dates and time from strings to Date and time formatted  objects 
-            if data['startTime']:
-                data['startTime'] = datetime.strptime(data['startTime'][:5], "%H:%M").time()
-            
-            if data['date']:
-                data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
-           
-            
-            #get conference key
-            c_key = ndb.Key(urlsafe=wsck)
-            #auto-generate id for the session using parent as the conference key
-            c_id = Session.allocate_ids(size=1, parent=c_key)[0]
-            # make Session key from ID
-            s_key = ndb.Key(Session, c_id, parent=c_key)
-            #save the session websafe key
-            data['sessionWebSafeKey'] = s_key.urlsafe()
-            data['key'] = s_key
-            
-
-            # create session & return (modified) SessionForm
-            Session(**data).put()
-
-            speaker_name = data['speaker']
-
-            #check to see if for this session, this particular speaker has more than 1 session. If so, this speaker becomes the featured speaker.
-            conf_sessions = Session.query()
-            # get all sessions for this speaker in this conference
-            conf_sessions = conf_sessions.filter( Session.c_websafeKey == wsck)
-            conf_sessions = conf_sessions.filter(Session.speaker == speaker_name)
-            count = conf_sessions.count()
-            print "$$$ %s", count
-
-
-            #if so, add to the taskqueue to put this speaker name in memcache
-            if count > 1:
-                taskqueue.add(params={'speakerName' : speaker_name},
-                                   url='/tasks/set_featured_speaker', method='GET')
-
-            return request   
-        else:
-            raise ConflictException('Unauthorised to create this session')
+
+    @staticmethod
+    def _afterSessionsWritten(c_key, sessions):
+        """Update the search index and session snapshot of a conference
+        once new sessions are saved."""
+        search_index.indexQuietly(search_index.indexSessions, sessions)
+        session_snapshot.patch(c_key, sessions)
+
+
+    @staticmethod
+    @ndb.transactional
+    def _putSessionsAndCountSpeakers(c_key, sessions):
+        """Save sessions of one conference and bump their speakers' session
+        counts, in a single batched write."""
+        # "Jane Doe" and "jane doe" are counted as one speaker
+        names = sorted(set(speakers.normalize(ses.speaker)
+                           for ses in sessions if ses.speaker))
+        counters = ndb.get_multi([ndb.Key(SpeakerSessionCount, name, parent=c_key)
+                                  for name in names])
+        # until the speakers backfill has recounted every conference, a
+        # speaker counted for the first time may have sessions stored
+        # before counting began; start from those (the backfill recounts
+        # any it has not saved again yet)
+        seed = not migrations.done(speakers.MIGRATION)
+        counters = dict((name, counter or SpeakerSessionCount(
+                            id=name, parent=c_key,
+                            count=speakers.storedCount(c_key, name) if seed else 0))
+                        for name, counter in zip(names, counters))
+        featured = None
+        for ses in sessions:
+            if not ses.speaker:
+                continue
+            counter = counters[speakers.normalize(ses.speaker)]
+            counter.count += 1
+            # the latest speaker with more than 1 session wins
+            if counter.count > 1:
+                featured = ses.speaker
+        ndb.put_multi(sessions + counters.values())
+
+        #a speaker with more than 1 session in this conference becomes its
+        #featured speaker; the job only runs if this transaction commits,
+        #once for a burst of sessions
+        if featured:
+            jobs.schedule('featured_speaker', c_key, featured)
+
+
+    @staticmethod
+    def _featuredSpeakerKey(c_key):
+        """Return the key of a conference's FeaturedSpeaker entity."""
+        return ndb.Key(FeaturedSpeaker, 'featured', parent=c_key)
 
     
-    #set the memcache with speaker name
     @staticmethod
-    def _set_speaker_cache(featured_speaker):
-        print "####, %s", featured_speaker
-        memcache.set("MEMCAHE_KEY",featured_speaker)
+    def _featuredSpeakerJob(c_key, featured_speakers):
+        """Job: the latest of the queued featured speakers wins."""
+        ConferenceApi._set_speaker_cache(c_key.urlsafe(), featured_speakers[-1])
+
+
+    #set the featured speaker of a conference, in datastore and memcache
+    @staticmethod
+    def _set_speaker_cache(wsck, featured_speaker):
+        c_key = ndb.Key(urlsafe=wsck)
+        FeaturedSpeaker(key=ConferenceApi._featuredSpeakerKey(c_key),
+                        speaker=featured_speaker).put()
+        memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY % wsck, featured_speaker)
 
 
 
@@ -559,72 +1291,156 @@ class ConferenceApi(remote.Service):
     #Create a session
     @endpoints.method(SessionForm, SessionForm, path='session',
             http_method='POST', name='createSession')
+    @instrumented
     def createSession(self, request):
         """Create new session."""
         return self._createSessionObject(request)    
 
 
-    #Copy session to Form
-    def _copySessionToForm(self, session):
-        """Copy relevant fields from Session to SessionForm."""
-        cf = SessionForm()
-        
-        for field in cf.all_fields():
-            if hasattr(session, field.name):
-                # convert Date to date string and time to time string; just copy others
-                if field.name == "date":
-                    setattr(cf, field.name, str(getattr(session, field.name)))
-                
-                elif field.name == "startTime":
-                    setattr(cf, field.name, str(getattr(session, field.name)))    
-                
-                elif field.name == "c_websafeKey":
-                    setattr(cf, field.name, getattr(session, field.name))   
-                #a case for default values if no values entered
-                elif getattr(session, field.name) == None:
-                    setattr(cf, field.name, 'Default')    
-                else:
-                    setattr(cf, field.name, getattr(session, field.name))
+    #Create many sessions of one conference at once
+    @endpoints.method(SESSION_BATCH_REQUEST, SessionResultForms,
+            path='conference/{websafeConferenceKey}/sessions',
+            http_method='POST', name='createSessions')
+    @instrumented
+    def createSessions(self, request):
+        """Create a batch of sessions, reporting success or an error per session."""
+        return self._createSessionObjects(request)
+
+
+    def _search(self, index_name, request, conference=None):
+        """Run a full-text search, returning (entities, nextPageToken)."""
+        if not request.query:
+            raise endpoints.BadRequestException("'query' field required")
+        try:
+            keys, nextPageToken = search_index.find(
+                index_name, request.query, self._pageSize(request.pageSize),
+                request.cursor, conference)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid search query or cursor.")
+        # documents of deleted entities may linger in the index
+        entities = [e for e in ndb.get_multi(keys) if e is not None]
+        return entities, nextPageToken
+
+
+    @endpoints.method(SEARCH_REQUEST, ConferenceForms,
+            path='search/conferences',
+            http_method='GET', name='searchConferences')
+    @instrumented
+    def searchConferences(self, request):
+        """Full-text search of conference names, descriptions and topics,
+        best matches first."""
+        conferences, nextPageToken = self._search(
+            search_index.CONFERENCE_INDEX, request)
+        seats_left = seats.getSeatsAvailable([conf.key for conf in conferences])
+        names = self._legacyOrganizerNames(conferences)
+        return ConferenceForms(
+            items=[self._copyConferenceToForm(conf, names.get(conf.key),
+                seats_left.get(conf.key)) for conf in conferences],
+            nextPageToken=nextPageToken
+        )
 
-        cf.check_initialized()
-        return cf
+
+    @endpoints.method(SEARCH_REQUEST, SessionForms,
+            path='search/sessions',
+            http_method='GET', name='searchSessions')
+    @instrumented
+    def searchSessions(self, request):
+        """Full-text search of session names, highlights and speakers, best
+        matches first; optionally within one conference."""
+        sessions, nextPageToken = self._search(
+            search_index.SESSION_INDEX, request, request.websafeConferenceKey)
+        return SessionForms(
+            items=[self._copySessionToForm(ses) for ses in sessions],
+            nextPageToken=nextPageToken
+        )
+
+
+    #Copy session to Form
+    def _copySessionToForm(self, session, fields=None):
+        """Copy relevant fields (or only those in fields) from Session to SessionForm."""
+        return SESSION_MAPPER.copy(session, fields)
         
 
     #Get all sessions in a conference
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+    @endpoints.method(SESSION_LIST_REQUEST, SessionForms,
             path='getConferenceSessions/{websafeConferenceKey}',
             http_method='GET', name='getConferenceSessions')
+    @instrumented
     def getConferenceSessions(self, request):
-        """Get list of sessions in a conference."""
+        """Get list of sessions in a conference, optionally only some
+        fields; just the etag, flagged notModified, if If-None-Match holds
+        the list's current etag."""
         
-        #web safe key of this conference
-        wsck = request.websafeConferenceKey
+        #key of this conference
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        fields = self._checkFields(SESSION_MAPPER, request.fields)
+
+        # a client polling an unchanged list is answered from memcache
+        ifNoneMatch = self._ifNoneMatch()
+        if ifNoneMatch:
+            tag = etags.cachedSessionsTagAsync(c_key, fields).get_result()
+            if etags.matches(ifNoneMatch, tag):
+                return SessionForms(etag=tag, notModified=True)
+        # the session snapshot version is bumped by every session write;
+        # read it first so a write during the query changes the tag
+        etag = etags.sessionsTag(
+            session_snapshot.versionAsync(c_key).get_result(), fields)
         
-        #filter using this conference web safe key for sessions.
+        #sessions are children of their conference, so use an ancestor query;
+        #lists of indexed fields only are served by a projection query
         
-        sessions = Session.query()
-        sessions = sessions.filter(Session.c_websafeKey == wsck).fetch()
+        sessions = Session.query(ancestor=c_key)
+        projection = self._projectionFor(SESSION_MAPPER, fields, SESSION_LIST_PROJECTION)
+        if projection:
+            sessions = sessions.fetch(projection=projection)
          
-        return SessionForms(items=[self._copySessionToForm(ses) for ses in sessions])
+        return SessionForms(items=[self._copySessionToForm(ses, fields) for ses in sessions],
+                            etag=etag)
+
+
+    def _selectSessions(self, c_key, predicate):
+        """Return a conference's sessions matching a parsed predicate,
+        evaluated on its session snapshot."""
+        snapshot = session_snapshot.get(c_key)
+        return session_snapshot.sessions(
+            c_key, snapshot, session_snapshot.select(snapshot, predicate))
+
+
+    #Query a conference's sessions with AND/OR/NOT predicates
+    @endpoints.method(SESSION_QUERY_REQUEST, SessionForms,
+            path='querySessions/{websafeConferenceKey}',
+            http_method='GET', name='querySessions')
+    @instrumented
+    def querySessions(self, request):
+        """Get sessions of a conference matching a predicate such as
+        'NOT sessionType = WORKSHOP AND startTime < 19:00', which may use
+        more than one inequality."""
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        fields = self._checkFields(SESSION_MAPPER, request.fields)
+        try:
+            predicate = session_snapshot.parsePredicate(request.where)
+        except ValueError as e:
+            raise endpoints.BadRequestException('Invalid predicate: %s' % e)
+        sessions = self._selectSessions(c_key, predicate)
+        return SessionForms(
+            items=[self._copySessionToForm(ses, fields) for ses in sessions])
 
 
     #Get all sessions in a conference by type
     @endpoints.method(SES_TYPE_GET_REQUEST, SessionForms,
             path='getConferenceSessionsByType/{websafeConferenceKey,type}',
             http_method='GET', name='getConferenceSessionsByType')
+    @instrumented
     def getConferenceSessionsByType(self, request):
         """Get list of sessions in a conference by type."""
         
-        #web safe key of this conference
+        #key of this conference
         sesType = request.type
-        conf = request.websafeConferenceKey
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
          
-        #filter using this conference web safe key for sessions.
-        
-        sessions = Session.query()
-        sessions = sessions.filter(Session.c_websafeKey == conf)
-        sessions = sessions.filter(Session.sessionType == sesType).fetch()
-        
+        #filter the conference's cached session snapshot by type
+        sessions = self._selectSessions(
+            c_key, ('cmp', 'sessionType', '=', sesType))
         
         return SessionForms(items=[self._copySessionToForm(ses) for ses in sessions])
 
@@ -634,77 +1450,123 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SES_SPEAKER_GET_REQUEST, SessionForms,
             path='getSessionsBySpeaker/{speaker}',
             http_method='GET', name='getSessionsBySpeaker')
+    @instrumented
     def getSessionsBySpeaker(self, request):
         """Get all sessions by speaker"""
         
-        #web safe key of this conference
-        speaker = request.speaker
-        #c_wsck = request.websafeConferenceKey
-        
- 
-        #filter using this conference web safe key for sessions.
-        #print wsck
-        sessions = Session.query()
-        
-        sessions = sessions.filter(Session.speaker == speaker).fetch()
-        
-        
+        sessions = speakers.sessionsOf(request.speaker)
         return SessionForms(items=[self._copySessionToForm(ses) for ses in sessions])        
 
 
     #add session to wishlist
+    def _wishListItemKey(self, p_key, sesKey):
+        """Return the WishListItem key of a session for a user, checking
+        that sesKey is a session key."""
+        try:
+            ses_key = ndb.Key(urlsafe=sesKey)
+        except Exception:
+            ses_key = None
+        if ses_key is None or ses_key.kind() != Session._get_kind():
+            raise endpoints.BadRequestException(
+                'Invalid session key: %s' % sesKey)
+        return ndb.Key(WishListItem, ses_key.urlsafe(), parent=p_key)
+
+
+    def _wishListProfileKey(self):
+        """Return the user's Profile key, moving a legacy wishlist stored
+        on the Profile into WishListItem entities first."""
+        prof = self._getProfileFromUser() # get user Profile
+        if prof.wishListSessionKeys:
+            self._migrateWishList(prof.key)
+            profile_cache.invalidate(prof.key)
+        return prof.key
+
+
+    @ndb.transactional
+    def _migrateWishList(self, p_key):
+        """Move Profile.wishListSessionKeys into WishListItem entities."""
+        prof = p_key.get()
+        items = [WishListItem(id=sesKey, parent=p_key)
+                 for sesKey in set(prof.wishListSessionKeys)]
+        prof.wishListSessionKeys = []
+        ndb.put_multi(items + [prof])
+
+
     def _sessionWishList(self, request):
         """add session to wishlist"""
-        retval = None
-        prof = self._getProfileFromUser() # get user Profile
-        
+        p_key = self._wishListProfileKey()
+        retval = self._addToWishList(
+            self._wishListItemKey(p_key, request.sessionKey))
+        return BooleanMessage(data=retval)
 
-        #get url safe session key from request
-        sesKey= request.sessionKey
-        
-        # check if user already added to wishlist
-        if sesKey in prof.wishListSessionKeys:
-            retval = False
+
+    @ndb.transactional
+    def _addToWishList(self, item_key):
+        """Add a session to the wishlist; items are keyed by session, so
+        one key lookup finds a duplicate."""
+        if item_key.get():
             raise ConflictException(
                     "You have already added this session to your wish list")
-        else:
-            # add wishlist
-            prof.wishListSessionKeys.append(sesKey)
-            retval = True
+        WishListItem(key=item_key).put()
+        return True
 
-        # write things back to the datastore & return
-        prof.put()
-        return BooleanMessage(data=retval)
+
+    @ndb.transactional
+    def _removeFromWishList(self, item_key):
+        """Remove a session from the wishlist; False if it was not on it."""
+        if not item_key.get():
+            return False
+        item_key.delete()
+        return True
 
     #add session wish list based on the url safe session key
     @endpoints.method(SESSION_WISH_REQUEST, BooleanMessage,
             path='sessionWishList/{sessionKey}',
             http_method='POST', name='addSessionToWishlist')
+    @instrumented
     def addSessionToWishlist(self, request):
         """Add session to wish list."""
         return self._sessionWishList(request)    
 
 
+    #remove a session from the wish list
+    @endpoints.method(SESSION_WISH_REQUEST, BooleanMessage,
+            path='sessionWishList/{sessionKey}',
+            http_method='DELETE', name='removeSessionFromWishlist')
+    @instrumented
+    def removeSessionFromWishlist(self, request):
+        """Remove session from wish list."""
+        p_key = self._wishListProfileKey()
+        retval = self._removeFromWishList(
+            self._wishListItemKey(p_key, request.sessionKey))
+        if not retval:
+            raise endpoints.NotFoundException(
+                'Session is not in your wish list: %s' % request.sessionKey)
+        return BooleanMessage(data=retval)
+
+
     #get sessions in wishlist
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(WISHLIST_REQUEST, SessionForms,
             path='getSessionsInWishList',
             http_method='POST', name='getSessionsInWishList')
+    @instrumented
     def getSessionsInWishList(self, request):
-        """Return sessions in wishlist"""
-        # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-
-        # get user profile
-        prof = self._getProfileFromUser() # get user Profile
-        
-        ses_keys = [ndb.Key(urlsafe=ses) for ses in prof.wishListSessionKeys]
-        sessions = ndb.get_multi(ses_keys)
-        
-        
+        """Return sessions in wishlist, one page at a time"""
+        # get user profile key (this also makes sure the user is authed)
+        p_key = self._wishListProfileKey()
+
+        # a keys-only ancestor query pages through the items; their ids are
+        # the session keys
+        item_keys, nextPageToken = self._fetchPage(
+            WishListItem.query(ancestor=p_key), request.pageSize,
+            request.cursor, keys_only=True)
+        sessions = ndb.get_multi(
+            [ndb.Key(urlsafe=item_key.id()) for item_key in item_keys])
+
+        # sessions deleted since they were added are skipped
         return SessionForms(
-            items=[self._copySessionToForm(ses) for ses in sessions]
+            items=[self._copySessionToForm(ses) for ses in sessions if ses],
+            nextPageToken=nextPageToken
         )
 
 #Query 1
@@ -712,6 +1574,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESSION_TYPE_SPEAKER, SessionForms,
             path='sessionTypeBySpeaker/{sessionType,speakerName}',
             http_method='POST', name='sessionTypeBySpeaker')
+    @instrumented
     def sessionTypeBySpeaker(self, request):
         """Return session based on type and speaker name"""
         # make sure user is authed
@@ -721,10 +1584,8 @@ class ConferenceApi(remote.Service):
 
         sesType = request.sessionType
         spkrName = request.speakerName
-        sessions = Session.query()
-        sessions = sessions.filter(Session.speaker == spkrName)
-        sessions = sessions.filter (Session.sessionType == sesType)
-        sesssions = sessions.fetch()
+        sessions = [ses for ses in speakers.sessionsOf(spkrName)
+                    if ses.sessionType == sesType]
 
         # return set of SessionForma objects 
         return SessionForms(
@@ -737,6 +1598,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONFERENCE_SESSION_SPEAKER, SessionForms,
             path='allConferenceSessionsOfSpeaker/{conferencewebsafekey,speakerName}',
             http_method='POST', name='allConferenceSessionsOfSpeaker')
+    @instrumented
     def allConferenceSessionsOfSpeaker(self, request):
         """Return sessions of a speaker in a conference"""
         # make sure user is authed
@@ -744,15 +1606,16 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        confwsk = request.conferencewebsafekey
+        c_key = ndb.Key(urlsafe=request.conferencewebsafekey)
         spkrName = request.speakerName
         
-        #find all sessions in this conference
-        confses = Session.query()
-        confses = confses.filter(Session.c_websafeKey == confwsk)
-
-        sessions = confses.filter(Session.speaker == spkrName)
-        sessions = sessions.fetch()
+        #find the speaker's sessions in this conference's session snapshot,
+        #whatever the case and spacing of the name
+        name = speakers.normalize(spkrName)
+        snapshot = session_snapshot.get(c_key)
+        sessions = session_snapshot.sessions(c_key, snapshot,
+            [i for i, speaker in enumerate(snapshot['speaker'])
+             if speakers.normalize(speaker) == name])
 
 
         #sessions = Session.query()
@@ -765,14 +1628,20 @@ class ConferenceApi(remote.Service):
             items=[self._copySessionToForm(ses) for ses in sessions]
         )    
 
-     #Task 4 Endpoint method to get the featured speaker.
-    @endpoints.method(message_types.VoidMessage, FeaturedSpeakerMessage,
-            path='getFeaturedSpeaker',
+     #Task 4 Endpoint method to get the featured speaker of a conference.
+    @endpoints.method(CONF_GET_REQUEST, FeaturedSpeakerMessage,
+            path='getFeaturedSpeaker/{websafeConferenceKey}',
             http_method='GET', name='getFeaturedSpeaker')
+    @instrumented
     def getFeaturedSpeaker(self, request):
-        """Get featured speaker from memcache""" 
-        spkr=memcache.get("MEMCAHE_KEY")
-        print "^^^ %s", spkr
+        """Get featured speaker of a conference, from memcache if possible""" 
+        wsck = request.websafeConferenceKey
+        spkr = memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY % wsck)
+        if spkr is None:
+            #fall back to the datastore copy and cache it again
+            featured = self._featuredSpeakerKey(ndb.Key(urlsafe=wsck)).get()
+            spkr = featured.speaker if featured else ''
+            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY % wsck, spkr)
         return FeaturedSpeakerMessage(data=spkr)    
 
 
@@ -781,6 +1650,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='filterPlayground',
             http_method='POST', name='filterPlayground')
+    @instrumented
     def filterPlayground(self, request):
         """Return conferences created by user."""
         # make sure user is authed
@@ -805,5 +1675,64 @@ class ConferenceApi(remote.Service):
         )
 
 
+# - - - Admin - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _requireAdmin(self):
+        """Make sure the current user is one of the configured admins."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        if user.email() not in ADMIN_EMAILS:
+            raise endpoints.ForbiddenException('Admin access required')
+
+
+    @endpoints.method(STATS_REQUEST, EndpointStatsForms,
+            path='admin/endpointStats',
+            http_method='GET', name='getEndpointStats')
+    def getEndpointStats(self, request):
+        """Return per-endpoint latency and RPC costs over the last minutes (admin only)."""
+        self._requireAdmin()
+        minutes = min(max(request.minutes or DEFAULT_STATS_MINUTES, 1),
+                      MAX_STATS_MINUTES)
+        summaries = instrumentation.stats(minutes)
+        items = []
+        for name, summary in sorted(summaries.items()):
+            items.append(EndpointStatsForm(
+                endpoint=name,
+                calls=summary['calls'],
+                errors=summary['errors'],
+                meanMs=summary['meanMs'],
+                p50Ms=summary['p50Ms'],
+                p95Ms=summary['p95Ms'],
+                p99Ms=summary['p99Ms'],
+                datastoreGets=summary['datastore_get_rpcs'],
+                datastoreGetMs=summary['datastore_get_ms'],
+                datastorePuts=summary['datastore_put_rpcs'],
+                datastorePutMs=summary['datastore_put_ms'],
+                datastoreQueries=summary['datastore_query_rpcs'],
+                datastoreQueryMs=summary['datastore_query_ms'],
+                datastoreOther=summary['datastore_other_rpcs'],
+                memcacheRpcs=summary['memcache_rpcs'],
+                memcacheMs=summary['memcache_ms'],
+                memcacheHits=summary['memcacheHits'],
+                memcacheMisses=summary['memcacheMisses'],
+                cacheHits=summary['cacheHits'],
+                cacheMisses=summary['cacheMisses'],
+                cacheHitRatio=summary['cacheHitRatio'],
+                profileCacheHits=summary['profileCacheHits'],
+                profileCacheMisses=summary['profileCacheMisses'],
+                profileCacheHitRatio=summary['profileCacheHitRatio'],
+                taskqueueAdds=summary['tasksAdded'],
+                jobsCoalesced=summary['jobsCoalesced'],
+                jobItems=summary['jobItems'],
+                jobRetries=summary['jobRetries'],
+                jobLagMs=summary['jobLagMs'],
+            ))
+        return EndpointStatsForms(items=items)
+
+
+# background jobs, run by main.app at /tasks/jobs/<name>
+jobs.register('featured_speaker', ConferenceApi._featuredSpeakerJob)
+
 # registers API
 api = endpoints.api_server([ConferenceApi]) 
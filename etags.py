@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""etags.py
+
+ETags for conditional GETs of a conference and of its session list, so
+that clients polling for changes are answered from memcache alone.
+
+A conference's tag combines its `updated` time, which memcache keeps per
+conference, with its live seat count, which seats.py keeps there anyway,
+and the version of its organizer: conferences saved before they stored
+organizerDisplayName show the organizer's Profile name, which changes
+without the conference being saved, so saving a profile bumps the
+version (see versions.py). Readers get
+the version before they read the name, so a tag never claims a name
+newer than the one it was built with.
+
+A session list's tag is the version of the conference's session
+snapshot, which every session write bumps. Requests whose If-None-Match
+still matches get a response holding only the etag, with notModified
+set (Cloud Endpoints cannot send a 304); anything missing from memcache
+means the entity is read and the tag cached again.
+
+Writers of a Conference call conferencesChanged() after the put, which
+sets the new time; readers only add it, so a reader that saw the old
+entity never overwrites a newer time.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import seats
+import session_snapshot
+import versions
+
+MEMCACHE_CONFERENCE_UPDATED_KEY = "CONFERENCE_UPDATED:%s"
+MEMCACHE_ORGANIZER_VERSION_KEY = "ORGANIZER_VERSION:%s"
+UPDATED_CACHE_TIME = 3600
+
+
+def matches(header, tag):
+    """Whether an If-None-Match header value lists tag; weak tags match
+    too, as the comparison for GETs is the weak one."""
+    if not header or not tag:
+        return False
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == tag:
+            return True
+    return False
+
+
+def _stamp(updated):
+    # entities saved before `updated` existed have none until next saved
+    return updated.strftime('%Y%m%d%H%M%S%f') if updated else '0'
+
+
+def conferenceTag(stamp, seats_left, organizer_version):
+    """Return the tag of a conference with the given updated stamp, seats
+    available and organizer version."""
+    return '"c%s-%d-%d"' % (stamp, seats_left or 0, organizer_version)
+
+
+@ndb.tasklet
+def organizerVersionAsync(p_key):
+    """Return the current version of an organizer, starting one if needed;
+    get it before reading the organizer's name."""
+    version = yield versions.getAsync(MEMCACHE_ORGANIZER_VERSION_KEY % p_key.id())
+    raise ndb.Return(version or 0)
+
+
+def organizerChanged(p_key):
+    """Make the tags of a user's conferences stale; call after saving
+    their profile."""
+    memcache.incr(MEMCACHE_ORGANIZER_VERSION_KEY % p_key.id())
+
+
+@ndb.tasklet
+def cachedConferenceTagAsync(c_key):
+    """Return the current tag of a conference from memcache, or None."""
+    ctx = ndb.get_context()
+    wsck = c_key.urlsafe()
+    stamp, seats_left, organizer_version = yield (
+        ctx.memcache_get(MEMCACHE_CONFERENCE_UPDATED_KEY % wsck),
+        ctx.memcache_get(seats.MEMCACHE_SEATS_KEY % wsck),
+        ctx.memcache_get(MEMCACHE_ORGANIZER_VERSION_KEY % c_key.parent().id()))
+    if stamp is None or seats_left is None or organizer_version is None:
+        raise ndb.Return(None)
+    raise ndb.Return(conferenceTag(stamp, seats_left, organizer_version))
+
+
+def conferenceTagFor(conf, seats_left, organizer_version):
+    """Return the tag of a conference just read, caching its updated time;
+    organizer_version is the one got before the organizer name was."""
+    stamp = _stamp(conf.updated)
+    memcache.add(MEMCACHE_CONFERENCE_UPDATED_KEY % conf.key.urlsafe(), stamp,
+                 time=UPDATED_CACHE_TIME)
+    return conferenceTag(stamp, seats_left, organizer_version)
+
+
+def conferencesChanged(conferences):
+    """Cache the updated time of conferences just saved."""
+    memcache.set_multi(dict(
+        (MEMCACHE_CONFERENCE_UPDATED_KEY % conf.key.urlsafe(), _stamp(conf.updated))
+        for conf in conferences), time=UPDATED_CACHE_TIME)
+
+
+def sessionsTag(version, fields=None):
+    """Return the tag of a session list at a snapshot version (see
+    session_snapshot.versionAsync), limited to fields if given."""
+    if version is None:
+        return None
+    if fields:
+        return '"s%d-%s"' % (version, '.'.join(sorted(fields)))
+    return '"s%d"' % version
+
+
+@ndb.tasklet
+def cachedSessionsTagAsync(c_key, fields=None):
+    """Return the current tag of a conference's session list from
+    memcache, or None."""
+    version = yield ndb.get_context().memcache_get(
+        session_snapshot.MEMCACHE_SNAPSHOT_VERSION_KEY % c_key.urlsafe())
+    raise ndb.Return(sessionsTag(version, fields))
+
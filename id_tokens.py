@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""id_tokens.py
+
+Local verification of Google id_tokens: RS256-signed JWTs checked
+against Google's published signing keys (a JWKS document), so resolving
+the user of a token needs no call to the tokeninfo endpoint.
+
+The keys are cached per instance and in memcache for as long as Google's
+Cache-Control allows. A token signed with a key not seen yet refreshes
+them, at most once every MIN_REFRESH seconds. setCertificateSource()
+swaps the network fetch for another source, such as the stub in
+benchmarks/harness.py.
+
+"""
+
+import base64
+import binascii
+import json
+import re
+import threading
+import time
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+
+from google.appengine.api import memcache
+from google.appengine.api import urlfetch
+
+CERTS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+MEMCACHE_CERTS_KEY = 'GOOGLE_SIGNING_KEYS'
+# used when the certificate response has no max-age
+DEFAULT_CERTS_TIME = 3600
+MIN_REFRESH = 60
+FETCH_DEADLINE = 5
+# seconds of clock difference tolerated on exp and iat
+CLOCK_SKEW = 300
+
+
+class InvalidToken(Exception):
+    """The token is wrongly signed, expired or not for us."""
+
+
+class MalformedToken(InvalidToken):
+    """The token is no JWT at all, such as an access token."""
+
+
+class KeysUnavailable(Exception):
+    """The signing keys could not be fetched."""
+
+
+def fetchCertificates():
+    """Default certificate source: return Google's JWKS document and the
+    seconds it may be cached."""
+    try:
+        resp = urlfetch.fetch(CERTS_URL, deadline=FETCH_DEADLINE,
+                              validate_certificate=True)
+    except urlfetch.Error as e:
+        raise KeysUnavailable(str(e))
+    if resp.status_code != 200:
+        raise KeysUnavailable('HTTP %d' % resp.status_code)
+    max_age = re.search(r'max-age=(\d+)', resp.headers.get('Cache-Control', ''))
+    return (json.loads(resp.content),
+            int(max_age.group(1)) if max_age else DEFAULT_CERTS_TIME)
+
+
+_source = fetchCertificates
+_lock = threading.Lock()
+# per-instance copy: {kid: RSA key}, when it expires, when last fetched
+_keys = {'keys': None, 'expires': 0, 'fetched': 0}
+
+
+def setCertificateSource(source):
+    """Get signing keys from source() instead of the network; it returns
+    a JWKS document and the seconds it may be cached."""
+    global _source
+    with _lock:
+        _source = source
+        _keys.update(keys=None, expires=0, fetched=0)
+    memcache.delete(MEMCACHE_CERTS_KEY)
+
+
+def _b64decode(text):
+    text = str(text)
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _number(text):
+    return long(binascii.hexlify(_b64decode(text)), 16)
+
+
+def _rsaKeys(jwks):
+    return dict((key['kid'], RSA.construct((_number(key['n']), _number(key['e']))))
+                for key in jwks.get('keys', ()) if key.get('kty') == 'RSA')
+
+
+def _signingKeys(refresh=False):
+    """Return {kid: RSA key}, from this instance, memcache or the source."""
+    now = time.time()
+    with _lock:
+        if not refresh and _keys['keys'] is not None and now < _keys['expires']:
+            return _keys['keys']
+        if refresh and now < _keys['fetched'] + MIN_REFRESH:
+            return _keys['keys'] or {}
+
+    cached = None if refresh else memcache.get(MEMCACHE_CERTS_KEY)
+    if cached and now < cached[1]:
+        jwks, expires = cached
+    else:
+        jwks, max_age = _source()
+        expires = now + max_age
+        memcache.set(MEMCACHE_CERTS_KEY, (jwks, expires), time=max_age)
+    keys = _rsaKeys(jwks)
+    with _lock:
+        _keys.update(keys=keys, expires=expires, fetched=now)
+    return keys
+
+
+def verify(token, audiences):
+    """Return the claims of a valid id_token issued to one of audiences
+    (client ids); raise InvalidToken otherwise, or KeysUnavailable."""
+    try:
+        header_b64, claims_b64, signature_b64 = str(token).split('.')
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(claims_b64))
+        signature = _b64decode(signature_b64)
+    except (ValueError, TypeError, UnicodeEncodeError):
+        raise MalformedToken('not a JWT')
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise MalformedToken('not a JWT')
+    if header.get('alg') != 'RS256':
+        raise InvalidToken('unsupported algorithm: %s' % header.get('alg'))
+
+    key = _signingKeys().get(header.get('kid'))
+    if key is None:
+        # Google rotates its keys; fetch them again once in a while
+        key = _signingKeys(refresh=True).get(header.get('kid'))
+    if key is None:
+        raise InvalidToken('unknown signing key')
+    digest = SHA256.new('%s.%s' % (header_b64, claims_b64))
+    if not PKCS1_v1_5.new(key).verify(digest, signature):
+        raise InvalidToken('bad signature')
+
+    now = time.time()
+    if claims.get('iss') not in ISSUERS:
+        raise InvalidToken('wrong issuer')
+    if claims.get('aud') not in audiences:
+        raise InvalidToken('wrong audience')
+    if not claims.get('sub'):
+        raise InvalidToken('no subject')
+    if claims.get('exp', 0) + CLOCK_SKEW < now:
+        raise InvalidToken('expired')
+    if claims.get('iat', 0) - CLOCK_SKEW > now:
+        raise InvalidToken('issued in the future')
+    return claims
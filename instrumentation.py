@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+"""instrumentation.py
+
+Per-request cost accounting. Wrap an endpoint method or task handler
+with @instrumented and every call records its wall time plus the count
+and latency of the datastore gets, puts and queries, memcache hits and
+misses and taskqueue adds it made. apiproxy hooks do the counting, so
+nothing inside the endpoints needs to change.
+
+Each call is logged as one JSON line and added to per-endpoint counters
+and a latency histogram in memcache, bucketed by minute. Each instance
+adds its calls up and flushes them with one offset_multi every
+FLUSH_SECONDS, so a request seldom waits for memcache. stats() adds up
+the last minutes across all instances for the admin stats endpoint.
+
+Names are registered as they are decorated (and as jobs are registered,
+see jobs.py). An instance only knows the names of the modules it has
+imported, so flush() also merges them into a list kept in memcache,
+which stats() reads: the endpoint instance reports task handlers too.
+
+"""
+
+import functools
+import json
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+NAMESPACE = 'instrumentation'
+WINDOW_SECONDS = 60
+# upper bounds (ms) of the latency histogram buckets; the last is open
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# datastore calls are reported in three groups, everything else as "other"
+DATASTORE_CATEGORIES = {
+    'Get': 'datastore_get',
+    'Put': 'datastore_put',
+    'Delete': 'datastore_put',
+    'RunQuery': 'datastore_query',
+    'Next': 'datastore_query',
+}
+CATEGORIES = ('datastore_get', 'datastore_put', 'datastore_query',
+              'datastore_other', 'memcache', 'taskqueue', 'other')
+COUNTERS = ('calls', 'errors', 'wall_ms', 'memcache_hits', 'memcache_misses',
+            'tasks_added', 'cache_hits', 'cache_misses', 'profile_cache_hits',
+            'profile_cache_misses', 'jobs_coalesced', 'job_items',
+            'job_retries', 'job_lag_ms') + \
+    tuple('%s_%s' % (c, m) for c in CATEGORIES for m in ('rpcs', 'ms')) + \
+    tuple('latency_%d' % i for i in range(len(LATENCY_BUCKETS) + 1))
+
+# counts of an instance are flushed to memcache at most this often
+FLUSH_SECONDS = 10
+# keys per memcache get_multi in stats()
+STATS_BATCH = 1000
+# the names instrumented on any instance
+NAMES_KEY = 'names'
+CAS_RETRIES = 3
+
+_local = threading.local()
+# memcache key -> count not flushed yet, for this instance
+_pending = {}
+_pendingLock = threading.Lock()
+_lastFlush = [time.time()]
+# every name instrumented() records under on this instance
+_names = set()
+
+
+class _Call(object):
+    """What one instrumented call has done so far."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.rpcStarts = {}
+
+
+def _category(service, call):
+    if service == 'datastore_v3':
+        return DATASTORE_CATEGORIES.get(call, 'datastore_other')
+    if service in ('memcache', 'taskqueue'):
+        return service
+    return 'other'
+
+
+def _preCall(service, call, request, response, rpc=None):
+    record = getattr(_local, 'call', None)
+    if record is not None:
+        record.rpcStarts[id(rpc)] = time.time()
+
+
+def _postCall(service, call, request, response, rpc=None):
+    record = getattr(_local, 'call', None)
+    if record is None:
+        return
+    category = _category(service, call)
+    started = record.rpcStarts.pop(id(rpc), None)
+    counters = record.counters
+    counters[category + '_rpcs'] += 1
+    if started is not None:
+        counters[category + '_ms'] += int((time.time() - started) * 1000)
+    if service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        counters['memcache_hits'] += hits
+        counters['memcache_misses'] += request.key_size() - hits
+    elif service == 'taskqueue' and call == 'BulkAdd':
+        counters['tasks_added'] += request.add_request_size()
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+    'instrumentation', _preCall)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+    'instrumentation', _postCall)
+
+
+def count(counter, n=1):
+    """Add n to one of COUNTERS for the current instrumented call, if any;
+    lets caches report their own hits and misses."""
+    record = getattr(_local, 'call', None)
+    if record is not None:
+        record.counters[counter] += n
+
+
+def _bucket(wall_ms):
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if wall_ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+
+def _finish(record, failed):
+    """Log the call and add it to the current window's counters."""
+    counters = record.counters
+    wall_ms = int((time.time() - record.start) * 1000)
+    counters['calls'] = 1
+    counters['errors'] = 1 if failed else 0
+    counters['wall_ms'] = wall_ms
+    counters['latency_%d' % _bucket(wall_ms)] = 1
+    entry = dict((k, v) for k, v in counters.items() if v)
+    entry['endpoint'] = record.name
+    logging.info('endpoint_stats %s', json.dumps(entry, sort_keys=True))
+
+    window = int(record.start) // WINDOW_SECONDS
+    prefix = '%d:%s:' % (window, record.name)
+    with _pendingLock:
+        for counter, n in counters.items():
+            if n:
+                _pending[prefix + counter] = _pending.get(prefix + counter, 0) + n
+        if time.time() - _lastFlush[0] < FLUSH_SECONDS:
+            return
+    flush()
+
+
+def flush():
+    """Add this instance's pending counts to memcache."""
+    with _pendingLock:
+        offsets = dict(_pending)
+        _pending.clear()
+        _lastFlush[0] = time.time()
+    if not offsets:
+        return
+    try:
+        memcache.offset_multi(offsets, namespace=NAMESPACE, initial_value=0)
+        _publishNames()
+    except Exception:
+        # stats must never break the request they describe
+        logging.exception('could not record endpoint stats')
+
+
+def _publishNames():
+    """Merge this instance's names into the list in memcache."""
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        known = client.gets(NAMES_KEY, namespace=NAMESPACE)
+        if known is None:
+            if client.add(NAMES_KEY, sorted(_names), namespace=NAMESPACE):
+                return
+        elif _names.issubset(known) or client.cas(
+                NAMES_KEY, sorted(_names.union(known)), namespace=NAMESPACE):
+            return
+
+
+def names():
+    """Return the names instrumented on this or any other instance."""
+    return sorted(_names.union(
+        memcache.get(NAMES_KEY, namespace=NAMESPACE) or ()))
+
+
+def instrumented(func=None, name=None):
+    """Decorator recording the cost of each call of an endpoint or handler.
+
+    Use it bare on endpoint methods (the function name is the endpoint
+    name) or as @instrumented(name='...') on task handlers.
+    """
+    if func is None:
+        return functools.partial(instrumented, name=name)
+    name = name or func.__name__
+    _names.add(name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, 'call', None) is not None:
+            # already inside an instrumented call; count it there
+            return func(*args, **kwargs)
+        record = _local.call = _Call(name)
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _local.call = None
+            _finish(record, failed)
+    return wrapper
+
+
+def _percentile(buckets, calls, pct):
+    """Upper bound of the histogram bucket holding the pct-th percentile."""
+    if not calls:
+        return 0
+    wanted = pct / 100.0 * calls
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= wanted:
+            return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) \
+                else LATENCY_BUCKETS[-1] * 2
+    return LATENCY_BUCKETS[-1] * 2
+
+
+def stats(minutes=15):
+    """Return {endpoint: summary dict} over the last minutes, all instances."""
+    flush()
+    all_names = names()
+    last = int(time.time()) // WINDOW_SECONDS
+    windows = range(last - minutes + 1, last + 1)
+    keys = ['%d:%s:%s' % (w, name, counter)
+            for w in windows for name in all_names for counter in COUNTERS]
+    client = memcache.Client()
+    rpcs = [client.get_multi_async(keys[i:i + STATS_BATCH],
+                                   namespace=NAMESPACE)
+            for i in range(0, len(keys), STATS_BATCH)]
+    values = {}
+    for rpc in rpcs:
+        values.update(rpc.get_result())
+
+    summaries = {}
+    for name in all_names:
+        totals = dict.fromkeys(COUNTERS, 0)
+        for w in windows:
+            for counter in COUNTERS:
+                totals[counter] += values.get('%d:%s:%s' % (w, name, counter), 0)
+        calls = totals['calls']
+        if not calls:
+            continue
+        lookups = totals['cache_hits'] + totals['cache_misses']
+        profileLookups = totals['profile_cache_hits'] + \
+            totals['profile_cache_misses']
+        buckets = [totals['latency_%d' % i]
+                   for i in range(len(LATENCY_BUCKETS) + 1)]
+        summary = {
+            'calls': calls,
+            'errors': totals['errors'],
+            'meanMs': float(totals['wall_ms']) / calls,
+            'p50Ms': _percentile(buckets, calls, 50),
+            'p95Ms': _percentile(buckets, calls, 95),
+            'p99Ms': _percentile(buckets, calls, 99),
+            'memcacheHits': float(totals['memcache_hits']) / calls,
+            'memcacheMisses': float(totals['memcache_misses']) / calls,
+            'tasksAdded': float(totals['tasks_added']) / calls,
+            'cacheHits': float(totals['cache_hits']) / calls,
+            'cacheMisses': float(totals['cache_misses']) / calls,
+            'cacheHitRatio': float(totals['cache_hits']) / lookups
+                if lookups else 0.0,
+            # profile_cache.py
+            'profileCacheHits': float(totals['profile_cache_hits']) / calls,
+            'profileCacheMisses': float(totals['profile_cache_misses']) / calls,
+            'profileCacheHitRatio': float(totals['profile_cache_hits']) /
+                profileLookups if profileLookups else 0.0,
+            # background jobs (see jobs.py)
+            'jobsCoalesced': float(totals['jobs_coalesced']) / calls,
+            'jobItems': float(totals['job_items']) / calls,
+            'jobRetries': totals['job_retries'],
+            'jobLagMs': float(totals['job_lag_ms']) / calls,
+        }
+        for category in CATEGORIES:
+            rpcs = totals[category + '_rpcs']
+            summary[category + '_rpcs'] = float(rpcs) / calls
+            summary[category + '_ms'] = \
+                float(totals[category + '_ms']) / rpcs if rpcs else 0.0
+        summaries[name] = summary
+    return summaries
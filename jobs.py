@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""jobs.py
+
+Coalesced background jobs. Work for a job type and a scope (an entity
+key, such as a conference) is recorded as JobItem entities under the
+scope, so it can be written in the same transaction as the change that
+causes it. Once that commits, schedule() adds one task named after the
+job type, the scope and the current coalescing window; every later item
+in the window finds the task already there. A burst such as a bulk
+schedule upload therefore runs the job once, at the end of the window,
+over all its items.
+
+The task hands the scope's pending items to the job's handler in
+batches, oldest first, and deletes each batch once it is handled. An
+exception fails the task and App Engine retries it with the items still
+pending, so handlers must be idempotent. Each run is instrumented as
+'jobs.<type>', which also counts its items, retries and the lag from the
+oldest item to the run; schedule() counts the tasks it saved as
+'jobs_coalesced' on the caller.
+
+"""
+
+import hashlib
+import logging
+import re
+import time
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+import webapp2
+
+import instrumentation
+from models import JobItem
+
+JOB_URL = '/tasks/jobs/%s'
+DEFAULT_WINDOW = 10
+DEFAULT_BATCH = 100
+# task requests may run for 10 minutes; leave room for the last batch
+TIME_BUDGET = 480
+_TASK_NAME = re.compile(r'^[a-zA-Z0-9_-]{1,400}$')
+
+
+class Job(object):
+    """A registered job type: its handler, window and batch size."""
+
+    def __init__(self, name, handler, window, batch_size):
+        self.name = name
+        self.handler = handler
+        self.window = window
+        self.batch_size = batch_size
+        self.run = instrumentation.instrumented(self._run, name='jobs.%s' % name)
+
+    def _taskName(self, scope_key, window):
+        scope = scope_key.urlsafe()
+        if not _TASK_NAME.match(scope):
+            scope = hashlib.sha1(scope).hexdigest()
+        return '%s-%s-%d' % (self.name, scope, window)
+
+    def addTask(self, scope_key, window=None):
+        """Make sure a task runs the job for scope at the end of a window
+        (by default the current one)."""
+        if window is None:
+            window = int(time.time() // self.window)
+        countdown = max(0, (window + 1) * self.window - time.time())
+        try:
+            taskqueue.add(name=self._taskName(scope_key, window),
+                          url=JOB_URL % self.name,
+                          params={'scope': scope_key.urlsafe()},
+                          countdown=countdown)
+        except taskqueue.TaskAlreadyExistsError:
+            instrumentation.count('jobs_coalesced')
+        except taskqueue.TombstonedTaskError:
+            # this window's task has run already; use the next one
+            self.addTask(scope_key, window + 1)
+
+    def _run(self, scope_key, retries=0):
+        """Handle the pending items of scope, a batch at a time."""
+        if retries:
+            instrumentation.count('job_retries', retries)
+        deadline = time.time() + TIME_BUDGET
+        # an ancestor query sees every item committed before it
+        query = JobItem.query(JobItem.jobType == self.name,
+                              ancestor=scope_key).order(JobItem.created)
+        first = True
+        while True:
+            items = query.fetch(self.batch_size)
+            if not items:
+                return
+            if first:
+                lag = datetime.utcnow() - items[0].created
+                instrumentation.count('job_lag_ms',
+                                      int(lag.total_seconds() * 1000))
+                first = False
+            self.handler(scope_key, [item.payload for item in items])
+            ndb.delete_multi([item.key for item in items])
+            instrumentation.count('job_items', len(items))
+            if len(items) < self.batch_size:
+                return
+            if time.time() > deadline:
+                self.addTask(scope_key, int(time.time() // self.window) + 1)
+                return
+
+
+_jobs = {}
+
+
+def register(name, handler, window=DEFAULT_WINDOW, batch_size=DEFAULT_BATCH):
+    """Register a job type. handler(scope_key, payloads) gets the payloads
+    of up to batch_size items at a time, oldest first; bursts within
+    window seconds are handled together."""
+    _jobs[name] = Job(name, handler, window, batch_size)
+
+
+def schedule(name, scope_key, payload=None):
+    """Record one item of work for a job and make sure a task will handle
+    it; inside a transaction, neither happens unless it commits."""
+    job = _jobs[name]
+    JobItem(parent=scope_key, jobType=name, payload=payload).put()
+    # named tasks cannot be transactional, so add it after the commit;
+    # should that fail, the items wait for the scope's next schedule()
+    ndb.get_context().call_on_commit(lambda: job.addTask(scope_key))
+
+
+class JobHandler(webapp2.RequestHandler):
+    def post(self, name):
+        """Run a job for one scope"""
+        job = _jobs.get(name)
+        if job is None:
+            # a job type removed while tasks were queued; don't retry
+            logging.error('unknown job type: %s', name)
+            return
+        job.run(ndb.Key(urlsafe=self.request.get('scope')),
+                int(self.request.headers.get('X-AppEngine-TaskRetryCount', 0)))
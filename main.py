@@ -1,15 +1,153 @@
 from google.appengine.api import app_identity
+import json
+import StringIO
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
 from conference import ConferenceApi
+from instrumentation import instrumented
+from models import Conference, Session
+import bulk
+import jobs
+import search_index
+import speakers
 import webapp2
 
+# featured speakers are set by the featured_speaker job now; this drains
+# tasks queued before it
 class SetFeaturedSpeaker(webapp2.RequestHandler):
+    @instrumented(name='tasks.set_featured_speaker')
     def get(self):
-        """Set featured speaker in the memcache"""
-        ConferenceApi._set_speaker_cache(self.request.get('speakerName'))
+        """Set featured speaker of a conference in the memcache"""
+        wsck = self.request.get('websafeConferenceKey')
+        # tasks queued before speakers were tracked per conference have no key
+        if wsck:
+            ConferenceApi._set_speaker_cache(
+                wsck, self.request.get('speakerName'))
 
         
 
 
+class UpdateOrganizerDisplayName(webapp2.RequestHandler):
+    @instrumented(name='tasks.update_organizer_name')
+    def post(self):
+        """Copy a user's new display name onto their conferences"""
+        ConferenceApi._updateOrganizerDisplayName(
+            self.request.get('userId'), self.request.get('cursor'))
+
+
+class BackfillOrganizerDisplayNames(webapp2.RequestHandler):
+    @instrumented(name='tasks.backfill_organizer_names')
+    def post(self):
+        """Store organizer names on conferences created without one"""
+        ConferenceApi._backfillOrganizerDisplayNames(
+            self.request.get('cursor'))
+
+
+class MigrateRegistrations(webapp2.RequestHandler):
+    @instrumented(name='tasks.migrate_registrations')
+    def post(self):
+        """Move registrations stored on Profiles into Registration entities"""
+        ConferenceApi._migrateLegacyRegistrations()
+
+
+class BackfillSpeakers(webapp2.RequestHandler):
+    @instrumented(name='tasks.backfill_speakers')
+    def post(self):
+        """Index existing sessions by normalized speaker, one batch per task"""
+        cursor = speakers.backfill(self.request.get('cursor'))
+        if cursor:
+            taskqueue.add(params={'cursor': cursor},
+                          url='/tasks/backfill_speakers')
+
+
+class PromoteWaitlist(webapp2.RequestHandler):
+    @instrumented(name='tasks.promote_waitlist')
+    def post(self):
+        """Give free seats of a conference to its waitlist"""
+        ConferenceApi._promoteWaitlist(
+            ndb.Key(urlsafe=self.request.get('websafeConferenceKey')),
+            int(self.request.get('retries', 0)))
+
+
+class ReindexSearch(webapp2.RequestHandler):
+    # conferences first, then sessions
+    KINDS = {'Conference': Conference, 'Session': Session}
+    NEXT_KIND = {'Conference': 'Session'}
+
+    @instrumented(name='tasks.reindex_search')
+    def post(self):
+        """Rebuild the search documents, one batch per task"""
+        kind = self.request.get('kind') or 'Conference'
+        cursor = search_index.reindex(self.KINDS[kind],
+                                      self.request.get('cursor'))
+        if cursor:
+            taskqueue.add(params={'kind': kind, 'cursor': cursor},
+                          url='/tasks/reindex_search')
+        elif kind in self.NEXT_KIND:
+            taskqueue.add(params={'kind': self.NEXT_KIND[kind]},
+                          url='/tasks/reindex_search')
+
+
+class BulkImport(webapp2.RequestHandler):
+    def post(self):
+        """Start importing the uploaded JSONL or CSV rows"""
+        kind = self.request.get('kind')
+        fmt = self.request.get('format') or 'jsonl'
+        if kind not in bulk.KINDS or fmt not in bulk.FORMATS:
+            self.abort(400, detail='kind must be one of %s and format one of %s'
+                       % (', '.join(bulk.KINDS), ', '.join(bulk.FORMATS)))
+        try:
+            job = bulk.startImport(kind, fmt, self.request.body_file)
+        except ValueError as e:
+            self.abort(400, detail=str(e))
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps({'job': job.key.id(), 'rows': job.rows}))
+
+    def get(self):
+        """Report the progress of an import job"""
+        job = bulk.BulkJob.get_by_id(int(self.request.get('job') or 0))
+        if not job:
+            self.abort(404)
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(dict(
+            job.to_dict(exclude=['created']), job=job.key.id())))
+
+
+class BulkExport(webapp2.RequestHandler):
+    def get(self):
+        """Write one page of entities; X-Next-Cursor fetches the next"""
+        kind = self.request.get('kind')
+        fmt = self.request.get('format') or 'jsonl'
+        if kind not in bulk.KINDS or fmt not in bulk.FORMATS:
+            self.abort(400, detail='kind must be one of %s and format one of %s'
+                       % (', '.join(bulk.KINDS), ', '.join(bulk.FORMATS)))
+        out = StringIO.StringIO()
+        cursor = bulk.exportPage(kind, fmt, out, self.request.get('cursor'))
+        self.response.content_type = 'text/csv' if fmt == 'csv' \
+            else 'application/x-ndjson'
+        if cursor:
+            self.response.headers['X-Next-Cursor'] = cursor
+        self.response.write(out.getvalue())
+
+
+class BulkImportTask(webapp2.RequestHandler):
+    @instrumented(name='tasks.bulk_import')
+    def post(self):
+        """Import a job's rows from its checkpoint"""
+        bulk.runImport(int(self.request.get('job')))
+
+
 app = webapp2.WSGIApplication([
     ('/tasks/set_featured_speaker', SetFeaturedSpeaker),
+    ('/tasks/update_organizer_name', UpdateOrganizerDisplayName),
+    ('/tasks/backfill_organizer_names', BackfillOrganizerDisplayNames),
+    ('/tasks/reindex_search', ReindexSearch),
+    ('/tasks/migrate_registrations', MigrateRegistrations),
+    ('/tasks/bulk_import', BulkImportTask),
+    ('/tasks/backfill_speakers', BackfillSpeakers),
+    ('/tasks/promote_waitlist', PromoteWaitlist),
+    (r'/tasks/jobs/(\w+)', jobs.JobHandler),
+    ('/admin/bulk/import', BulkImport),
+    ('/admin/bulk/export', BulkExport),
 ], debug=True)
\ No newline at end of file
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""mappers.py
+
+Precompiled entity-to-message copying. A Mapper works out, once per
+(model, message) pair, which message fields come from the entity and how
+each value is converted; copying an entity then just runs that plan,
+without per-field hasattr/getattr lookups or name checks. Copies limited
+to a subset of the fields (sparse fieldsets) get a plan of their own, so
+they never touch attributes a projection query did not load.
+
+"""
+
+from operator import attrgetter
+
+
+def urlsafeKey(entity):
+    """Computed field: the websafe key of the entity."""
+    return entity.key.urlsafe()
+
+
+def storedKey(name, keyOf=attrgetter('key')):
+    """Computed field: the websafe key the entity stores in property name,
+    or, if a projection query did not load it, keyOf(entity).urlsafe().
+    Copying the stored string saves encoding the key for every item."""
+    stored = attrgetter(name)
+
+    def get(entity):
+        if entity._projection:
+            return keyOf(entity).urlsafe()
+        return stored(entity)
+    return get
+
+
+class Mapper(object):
+    """Copies entities of one ndb model into messages of one class.
+
+    converters maps field names to a function applied to the entity value
+    (None copies the value unchanged); otherwise is applied to the values
+    of all other fields the model has; computed maps field names that are
+    not model attributes to a function of the whole entity.
+    """
+
+    def __init__(self, model_class, message_class, converters=None,
+                 otherwise=None, computed=None):
+        converters = converters or {}
+        computed = computed or {}
+        self.message_class = message_class
+        self.fieldNames = frozenset(field.name
+                                    for field in message_class.all_fields())
+        self._plan = []
+        for field in message_class.all_fields():
+            name = field.name
+            if name in computed:
+                self._plan.append((name, computed[name], None))
+            elif hasattr(model_class, name):
+                convert = converters[name] if name in converters else otherwise
+                self._plan.append((name, attrgetter(name), convert))
+        # fields copied from entity properties, which a projection must load
+        self.propertyNames = frozenset(step[0] for step in self._plan
+                                       if step[0] not in computed)
+        # none of our messages have required fields; only pay for the
+        # check when one does
+        self._check = any(field.required
+                          for field in message_class.all_fields())
+        self._subsetPlans = {}
+
+    def _planFor(self, only):
+        """Return the plan restricted to the field names in only."""
+        only = frozenset(only)
+        plan = self._subsetPlans.get(only)
+        if plan is None:
+            plan = [step for step in self._plan if step[0] in only]
+            self._subsetPlans[only] = plan
+        return plan
+
+    def copy(self, entity, only=None):
+        """Return a new message with the entity's fields copied in.
+
+        If only is given, just those message fields are filled in.
+        """
+        plan = self._plan if only is None else self._planFor(only)
+        msg = self.message_class()
+        for name, get, convert in plan:
+            value = get(entity)
+            if convert is not None:
+                value = convert(value)
+            if value is not None:
+                setattr(msg, name, value)
+        if self._check:
+            msg.check_initialized()
+        return msg
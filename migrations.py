@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+"""migrations.py
+
+Completion flags for one-off backfills. Code that may only rely on data
+a backfill writes, such as a query on a property that older entities
+lack, checks done() first and keeps its fallback until then.
+
+A finished backfill stores a Migration entity. Instances remember a
+finished migration for good; memcache saves the others the get, and
+remembers an unfinished one for NOT_DONE_CACHE_TIME seconds.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Migration
+
+MEMCACHE_MIGRATION_KEY = "MIGRATION_DONE:%s"
+NOT_DONE_CACHE_TIME = 60
+
+# migrations this instance has seen finished
+_finished = set()
+
+
+@ndb.non_transactional
+def done(name):
+    """Return whether the backfill called name has finished; safe to call
+    in a transaction, which the flag is never part of."""
+    if name in _finished:
+        return True
+    finished = memcache.get(MEMCACHE_MIGRATION_KEY % name)
+    if finished is None:
+        finished = ndb.Key(Migration, name).get() is not None
+        memcache.set(MEMCACHE_MIGRATION_KEY % name, finished,
+                     time=0 if finished else NOT_DONE_CACHE_TIME)
+    if finished:
+        _finished.add(name)
+    return finished
+
+
+def finish(name):
+    """Record that the backfill called name has finished."""
+    Migration(id=name).put()
+    memcache.set(MEMCACHE_MIGRATION_KEY % name, True)
@@ -17,17 +17,35 @@ import endpoints
 from protorpc import messages
 from google.appengine.ext import ndb
 
+def normalizeSpeaker(name):
+    """Return the canonical form of a speaker name: "Jane  Doe" and
+    "jane doe" are one speaker."""
+    return u' '.join(name.split()).lower() if name else None
+
 class Session(ndb.Model):
     """Conference -- Conference object"""
     sessionName     = ndb.StringProperty(required=True)
     highlights      = ndb.StringProperty()
     duration        = ndb.StringProperty()
     speaker         = ndb.StringProperty()
+    # indexed so a speaker's sessions are found whatever the spelling
+    normalizedSpeaker = ndb.ComputedProperty(
+        lambda self: normalizeSpeaker(self.speaker))
     sessionType     = ndb.StringProperty(default='NOT_SPECIFIED')
     startTime       = ndb.TimeProperty()
     date            = ndb.DateProperty()
     c_websafeKey    =  ndb.StringProperty(required=True)
     sessionWebSafeKey = ndb.StringProperty(required=True)
+    updated         = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+class SpeakerSessionCount(ndb.Model):
+    """SpeakerSessionCount -- sessions a speaker has in one conference
+    (child of the Conference, keyed by normalized speaker name)"""
+    count           = ndb.IntegerProperty(default=0, indexed=False)
+
+class FeaturedSpeaker(ndb.Model):
+    """FeaturedSpeaker -- datastore copy of a conference's featured speaker"""
+    speaker         = ndb.StringProperty(indexed=False)
 
 class SessionForm(messages.Message):
     """Conference -- Conference object"""
@@ -45,6 +63,21 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    # 3 is websafeConferenceKey in SESSION_BATCH_REQUEST
+    etag = messages.StringField(4)
+    # set, with no items, when If-None-Match holds etag
+    notModified = messages.BooleanField(5)
+
+class SessionResultForm(messages.Message):
+    """SessionResultForm -- outcome of one session of a batch; error is
+    unset if it was created"""
+    session = messages.MessageField(SessionForm, 1)
+    error = messages.StringField(2)
+
+class SessionResultForms(messages.Message):
+    """SessionResultForms -- multiple SessionResultForm outbound form message"""
+    items = messages.MessageField(SessionResultForm, 1, repeated=True)
 
 class SessionType(messages.Enum):
     """Session Type -- session SessionType enumeration value"""
@@ -60,13 +93,43 @@ class Conference(ndb.Model):
     name            = ndb.StringProperty(required=True)
     description     = ndb.StringProperty()
     organizerUserId = ndb.StringProperty()
+    # copy of the organizer's Profile.displayName, kept up to date by a task
+    organizerDisplayName = ndb.StringProperty()
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
     startDate       = ndb.DateProperty()
     month           = ndb.IntegerProperty()
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
+    # seats at creation time; the live count is kept in SeatShard entities
     seatsAvailable  = ndb.IntegerProperty()
+    # number of SeatShards, see seats.py
+    seatShards      = ndb.IntegerProperty(indexed=False)
+    updated         = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a conference's available seats"""
+    seatsAvailable  = ndb.IntegerProperty(default=0, indexed=False)
+
+class BulkJob(ndb.Model):
+    """BulkJob -- an admin import of Conference or Session rows, with the
+    checkpoint it resumes from"""
+    kind            = ndb.StringProperty(choices=('Conference', 'Session'))
+    rows            = ndb.IntegerProperty(default=0, indexed=False)
+    nextRow         = ndb.IntegerProperty(default=0, indexed=False)
+    nextChunk       = ndb.IntegerProperty(default=1, indexed=False)
+    imported        = ndb.IntegerProperty(default=0, indexed=False)
+    skipped         = ndb.IntegerProperty(default=0, indexed=False)
+    failed          = ndb.IntegerProperty(default=0, indexed=False)
+    errors          = ndb.StringProperty(repeated=True, indexed=False)
+    status          = ndb.StringProperty(default='running')
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class BulkChunk(ndb.Model):
+    """BulkChunk -- a run of parsed rows of a BulkJob (child of the job,
+    numbered from 1), starting at row first of the job"""
+    first           = ndb.IntegerProperty(indexed=False)
+    rows            = ndb.JsonProperty(compressed=True)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -82,10 +145,15 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10)
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    # set, with no other fields, when If-None-Match holds etag
+    notModified     = messages.BooleanField(14)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    plan = messages.StringField(3)
 
 
 class ConferenceQueryForm(messages.Message):
@@ -97,27 +165,112 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    cursor = messages.StringField(3)
+    fields = messages.StringField(4, repeated=True)
+    explain = messages.BooleanField(5)
 
 
 class Profile(ndb.Model):
     """Profile -- User profile object"""
+    # profiles are cached by profile_cache; skip ndb's own memcache copy
+    _use_memcache = False
+
     userId = ndb.StringProperty()
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    # legacy registrations; moved into Registration entities on first use
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    # legacy wishlist; moved into WishListItem entities on first use
     wishListSessionKeys = ndb.StringProperty(repeated=True)
 
+class Registration(ndb.Model):
+    """Registration -- a user's seat at a conference (child of the Profile,
+    keyed by the conference's websafe key)"""
+    conference      = ndb.KeyProperty(kind='Conference', required=True)
+    registered      = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+class Migration(ndb.Model):
+    """Migration -- a finished backfill (keyed by name, see migrations.py)"""
+    finished        = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+class JobItem(ndb.Model):
+    """JobItem -- one pending item of work for a background job (child of
+    the entity the job is for, see jobs.py)"""
+    jobType         = ndb.StringProperty(required=True)
+    payload         = ndb.JsonProperty()
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class UserIdMapping(ndb.Model):
+    """UserIdMapping -- the user id of an email when user ids are "custom"
+    (keyed by the lower-cased email)"""
+    userId          = ndb.StringProperty(required=True, indexed=False)
+    created         = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- a user waiting for a seat at a full conference
+    (child of the Profile, keyed by the conference's websafe key)"""
+    conference      = ndb.KeyProperty(kind='Conference', required=True)
+    joined          = ndb.DateTimeProperty(auto_now_add=True)
+
+class WishListItem(ndb.Model):
+    """WishListItem -- one session on a user's wishlist (child of the
+    Profile, keyed by the session's websafe key)"""
+    added           = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
+
 # needed for conference registration
 class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
     data = messages.BooleanField(1)
 
+class WaitlistPositionForm(messages.Message):
+    """WaitlistPositionForm -- outbound place of a user on a waitlist"""
+    websafeConferenceKey = messages.StringField(1)
+    position        = messages.IntegerField(2)
+
 # for featured speaker
 class FeaturedSpeakerMessage(messages.Message):
     """FeaturedSpeakerMessage-- outbound featured speaker message"""
     data = messages.StringField(1)    
 
+# for the admin endpoint stats
+class EndpointStatsForm(messages.Message):
+    """EndpointStatsForm -- cost of one endpoint, averaged per call"""
+    endpoint        = messages.StringField(1)
+    calls           = messages.IntegerField(2)
+    errors          = messages.IntegerField(3)
+    meanMs          = messages.FloatField(4)
+    p50Ms           = messages.IntegerField(5)
+    p95Ms           = messages.IntegerField(6)
+    p99Ms           = messages.IntegerField(7)
+    datastoreGets   = messages.FloatField(8)
+    datastoreGetMs  = messages.FloatField(9)
+    datastorePuts   = messages.FloatField(10)
+    datastorePutMs  = messages.FloatField(11)
+    datastoreQueries = messages.FloatField(12)
+    datastoreQueryMs = messages.FloatField(13)
+    datastoreOther  = messages.FloatField(14)
+    memcacheRpcs    = messages.FloatField(15)
+    memcacheMs      = messages.FloatField(16)
+    memcacheHits    = messages.FloatField(17)
+    memcacheMisses  = messages.FloatField(18)
+    taskqueueAdds   = messages.FloatField(19)
+    cacheHits       = messages.FloatField(20)
+    cacheMisses     = messages.FloatField(21)
+    cacheHitRatio   = messages.FloatField(22)
+    jobsCoalesced   = messages.FloatField(23)
+    jobItems        = messages.FloatField(24)
+    jobRetries      = messages.IntegerField(25)
+    jobLagMs        = messages.FloatField(26)
+    profileCacheHits = messages.FloatField(27)
+    profileCacheMisses = messages.FloatField(28)
+    profileCacheHitRatio = messages.FloatField(29)
+
+class EndpointStatsForms(messages.Message):
+    """EndpointStatsForms -- multiple EndpointStatsForm outbound form message"""
+    items = messages.MessageField(EndpointStatsForm, 1, repeated=True)
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT    
@@ -137,6 +290,12 @@ class ProfileForm(messages.Message):
     teeShirtSize = messages.EnumField('TeeShirtSize', 4)
 
 
+class ProfileForms(messages.Message):
+    """ProfileForms -- multiple ProfileForm outbound form message"""
+    items = messages.MessageField(ProfileForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
     NOT_SPECIFIED = 1
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+
+"""planner.py
+
+Query planning for queryConferences. User filters are normalized first:
+values get their property's type, duplicates are dropped, ranges on one
+property are folded into a single lower/upper bound, and contradictions
+turn into an empty plan that never reaches the datastore.
+
+The planner then splits the filters between the datastore and an
+in-memory post-filter. It only hands the datastore a query that a
+built-in index or a composite index from index.yaml can serve, and
+picks the split that reads the fewest entities per page, using rough
+per-filter selectivity estimates. NE is always post-filtered, so it
+never becomes a multi-query fan-out.
+
+"""
+
+import itertools
+import os
+
+import endpoints
+import yaml
+from google.appengine.ext import ndb
+
+from models import Conference
+
+OPERATORS = {
+            'EQ':   '=',
+            'GT':   '>',
+            'GTEQ': '>=',
+            'LT':   '<',
+            'LTEQ': '<=',
+            'NE':   '!='
+            }
+
+FIELDS =    {
+            'CITY': 'city',
+            'TOPIC': 'topics',
+            'MONTH': 'month',
+            'MAX_ATTENDEES': 'maxAttendees',
+            }
+
+# type of each filterable property; topics is the only repeated one
+FIELD_TYPES = {
+    'city': unicode,
+    'topics': unicode,
+    'month': int,
+    'maxAttendees': int,
+}
+REPEATED_FIELDS = ('topics',)
+
+# rough share of conferences passing one filter, used to rank plans
+EQ_SELECTIVITY = {
+    'city': 0.05,
+    'topics': 0.1,
+    'month': 1 / 12.0,
+    'maxAttendees': 0.02,
+}
+RANGE_SELECTIVITY = 1 / 3.0
+BETWEEN_SELECTIVITY = 0.1
+NE_SELECTIVITY = 0.9
+
+# plans expected to read more than 1 / MIN_POST_SELECTIVITY entities per
+# result are rejected; MAX_SCAN caps the entities read for any one page
+MIN_POST_SELECTIVITY = 0.05
+MAX_SCAN = 1000
+MAX_FILTERS = 10
+
+INDEX_FILE = os.path.join(os.path.dirname(__file__), 'index.yaml')
+_indexes = None
+
+
+def _compositeIndexes():
+    """Property lists of the Conference composite indexes in index.yaml."""
+    global _indexes
+    if _indexes is None:
+        with open(INDEX_FILE) as f:
+            config = yaml.safe_load(f) or {}
+        _indexes = [
+            tuple(prop['name'] for prop in index.get('properties', ()))
+            for index in config.get('indexes') or ()
+            if index.get('kind') == 'Conference'
+            and not index.get('ancestor')
+            and all(prop.get('direction', 'asc') == 'asc'
+                    for prop in index.get('properties', ()))
+        ]
+    return _indexes
+
+
+def _indexFor(eq_fields, order):
+    """Return the index serving these filters and sort orders: 'built-in',
+    the composite index's property tuple, or None if there is none."""
+    if not order or (not eq_fields and len(order) == 1):
+        # equality-only queries use a merge join of the single-property
+        # indexes, as does one sort order with no equality filters
+        return 'built-in'
+    wanted = sorted(eq_fields)
+    for index in _compositeIndexes():
+        if len(index) == len(eq_fields) + len(order) \
+                and index[len(eq_fields):] == tuple(order) \
+                and sorted(index[:len(eq_fields)]) == wanted:
+            return index
+    return None
+
+
+def _convert(field, value):
+    try:
+        return FIELD_TYPES[field](value)
+    except (TypeError, ValueError):
+        raise endpoints.BadRequestException(
+            "Invalid value '%s' for %s filter." % (value, field))
+
+
+class _Range(object):
+    """Folded lower and upper bound of the range filters on one property."""
+
+    def __init__(self):
+        self.lower = None       # (op, value)
+        self.upper = None
+
+    def add(self, op, value):
+        if op in ('>', '>='):
+            if self.lower is None or value > self.lower[1] or \
+                    (value == self.lower[1] and op == '>'):
+                self.lower = (op, value)
+        elif self.upper is None or value < self.upper[1] or \
+                (value == self.upper[1] and op == '<'):
+            self.upper = (op, value)
+
+    def empty(self):
+        if self.lower is None or self.upper is None:
+            return False
+        if self.lower[1] == self.upper[1]:
+            return self.lower[0] == '>' or self.upper[0] == '<'
+        return self.lower[1] > self.upper[1]
+
+    def contains(self, value):
+        return all(_test(value, op, bound) for op, bound in self.bounds())
+
+    def filters(self, field):
+        return [(field, op, value) for op, value in self.bounds()]
+
+    def bounds(self):
+        return [b for b in (self.lower, self.upper) if b is not None]
+
+    def selectivity(self):
+        if self.lower and self.upper:
+            return BETWEEN_SELECTIVITY
+        return RANGE_SELECTIVITY
+
+
+def _test(value, op, bound):
+    if value is None:
+        # entities without the property are not in its index, so the
+        # datastore never returns them for any filter on it
+        return False
+    if op == '=':
+        return value == bound
+    if op == '!=':
+        return value != bound
+    if op == '>':
+        return value > bound
+    if op == '>=':
+        return value >= bound
+    if op == '<':
+        return value < bound
+    return value <= bound
+
+
+class Plan(object):
+    """How one set of filters is run: which go to the datastore and
+    which are checked in memory, and in what order results come back."""
+
+    def __init__(self, filters=(), range_field=None, post_filters=(),
+                 order=(), index='built-in', selectivity=1.0,
+                 post_selectivity=1.0, empty=False):
+        self.filters = list(filters)
+        self.rangeField = range_field
+        self.postFilters = list(post_filters)
+        self.order = list(order)
+        self.index = index
+        self.selectivity = selectivity
+        self.postSelectivity = post_selectivity
+        self.empty = empty
+
+    @property
+    def unfiltered(self):
+        return not self.empty and not self.filters and not self.postFilters
+
+    def query(self):
+        """The datastore half of the plan, as an ndb query."""
+        q = Conference.query()
+        for field, op, value in self.filters:
+            q = q.filter(ndb.query.FilterNode(field, op, value))
+        for field in self.order:
+            q = q.order(ndb.GenericProperty(field))
+        return q
+
+    def matches(self, conf):
+        """Whether a conference read by query() passes the post-filters."""
+        ranges = {}
+        for field, op, value in self.postFilters:
+            got = getattr(conf, field)
+            if field not in REPEATED_FIELDS:
+                if not _test(got, op, value):
+                    return False
+            elif op in ('=', '!='):
+                # like the datastore, a repeated property matches when any
+                # one of its values does
+                if not any(_test(v, op, value) for v in got):
+                    return False
+            else:
+                ranges.setdefault(field, []).append((op, value))
+        # ...and the range filters on it must all hold for the same value
+        for field, bounds in ranges.items():
+            if not any(all(_test(v, op, value) for op, value in bounds)
+                       for v in getattr(conf, field)):
+                return False
+        return True
+
+    def explain(self):
+        """Describe the plan in one line, for explain mode."""
+        if self.empty:
+            return 'empty: the filters contradict each other; no datastore query'
+        def describe(filters):
+            return ', '.join('%s %s %r' % f for f in filters) or 'none'
+        if self.index == 'built-in':
+            index = 'built-in'
+        else:
+            index = 'Conference(%s)' % ', '.join(self.index)
+        return ('index: %s; datastore filters: %s; post-filters: %s; '
+                'order: %s; estimated selectivity: %.3g datastore, %.3g post' % (
+                    index, describe(self.filters), describe(self.postFilters),
+                    ', '.join(self.order) or 'key', self.selectivity,
+                    self.postSelectivity))
+
+
+def normalize(filters):
+    """Turn ConferenceQueryForm filters into (eqs, ranges, nes), or None if
+    they can match nothing. eqs and nes are lists of (field, value) pairs,
+    ranges maps a field to its folded _Range."""
+    if len(filters) > MAX_FILTERS:
+        raise endpoints.BadRequestException(
+            "At most %d filters are allowed." % MAX_FILTERS)
+    eqs, ranges, nes = [], {}, []
+    for f in filters:
+        try:
+            field = FIELDS[f.field]
+            op = OPERATORS[f.operator]
+        except KeyError:
+            raise endpoints.BadRequestException("Filter contains invalid field or operator.")
+        value = _convert(field, f.value)
+        if op == '=':
+            if (field, value) not in eqs:
+                eqs.append((field, value))
+        elif op == '!=':
+            if (field, value) not in nes:
+                nes.append((field, value))
+        else:
+            ranges.setdefault(field, _Range()).add(op, value)
+
+    if any(r.empty() for r in ranges.values()):
+        return None
+    for field in FIELD_TYPES:
+        if field in REPEATED_FIELDS:
+            continue
+        values = [v for f, v in eqs if f == field]
+        if len(values) > 1:
+            return None
+        if values:
+            # an equality filter settles the other filters on its property
+            value = values[0]
+            if field in ranges:
+                if not ranges.pop(field).contains(value):
+                    return None
+            if (field, value) in nes:
+                return None
+            nes = [(f, v) for f, v in nes if f != field]
+    return eqs, ranges, nes
+
+
+def plan(filters):
+    """Return the cheapest Plan for the submitted filters."""
+    normalized = normalize(filters)
+    if normalized is None:
+        return Plan(empty=True)
+    eqs, ranges, nes = normalized
+    if not eqs and not ranges and not nes:
+        return Plan(order=['name'])
+
+    ne_filters = [(field, '!=', value) for field, value in nes]
+    best, best_cost = None, None
+    for size in range(len(eqs), -1, -1):
+        for pushed in itertools.combinations(eqs, size):
+            for range_field in [None] + sorted(ranges):
+                candidate = _candidate(eqs, ranges, ne_filters,
+                                       pushed, range_field)
+                if candidate is None or candidate.index is None:
+                    continue
+                cost = (1 / candidate.postSelectivity,
+                        candidate.order[-1:] != ['name'],
+                        len(candidate.postFilters))
+                if best is None or cost < best_cost:
+                    best, best_cost = candidate, cost
+
+    # sorting by name alone is always served by a built-in index, so
+    # there is a plan; it may just have to read too much
+    if best.postSelectivity < MIN_POST_SELECTIVITY:
+        needed = sorted(field for field, value in eqs)
+        needed += sorted(ranges, key=lambda f: ranges[f].selectivity())[:1]
+        raise endpoints.BadRequestException(
+            "This query needs a composite index on Conference(%s); "
+            "add it to index.yaml." % ', '.join(needed + ['name']))
+    return best
+
+
+def _candidate(eqs, ranges, ne_filters, pushed, range_field):
+    """Build the plan pushing these filters down, sorted by name if an
+    index allows it and in index order otherwise; None if no index can
+    serve it."""
+    filters = [(field, '=', value) for field, value in pushed]
+    post = [(field, '=', value) for field, value in eqs
+            if (field, value) not in pushed]
+    selectivity = 1.0
+    for field, value in pushed:
+        selectivity *= EQ_SELECTIVITY[field]
+    post_selectivity = 1.0
+    for field, value in eqs:
+        if (field, value) not in pushed:
+            post_selectivity *= EQ_SELECTIVITY[field]
+    for field, r in sorted(ranges.items()):
+        if field == range_field:
+            filters += r.filters(field)
+            selectivity *= r.selectivity()
+        else:
+            post += r.filters(field)
+            post_selectivity *= r.selectivity()
+    post += ne_filters
+    post_selectivity *= NE_SELECTIVITY ** len(ne_filters)
+
+    eq_fields = [field for field, value in pushed]
+    if range_field in eq_fields:
+        # the datastore won't mix = and a range on one property
+        return None
+    # results are sorted by the range property first, as the datastore
+    # requires, then by name when an index covers that
+    base = [range_field] if range_field else []
+    for order in (base + ['name'], base):
+        index = _indexFor(eq_fields, order)
+        if index is not None:
+            return Plan(filters, range_field, post, order, index,
+                        selectivity, post_selectivity)
+    return None
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""profile_cache.py
+
+Read-through memcache cache for Profile entities. Each cached entry is
+stored with the profile's current version (see versions.py); every write
+path bumps the version with incr() after its datastore write, which makes the old entry
+unusable without a separate delete.
+
+Only use cached profiles for reads. Code that modifies a profile must
+load it from the datastore inside a transaction and call invalidate()
+once the transaction has committed.
+
+"""
+
+from google.appengine.ext import ndb
+
+import instrumentation
+import versions
+
+MEMCACHE_PROFILE_KEY = "PROFILE:%s"
+MEMCACHE_VERSION_KEY = "PROFILE_VERSION:%s"
+
+
+@ndb.tasklet
+def getAsync(p_key):
+    """Return the Profile for p_key (or None), from memcache if possible.
+
+    The version and entry lookups are issued together, so ndb batches
+    them into one memcache call.
+    """
+    ctx = ndb.get_context()
+    uid = p_key.id()
+    version, entry = yield (ctx.memcache_get(MEMCACHE_VERSION_KEY % uid),
+                            ctx.memcache_get(MEMCACHE_PROFILE_KEY % uid))
+    if version is not None and entry and entry[0] == version:
+        instrumentation.count('profile_cache_hits')
+        raise ndb.Return(entry[1])
+
+    instrumentation.count('profile_cache_misses')
+    # read the version before the datastore, so a write that lands in
+    # between bumps it and the entry cached here is never used
+    if version is None:
+        version = yield versions.getAsync(MEMCACHE_VERSION_KEY % uid)
+    profile = yield p_key.get_async()
+    if profile and version is not None:
+        yield ctx.memcache_set(MEMCACHE_PROFILE_KEY % uid, (version, profile))
+    raise ndb.Return(profile)
+
+
+def get(p_key):
+    """Return the Profile for p_key (or None), from memcache if possible."""
+    return getAsync(p_key).get_result()
+
+
+def invalidateAsync(p_key):
+    """Make cached copies of a profile stale; call after every put()."""
+    return ndb.get_context().memcache_incr(MEMCACHE_VERSION_KEY % p_key.id())
+
+
+def invalidate(p_key):
+    """Make cached copies of a profile stale; call after every put()."""
+    invalidateAsync(p_key).get_result()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""query_cache.py
+
+memcache cache of queryConferences result pages. An entry is keyed by a
+hash of the normalized query plan, page size, cursor and requested
+fields, so equivalent filter sets share it, and stores the encoded
+ConferenceForms with the conference generation it was built under.
+
+Anything that changes what a listing shows (a new conference, a seat
+taken or released, an organizer renaming themselves) calls bump(), which
+makes every cached page stale at once without deleting them; the
+generation is a version kept by versions.py.
+
+"""
+
+import hashlib
+
+from google.appengine.ext import ndb
+from protorpc import protojson
+
+import instrumentation
+from models import ConferenceForms
+import versions
+
+MEMCACHE_GENERATION_KEY = "CONFERENCE_GENERATION"
+MEMCACHE_QUERY_KEY = "CONFERENCE_QUERY:%s"
+# first pages are what the home and browse pages ask for; later pages are
+# rarely asked for twice
+FIRST_PAGE_CACHE_TIME = 600
+PAGE_CACHE_TIME = 120
+
+
+def queryKey(plan, pageSize, cursor, fields):
+    """Return the cache key for one page of a planned query."""
+    canonical = repr((sorted(plan.filters), sorted(plan.postFilters),
+                      plan.order, plan.empty, pageSize, cursor or None,
+                      sorted(fields) if fields is not None else None))
+    return MEMCACHE_QUERY_KEY % hashlib.sha1(canonical).hexdigest()
+
+
+@ndb.tasklet
+def getAsync(key):
+    """Return (ConferenceForms or None, generation) for a cache key.
+
+    Pass the generation to put() once the page is built, so a page read
+    before a concurrent bump() is never served.
+    """
+    ctx = ndb.get_context()
+    generation, entry = yield (ctx.memcache_get(MEMCACHE_GENERATION_KEY),
+                               ctx.memcache_get(key))
+    if generation is not None and entry and entry[0] == generation:
+        instrumentation.count('cache_hits')
+        raise ndb.Return((protojson.decode_message(ConferenceForms, entry[1]),
+                          generation))
+
+    instrumentation.count('cache_misses')
+    if generation is None:
+        generation = yield versions.getAsync(MEMCACHE_GENERATION_KEY)
+    raise ndb.Return((None, generation))
+
+
+def get(key):
+    """Return (ConferenceForms or None, generation) for a cache key."""
+    return getAsync(key).get_result()
+
+
+def put(key, generation, forms, first_page=True):
+    """Cache a page built under generation."""
+    ndb.get_context().memcache_set(
+        key, (generation, protojson.encode_message(forms)),
+        time=FIRST_PAGE_CACHE_TIME if first_page else PAGE_CACHE_TIME
+    ).get_result()
+
+
+def bumpAsync():
+    """Make every cached page stale; call after changing a conference."""
+    return ndb.get_context().memcache_incr(MEMCACHE_GENERATION_KEY)
+
+
+def bump():
+    """Make every cached page stale; call after changing a conference."""
+    bumpAsync().get_result()
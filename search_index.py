@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""search_index.py
+
+Full-text search over conferences and sessions with the App Engine
+Search API. Each conference and session has one document, whose id is
+the entity's websafe key, in the 'conferences' or 'sessions' index.
+Documents are written when a conference or session is created;
+reindex() rebuilds them in batches for data created before search
+existed.
+
+Searches return entity keys ranked by match score, one page at a time,
+so the endpoints can load the entities with a single get_multi.
+
+"""
+
+import logging
+
+from google.appengine.api import search
+from google.appengine.ext import ndb
+
+from models import Conference
+
+CONFERENCE_INDEX = 'conferences'
+SESSION_INDEX = 'sessions'
+# most documents one index.put() accepts
+PUT_BATCH = 200
+# documents scored with the full match scorer; later ones keep their rank
+SCORED_LIMIT = 1000
+
+
+def conferenceDocument(conf):
+    """Return the search document for a Conference."""
+    fields = [
+        search.TextField(name='name', value=conf.name),
+        search.TextField(name='description', value=conf.description),
+        search.TextField(name='city', value=conf.city),
+    ]
+    # one field per topic, so topics:xyz matches any of them
+    fields += [search.TextField(name='topics', value=topic)
+               for topic in conf.topics or ()]
+    return search.Document(doc_id=conf.key.urlsafe(), fields=fields)
+
+
+def sessionDocument(session):
+    """Return the search document for a Session."""
+    return search.Document(doc_id=session.key.urlsafe(), fields=[
+        search.TextField(name='sessionName', value=session.sessionName),
+        search.TextField(name='highlights', value=session.highlights),
+        search.TextField(name='speaker', value=session.speaker),
+        # lets a search be limited to one conference
+        search.AtomField(name='conference',
+                         value=session.key.parent().urlsafe()),
+    ])
+
+
+def _put(index_name, documents):
+    index = search.Index(name=index_name)
+    for i in range(0, len(documents), PUT_BATCH):
+        index.put(documents[i:i + PUT_BATCH])
+
+
+def indexConferences(conferences):
+    """Add or update the documents of these conferences."""
+    _put(CONFERENCE_INDEX, [conferenceDocument(conf) for conf in conferences])
+
+
+def indexSessions(sessions):
+    """Add or update the documents of these sessions."""
+    _put(SESSION_INDEX, [sessionDocument(session) for session in sessions])
+
+
+def indexQuietly(index, entities):
+    """Index entities that were just saved, without failing the request;
+    a reindex() picks up anything missed."""
+    try:
+        index(entities)
+    except search.Error:
+        logging.exception('could not index %d entities', len(entities))
+
+
+def find(index_name, query_string, pageSize, cursor=None, conference=None):
+    """Return (keys, nextPageToken) for one page of ranked matches.
+
+    Raises ValueError for a malformed query or cursor.
+    """
+    if conference:
+        query_string = '(%s) conference:"%s"' % (query_string, conference)
+    try:
+        options = search.QueryOptions(
+            limit=pageSize,
+            cursor=search.Cursor(web_safe_string=cursor or None),
+            ids_only=True,
+            sort_options=search.SortOptions(
+                match_scorer=search.MatchScorer(),
+                expressions=[search.SortExpression(
+                    expression='_score',
+                    direction=search.SortExpression.DESCENDING,
+                    default_value=0)],
+                limit=SCORED_LIMIT))
+        results = search.Index(name=index_name).search(
+            search.Query(query_string=query_string, options=options))
+    except (search.QueryError, search.InvalidRequest, ValueError) as e:
+        raise ValueError(str(e))
+
+    keys = [ndb.Key(urlsafe=doc.doc_id) for doc in results.results]
+    nextPageToken = results.cursor.web_safe_string if results.cursor else None
+    return keys, nextPageToken
+
+
+def reindex(model, cursor=None, batch=PUT_BATCH):
+    """Index one batch of model entities; return the cursor of the next
+    batch, or None when done."""
+    index = indexConferences if model is Conference else indexSessions
+    start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+    entities, next_cursor, more = model.query().fetch_page(
+        batch, start_cursor=start_cursor)
+    index(entities)
+    if more and next_cursor:
+        return next_cursor.urlsafe()
+    return None
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Sharded seat counter for conference registration. A conference's seats
+are split across root SeatShard entities so that concurrent
+registrations write to different entity groups instead of all updating
+the Conference. The shards only ever hold seats that really exist, so
+taking a seat from a shard with none left fails and nothing is oversold.
+
+A conference gets one shard per SEATS_PER_SHARD seats, up to MAX_SHARDS,
+and keeps the count in Conference.seatShards; raising maxAttendees adds
+shards, lowering it leaves them. Conferences created before the count
+scaled have NUM_SHARDS.
+
+"""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import SeatShard
+
+# shards of conferences that do not store their count
+NUM_SHARDS = 20
+SEATS_PER_SHARD = 50
+# changing the capacity writes the Conference and every shard in one
+# transaction, which may span 25 entity groups
+MAX_SHARDS = 24
+MEMCACHE_SEATS_KEY = "SEATS_AVAILABLE:%s"
+# seats taken and given back update the cached total; it only drifts when
+# a change races a reader filling it in
+SEATS_CACHE_TIME = 600
+
+
+def numShards(maxAttendees):
+    """Return how many shards a conference of maxAttendees seats gets."""
+    return max(1, min(MAX_SHARDS,
+                      -(-(maxAttendees or 0) // SEATS_PER_SHARD)))
+
+
+def shardCount(conf):
+    """Return how many shards a conference has."""
+    return conf.seatShards or NUM_SHARDS
+
+
+def _split(seats, count):
+    """Spread seats as evenly as possible over count counts."""
+    share, rest = divmod(max(seats or 0, 0), count)
+    return [share + (1 if i < rest else 0) for i in range(count)]
+
+
+def _shardKey(conf_key, i):
+    return ndb.Key(SeatShard, '%s:%d' % (conf_key.urlsafe(), i))
+
+
+def shardKeys(conf):
+    """Return the keys of all seat shards of a conference."""
+    return [_shardKey(conf.key, i) for i in range(shardCount(conf))]
+
+
+def newShards(conf):
+    """Return (unsaved) shards holding the seats of a new conference,
+    recording their count on conf."""
+    conf.seatShards = numShards(conf.maxAttendees)
+    memcache.set(MEMCACHE_SEATS_KEY % conf.key.urlsafe(),
+                 conf.seatsAvailable or 0, time=SEATS_CACHE_TIME)
+    return [SeatShard(key=key, seatsAvailable=n) for key, n in
+            zip(shardKeys(conf), _split(conf.seatsAvailable, conf.seatShards))]
+
+
+def addShards(conf, maxAttendees):
+    """Return (unsaved) empty shards that bring a conference up to the
+    shard count of maxAttendees seats, recording it on conf."""
+    have, want = shardCount(conf), numShards(maxAttendees)
+    if want <= have:
+        return []
+    conf.seatShards = want
+    return [SeatShard(key=_shardKey(conf.key, i)) for i in range(have, want)]
+
+
+@ndb.tasklet
+def loadShardsAsync(conf_key):
+    """Return the seat shards of a conference, creating them on first use.
+
+    Conferences created before seats were sharded have no shards yet; their
+    Conference.seatsAvailable is still the live count, so it is split up.
+    Returns None if there is no such conference.
+    """
+    conf = yield conf_key.get_async()
+    if not conf:
+        raise ndb.Return(None)
+    keys = shardKeys(conf)
+    shards = yield ndb.get_multi_async(keys)
+    if None in shards:
+        split = _split(conf.seatsAvailable, len(keys))
+        created = yield [SeatShard.get_or_insert_async(keys[i].id(),
+                                                       seatsAvailable=split[i])
+                         for i, shard in enumerate(shards) if shard is None]
+        created = iter(created)
+        shards = [shard or next(created) for shard in shards]
+    raise ndb.Return(shards)
+
+
+def candidateShards(shards):
+    """Return keys of the shards that still have seats, in random order."""
+    keys = [shard.key for shard in shards if shard.seatsAvailable > 0]
+    random.shuffle(keys)
+    return keys
+
+
+def anyShard(conf):
+    """Return the key of a random shard, to give a seat back to."""
+    return random.choice(shardKeys(conf))
+
+
+def seatTakenAsync(conf_key, delta=1):
+    """Update the cached total after seats were taken."""
+    return ndb.get_context().memcache_decr(
+        MEMCACHE_SEATS_KEY % conf_key.urlsafe(), delta=delta)
+
+
+def seatReleasedAsync(conf_key, delta=1):
+    """Update the cached total after seats were given back."""
+    return ndb.get_context().memcache_incr(
+        MEMCACHE_SEATS_KEY % conf_key.urlsafe(), delta=delta)
+
+
+def resize(shards, delta):
+    """Add delta seats (or take -delta seats away) across shards, fullest
+    first when taking; returns False, changing nothing, if fewer than
+    -delta seats are left."""
+    if delta < 0 and sum(shard.seatsAvailable for shard in shards) < -delta:
+        return False
+    if delta >= 0:
+        for shard, n in zip(shards, _split(delta, len(shards))):
+            shard.seatsAvailable += n
+        return True
+    for shard in sorted(shards, key=lambda shard: -shard.seatsAvailable):
+        taken = min(shard.seatsAvailable, -delta)
+        shard.seatsAvailable -= taken
+        delta += taken
+    return True
+
+
+def forget(conf_key):
+    """Drop the cached total, after a change not made one seat at a time."""
+    memcache.delete(MEMCACHE_SEATS_KEY % conf_key.urlsafe())
+
+
+@ndb.tasklet
+def getSeatsAvailableAsync(conf_keys):
+    """Return {conference key: seats available} for the given conferences.
+
+    Totals come from memcache; misses are summed from the shards, with
+    one get_multi for the conferences and one for their shards, and cached
+    for the next caller.
+    """
+    totals = {}
+    cache_keys = dict((MEMCACHE_SEATS_KEY % key.urlsafe(), key)
+                      for key in conf_keys)
+    cached = yield memcache.Client().get_multi_async(cache_keys.keys())
+    missing = []
+    for cache_key, conf_key in cache_keys.items():
+        if cache_key in cached:
+            totals[conf_key] = cached[cache_key]
+        else:
+            missing.append(conf_key)
+
+    if missing:
+        # the conferences hold their shard counts
+        confs = yield ndb.get_multi_async(missing)
+        confs = [conf for conf in confs if conf]
+        shard_keys = []
+        for conf in confs:
+            shard_keys.extend(shardKeys(conf))
+        shards = yield ndb.get_multi_async(shard_keys)
+
+        to_cache = {}
+        start = 0
+        for conf_key in missing:
+            totals[conf_key] = 0
+        for conf in confs:
+            conf_shards = shards[start:start + shardCount(conf)]
+            start += len(conf_shards)
+            if None in conf_shards:
+                # not sharded yet, the Conference still holds the count
+                totals[conf.key] = conf.seatsAvailable or 0
+            else:
+                totals[conf.key] = sum(shard.seatsAvailable
+                                       for shard in conf_shards)
+        for conf_key in missing:
+            to_cache[MEMCACHE_SEATS_KEY % conf_key.urlsafe()] = totals[conf_key]
+        yield memcache.Client().add_multi_async(to_cache, time=SEATS_CACHE_TIME)
+
+    raise ndb.Return(totals)
+
+
+def getSeatsAvailable(conf_keys):
+    """Return {conference key: seats available} for the given conferences."""
+    return getSeatsAvailableAsync(conf_keys).get_result()
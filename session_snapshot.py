@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+
+"""session_snapshot.py
+
+Column-oriented snapshot of one conference's sessions in memcache, for
+queries the datastore can't serve, such as two inequalities ("not a
+workshop and starting before 19:00"). Each column holds one field of
+every session, with dates as ordinals and times and durations as
+minutes, so a predicate compares plain ints and strings.
+
+Like profile_cache, a snapshot is stored with the conference's snapshot
+version. Creating sessions bumps the version and appends them to the
+cached snapshot with compare-and-set; if another write got there first,
+the snapshot is simply rebuilt by the next reader.
+
+A large conference's snapshot (highlights included) can pass memcache's
+1MB value limit, so it is stored compressed and split into chunks of at
+most CHUNK_BYTES: the header entry holds the version, the chunk count
+and the first chunk, and the other chunks are keyed by the version, so a
+reader never mixes chunks of two snapshots. Snapshots of more than
+MAX_CHUNKS chunks are not cached at all.
+
+Predicates are strings such as
+
+    NOT sessionType = WORKSHOP AND startTime < 19:00
+    (speaker = "Ada Lovelace" OR duration >= 90) AND date = 2016-06-01
+
+with AND, OR, NOT and parentheses over sessionType, speaker, sessionName,
+date (YYYY-MM-DD), startTime (HH:MM) and duration (minutes). A missing
+value matches no comparison, as in the datastore, but does match its
+NOT.
+
+"""
+
+import cPickle as pickle
+import logging
+import re
+import zlib
+from datetime import date, datetime, time as dtime
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Session
+import versions
+
+MEMCACHE_SNAPSHOT_KEY = "SESSION_SNAPSHOT:%s"
+MEMCACHE_SNAPSHOT_VERSION_KEY = "SESSION_SNAPSHOT_VERSION:%s"
+MEMCACHE_SNAPSHOT_CHUNK_KEY = "SESSION_SNAPSHOT:%s:%d:%d"
+CAS_RETRIES = 3
+# memcache values are limited to 1MB, key and overhead included
+CHUNK_BYTES = 900 * 1024
+MAX_CHUNKS = 16
+
+TEXT_COLUMNS = ('sessionName', 'highlights', 'duration', 'speaker',
+                'sessionType')
+# columns predicates may compare, with the parser for their values
+QUERY_COLUMNS = ('sessionType', 'speaker', 'sessionName', 'date',
+                 'startTime', 'durationMinutes')
+FIELD_ALIASES = {'type': 'sessionType', 'duration': 'durationMinutes',
+                 'time': 'startTime'}
+
+
+# - - - values - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _minutes(t):
+    return t.hour * 60 + t.minute if t else None
+
+
+def durationMinutes(duration):
+    """Minutes in a free-text duration such as '90', '90 min' or '2 hours'."""
+    match = re.match(r'\s*(\d+(?:\.\d+)?)\s*(h|hour|hours|hr|hrs)?\b',
+                     duration or '', re.I)
+    if not match:
+        return None
+    value = float(match.group(1))
+    return int(value * 60 if match.group(2) else value)
+
+
+def _parseValue(column, text):
+    try:
+        if column == 'date':
+            return datetime.strptime(text, '%Y-%m-%d').date().toordinal()
+        if column == 'startTime':
+            return _minutes(datetime.strptime(text, '%H:%M').time())
+        if column == 'durationMinutes':
+            return int(text)
+    except ValueError:
+        raise ValueError('invalid value for %s: %s' % (column, text))
+    return text
+
+
+# - - - snapshots - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _emptySnapshot():
+    snapshot = dict((column, []) for column in TEXT_COLUMNS)
+    snapshot.update(ids=[], date=[], startTime=[], durationMinutes=[])
+    return snapshot
+
+
+def _append(snapshot, sessions):
+    for ses in sessions:
+        snapshot['ids'].append(ses.key.id())
+        for column in TEXT_COLUMNS:
+            snapshot[column].append(getattr(ses, column))
+        snapshot['date'].append(ses.date.toordinal() if ses.date else None)
+        snapshot['startTime'].append(_minutes(ses.startTime))
+        snapshot['durationMinutes'].append(durationMinutes(ses.duration))
+    return snapshot
+
+
+def versionAsync(c_key):
+    """Return the current snapshot version, starting one if needed; None
+    if memcache lost it meanwhile."""
+    return versions.getAsync(MEMCACHE_SNAPSHOT_VERSION_KEY % c_key.urlsafe())
+
+
+def _chunkKeys(wsck, version, count):
+    return [MEMCACHE_SNAPSHOT_CHUNK_KEY % (wsck, version, i)
+            for i in range(1, count)]
+
+
+def _encode(snapshot):
+    """Return the chunks of a snapshot, or None if it is too large."""
+    data = zlib.compress(pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL))
+    chunks = [data[i:i + CHUNK_BYTES]
+              for i in range(0, len(data), CHUNK_BYTES)] or ['']
+    if len(chunks) > MAX_CHUNKS:
+        logging.warning('session snapshot of %d bytes is too large to cache',
+                        len(data))
+        return None
+    return chunks
+
+
+@ndb.tasklet
+def _readAsync(wsck, entry):
+    """Return the snapshot of a header entry, or None if a chunk is lost."""
+    version, count, first = entry
+    chunks = [first]
+    if count > 1:
+        keys = _chunkKeys(wsck, version, count)
+        found = yield memcache.Client().get_multi_async(keys)
+        if len(found) < len(keys):
+            raise ndb.Return(None)
+        chunks.extend(found[key] for key in keys)
+    raise ndb.Return(pickle.loads(zlib.decompress(''.join(chunks))))
+
+
+@ndb.tasklet
+def _writeChunksAsync(wsck, version, chunks):
+    """Store all but the first chunk; return the header entry to store, or
+    None if memcache did not take them all."""
+    if chunks is None:
+        raise ndb.Return(None)
+    rest = dict(zip(_chunkKeys(wsck, version, len(chunks)), chunks[1:]))
+    if rest:
+        statuses = yield memcache.Client().set_multi_async(rest)
+        if any(status != memcache.STORED for status in statuses.values()):
+            raise ndb.Return(None)
+    raise ndb.Return((version, len(chunks), chunks[0]))
+
+
+@ndb.tasklet
+def getAsync(c_key):
+    """Return the snapshot of a conference's sessions, building it from
+    one ancestor query if memcache has no current one."""
+    ctx = ndb.get_context()
+    wsck = c_key.urlsafe()
+    version, entry = yield (
+        ctx.memcache_get(MEMCACHE_SNAPSHOT_VERSION_KEY % wsck),
+        ctx.memcache_get(MEMCACHE_SNAPSHOT_KEY % wsck))
+    if version is not None and entry and entry[0] == version:
+        snapshot = yield _readAsync(wsck, entry)
+        if snapshot is not None:
+            raise ndb.Return(snapshot)
+
+    # read the version before the sessions, so a session created in
+    # between bumps it and this snapshot is never used
+    if version is None:
+        version = yield versionAsync(c_key)
+    sessions = yield Session.query(ancestor=c_key).fetch_async()
+    snapshot = _append(_emptySnapshot(), sessions)
+    if version is not None:
+        entry = yield _writeChunksAsync(wsck, version, _encode(snapshot))
+        if entry:
+            yield ctx.memcache_set(MEMCACHE_SNAPSHOT_KEY % wsck, entry)
+    raise ndb.Return(snapshot)
+
+
+def get(c_key):
+    """Return the snapshot of a conference's sessions."""
+    return getAsync(c_key).get_result()
+
+
+def patch(c_key, sessions):
+    """Add new sessions of a conference to its cached snapshot; call after
+    they are saved."""
+    wsck = c_key.urlsafe()
+    client = memcache.Client()
+    version = client.incr(MEMCACHE_SNAPSHOT_VERSION_KEY % wsck)
+    if version is None:
+        return
+    for _ in range(CAS_RETRIES):
+        entry = client.gets(MEMCACHE_SNAPSHOT_KEY % wsck)
+        # only a snapshot of the version just replaced can be brought up
+        # to date; anything else is stale already
+        if not entry or entry[0] != version - 1:
+            return
+        snapshot = _readAsync(wsck, entry).get_result()
+        if snapshot is None:
+            return
+        # the new chunks are keyed by the new version, so readers of the
+        # old one are undisturbed until the header is swapped
+        new_entry = _writeChunksAsync(wsck, version, _encode(
+            _append(snapshot, sessions))).get_result()
+        if not new_entry or client.cas(MEMCACHE_SNAPSHOT_KEY % wsck, new_entry):
+            return
+
+
+def sessions(c_key, snapshot, rows):
+    """Return Session entities for rows of a snapshot, without the datastore."""
+    result = []
+    for i in rows:
+        s_key = ndb.Key(Session, snapshot['ids'][i], parent=c_key)
+        values = dict((column, snapshot[column][i]) for column in TEXT_COLUMNS)
+        ordinal, minutes = snapshot['date'][i], snapshot['startTime'][i]
+        result.append(Session(
+            key=s_key,
+            date=date.fromordinal(ordinal) if ordinal is not None else None,
+            startTime=dtime(minutes // 60, minutes % 60)
+                if minutes is not None else None,
+            c_websafeKey=c_key.urlsafe(),
+            sessionWebSafeKey=s_key.urlsafe(),
+            **values))
+    return result
+
+
+# - - - predicates - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+_TOKEN = re.compile(r'''\s*(?:
+    (?P<paren>[()])
+  | (?P<op><=|>=|!=|=|<|>)
+  | "(?P<dquoted>(?:[^"\\]|\\.)*)"
+  | '(?P<squoted>[^']*)'
+  | (?P<word>[^\s()<>=!"']+)
+)''', re.X)
+
+_OPERATORS = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def _tokenize(text):
+    tokens, pos = [], 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if not match or match.end() == pos:
+            raise ValueError('unexpected text at: %s' % text[pos:pos + 20])
+        pos = match.end()
+        if match.group('paren'):
+            tokens.append(('paren', match.group('paren')))
+        elif match.group('op'):
+            tokens.append(('op', match.group('op')))
+        elif match.group('dquoted') is not None:
+            tokens.append(('value', re.sub(r'\\(.)', r'\1', match.group('dquoted'))))
+        elif match.group('squoted') is not None:
+            tokens.append(('value', match.group('squoted')))
+        elif match.group('word').upper() in ('AND', 'OR', 'NOT'):
+            tokens.append(('keyword', match.group('word').upper()))
+        else:
+            tokens.append(('value', match.group('word')))
+    return tokens
+
+
+class _Parser(object):
+    """Recursive descent parser turning a predicate into nested tuples:
+    ('or', a, b), ('and', a, b), ('not', a) and ('cmp', column, op, value)."""
+
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind, value=None):
+        token = self.peek()
+        if token[0] != kind or (value is not None and token[1] != value):
+            raise ValueError('expected %s but found %s' % (
+                value or kind, token[1] or 'the end'))
+        self.pos += 1
+        return token[1]
+
+    def parse(self):
+        tree = self.expr()
+        if self.pos != len(self.tokens):
+            raise ValueError('unexpected %s' % self.peek()[1])
+        return tree
+
+    def expr(self):
+        tree = self.term()
+        while self.peek() == ('keyword', 'OR'):
+            self.pos += 1
+            tree = ('or', tree, self.term())
+        return tree
+
+    def term(self):
+        tree = self.factor()
+        while self.peek() == ('keyword', 'AND'):
+            self.pos += 1
+            tree = ('and', tree, self.factor())
+        return tree
+
+    def factor(self):
+        if self.peek() == ('keyword', 'NOT'):
+            self.pos += 1
+            return ('not', self.factor())
+        if self.peek() == ('paren', '('):
+            self.pos += 1
+            tree = self.expr()
+            self.take('paren', ')')
+            return tree
+        field = self.take('value')
+        column = FIELD_ALIASES.get(field, field)
+        if column not in QUERY_COLUMNS:
+            raise ValueError('unknown field: %s' % field)
+        op = self.take('op')
+        return ('cmp', column, op, _parseValue(column, self.take('value')))
+
+
+def parsePredicate(text):
+    """Parse a predicate string; ValueError if it is malformed."""
+    if not text or not text.strip():
+        raise ValueError('empty predicate')
+    return _Parser(text).parse()
+
+
+def select(snapshot, tree):
+    """Return the sorted row numbers of a snapshot matching a parsed
+    predicate. Each comparison scans one column; AND, OR and NOT combine
+    the row sets."""
+    def rows(node):
+        if node[0] == 'cmp':
+            _, column, op, value = node
+            test = _OPERATORS[op]
+            return set(i for i, v in enumerate(snapshot[column])
+                       if v is not None and test(v, value))
+        if node[0] == 'not':
+            return set(range(len(snapshot['ids']))) - rows(node[1])
+        if node[0] == 'and':
+            return rows(node[1]) & rows(node[2])
+        return rows(node[1]) | rows(node[2])
+    return sorted(rows(tree))
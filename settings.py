@@ -14,3 +14,6 @@ created/forked from conference.py by wesc on 2014 may 24
 # Console or Cloud Console.
 WEB_CLIENT_ID = '910204275207-r7pl9671dspijekl3t28pe3jq8lljmb8.apps.googleusercontent.com'
 
+# Users (by email) allowed to call the admin-only endpoints, such as the
+# per-endpoint stats.
+ADMIN_EMAILS = []
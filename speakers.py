@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""speakers.py
+
+Speakers, identified by their normalized name ("Jane  Doe" and "jane doe"
+are one speaker). Every Session stores its normalizedSpeaker, so a
+speaker's sessions are one indexed equality query plus a get_multi,
+however many sessions they have.
+
+Sessions saved before normalizedSpeaker existed lack the property until
+backfill() has saved them again, so until it has finished sessionsOf()
+also runs the old equality query on the name as given. The backfill
+also recounts each conference's SpeakerSessionCount entities in a
+transaction, dropping counters keyed by names that are not normalized.
+
+"""
+
+from google.appengine.ext import ndb
+
+import migrations
+from models import Conference, Session, SpeakerSessionCount
+from models import normalizeSpeaker
+
+# conferences per backfill task, and sessions saved again per transaction
+BACKFILL_BATCH = 20
+RESAVE_BATCH = 100
+MIGRATION = 'speakers'
+
+
+def normalize(name):
+    """Return the canonical form of a speaker name."""
+    return normalizeSpeaker(name)
+
+
+def sessionsOf(name):
+    """Return the sessions of a speaker, whatever the case and spacing of
+    the name."""
+    normalized = normalize(name)
+    if not normalized:
+        return []
+    s_keys = Session.query(Session.normalizedSpeaker == normalized) \
+        .fetch(keys_only=True)
+    if not migrations.done(MIGRATION):
+        # sessions not saved again yet are only found by their exact name
+        found = set(s_keys)
+        s_keys += [s_key for s_key in Session.query(Session.speaker == name)
+                   .fetch(keys_only=True) if s_key not in found]
+    # sessions deleted since are skipped
+    return [ses for ses in ndb.get_multi(s_keys) if ses]
+
+
+def storedCount(c_key, name):
+    """Return how many of a conference's stored sessions are by a speaker
+    (name normalized); strongly consistent, as it is an ancestor query."""
+    return Session.query(Session.normalizedSpeaker == name,
+                         ancestor=c_key).count()
+
+
+def storedCounts(c_key):
+    """Return {normalized speaker name: sessions} for the sessions a
+    conference has stored; strongly consistent, as it is an ancestor
+    query."""
+    counts = {}
+    for ses in Session.query(ancestor=c_key):
+        name = normalize(ses.speaker)
+        if name:
+            counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+@ndb.transactional
+def _resave(s_keys):
+    ndb.put_multi([ses for ses in ndb.get_multi(s_keys) if ses])
+
+
+@ndb.transactional
+def _recount(c_key):
+    """Recount one conference's SpeakerSessionCounts from its sessions.
+    Session writes to the conference conflict with this transaction, so
+    no increment is lost."""
+    counts = storedCounts(c_key)
+    stale = [key for key in SpeakerSessionCount.query(ancestor=c_key)
+             .fetch(keys_only=True) if key.id() not in counts]
+    ndb.put_multi([SpeakerSessionCount(id=name, parent=c_key, count=count)
+                   for name, count in counts.items()])
+    ndb.delete_multi(stale)
+
+
+def backfill(cursor=None):
+    """Save the sessions of one batch of conferences again, so they are
+    indexed by normalized speaker, and recount their speakers; return
+    the cursor of the next batch, or None once all are done."""
+    start_cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+    c_keys, next_cursor, more = Conference.query().fetch_page(
+        BACKFILL_BATCH, start_cursor=start_cursor, keys_only=True)
+
+    for c_key in c_keys:
+        s_keys = Session.query(ancestor=c_key).fetch(keys_only=True)
+        for i in range(0, len(s_keys), RESAVE_BATCH):
+            _resave(s_keys[i:i + RESAVE_BATCH])
+        _recount(c_key)
+
+    if more and next_cursor:
+        return next_cursor.urlsafe()
+    migrations.finish(MIGRATION)
+    return None
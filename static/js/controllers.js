@@ -423,12 +423,26 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Holds the token for the next page of conferences, if there is one.
+     * @type {string}
+     */
+    $scope.nextPageToken = null;
+
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param loadMore when true, fetches the next page and appends it to the conferences already shown.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (loadMore) {
         var sendFilters = {
-            filters: []
+            filters: [],
+            // only the fields shown in the list; lets the server use projection queries
+            fields: ['websafeKey', 'name', 'city', 'startDate', 'organizerDisplayName',
+                'maxAttendees', 'seatsAvailable']
+        }
+        if (loadMore && $scope.nextPageToken) {
+            sendFilters.cursor = $scope.nextPageToken;
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -458,10 +472,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!loadMore) {
+                            $scope.conferences = [];
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextPageToken = resp.nextPageToken || null;
                     }
                     $scope.submitted = true;
                 });
@@ -470,10 +487,16 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
 
     /**
      * Invokes the conference.getConferencesCreated method.
+     *
+     * @param loadMore when true, fetches the next page and appends it to the conferences already shown.
      */
-    $scope.getConferencesCreated = function () {
+    $scope.getConferencesCreated = function (loadMore) {
+        var request = {};
+        if (loadMore && $scope.nextPageToken) {
+            request.cursor = $scope.nextPageToken;
+        }
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
+        gapi.client.conference.getConferencesCreated(request).
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -495,10 +518,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!loadMore) {
+                            $scope.conferences = [];
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextPageToken = resp.nextPageToken || null;
                     }
                     $scope.submitted = true;
                 });
@@ -631,8 +657,9 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                         $scope.isUserAttending = true;
                         $scope.conference.seatsAvailable = $scope.conference.seatsAvailable - 1;
                     } else {
-                        $scope.messages = 'Failed to register for the conference';
-                        $scope.alertStatus = 'warning';
+                        // The conference is full; the user now waits for a seat.
+                        $scope.messages = 'The conference is full, you are on its waitlist';
+                        $scope.alertStatus = 'info';
                     }
                 }
             });
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""test_bulk.py
+
+Admin bulk imports: how uploads are split into chunks, and how rows with
+foreign keys or a lost chunk are reported.
+
+usage: GAE_SDK=/path/to/google_appengine python -m unittest discover tests
+
+"""
+
+import json
+import os
+import StringIO
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import harness
+
+from google.appengine.ext import ndb
+
+import bulk
+from models import BulkChunk, BulkJob, Conference, Profile, Session
+
+
+def upload(rows):
+    return StringIO.StringIO(''.join(json.dumps(row) + '\n' for row in rows))
+
+
+class BulkImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = harness.Environment()
+        self.p_key = Profile(id='organizer', displayName='Organizer').put()
+        self.c_key = ndb.Key(Conference, 1, parent=self.p_key)
+        Conference(key=self.c_key, name='Conference', organizerUserId='organizer').put()
+
+    def tearDown(self):
+        self.env.deactivate()
+
+    def importRows(self, kind, rows):
+        job = bulk.startImport(kind, 'jsonl', upload(rows))
+        bulk.runImport(job.key.id())
+        return BulkJob.get_by_id(job.key.id())
+
+    def session(self, name, **row):
+        row.update(sessionName=name, c_websafeKey=self.c_key.urlsafe())
+        return row
+
+    def testChunksAreSizedByBytes(self):
+        chunk_bytes, bulk.CHUNK_BYTES = bulk.CHUNK_BYTES, 1000
+        try:
+            job = bulk.startImport('Session', 'jsonl', upload(
+                [self.session('Session %d' % i, highlights='x' * 200)
+                 for i in range(10)]))
+        finally:
+            bulk.CHUNK_BYTES = chunk_bytes
+        chunks = BulkChunk.query(ancestor=job.key).fetch()
+        self.assertEqual(job.rows, 10)
+        self.assertTrue(len(chunks) >= 3)
+        self.assertEqual(sum(len(chunk.rows) for chunk in chunks), 10)
+        for chunk in chunks:
+            self.assertTrue(sum(len(json.dumps(row))
+                                for row in chunk.rows) <= 1000)
+
+        bulk.runImport(job.key.id())
+        job = job.key.get()
+        self.assertEqual((job.status, job.imported, job.failed), ('done', 10, 0))
+        self.assertEqual(Session.query(ancestor=self.c_key).count(), 10)
+
+    def testBadUploadLeavesNothing(self):
+        self.assertRaises(ValueError, bulk.startImport, 'Session', 'jsonl',
+                          StringIO.StringIO('{"sessionName": "a"}\nnot json\n'))
+        self.assertEqual(BulkJob.query().count(), 0)
+        self.assertEqual(BulkChunk.query().count(), 0)
+
+    def testForeignKeysAreReportedPerRow(self):
+        other_app = ndb.Key(flat=self.c_key.flat() + ('Session', 1),
+                            app='someone-else')
+        other_conf = ndb.Key(Session, 1, parent=ndb.Key(
+            Conference, 2, parent=self.p_key))
+        job = self.importRows('Session', [
+            self.session('good'),
+            self.session('other app', sessionWebSafeKey=other_app.urlsafe()),
+            self.session('wrong kind', sessionWebSafeKey=self.p_key.urlsafe()),
+            self.session('wrong conference',
+                         sessionWebSafeKey=other_conf.urlsafe()),
+            self.session('garbage', sessionWebSafeKey='not-a-key'),
+            dict(sessionName='profile as conference',
+                 c_websafeKey=self.p_key.urlsafe()),
+        ])
+        self.assertEqual((job.status, job.imported, job.failed), ('done', 1, 5))
+        self.assertEqual([error.split(':')[0] for error in job.errors],
+                         ['row 2', 'row 3', 'row 4', 'row 5', 'row 6'])
+
+    def testMissingChunkFailsTheJob(self):
+        job = bulk.startImport('Session', 'jsonl', upload(
+            [self.session('Session')]))
+        ndb.Key(BulkChunk, 1, parent=job.key).delete()
+        bulk.runImport(job.key.id())
+        job = job.key.get()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.errors, ['chunk 1 is missing'])
+
+    def testResumesJobsOfFixedSizeChunks(self):
+        # chunks written before they were sized by bytes have no first row
+        job = BulkJob(kind='Session', rows=bulk.CHUNK_ROWS + 2,
+                      nextRow=bulk.CHUNK_ROWS + 1)
+        job.put()
+        BulkChunk(id=1, parent=job.key,
+                  rows=[{}] * bulk.CHUNK_ROWS).put()
+        BulkChunk(id=2, parent=job.key, rows=[
+            self.session('done already'), self.session('left')]).put()
+        bulk.runImport(job.key.id())
+        job = job.key.get()
+        self.assertEqual((job.status, job.imported), ('done', 1))
+        self.assertEqual([ses.sessionName for ses in
+                          Session.query(ancestor=self.c_key)], ['left'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""test_etags.py
+
+Conference etags change whenever what getConference returns changes,
+including the organizer name of conferences that do not store it, and
+requests holding the current etag get only the etag back, with
+notModified set.
+
+usage: GAE_SDK=/path/to/google_appengine python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import harness
+
+from google.appengine.ext import ndb
+from protorpc import remote
+
+import conference
+from conference import ConferenceApi
+import etags
+from models import Conference, Profile, ProfileMiniForm, Session
+
+
+class ConferenceTagTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = harness.Environment()
+        self.env.login('organizer@example.com')
+        self.api = ConferenceApi()
+        self.api.saveProfile(ProfileMiniForm(displayName='Old name'))
+        p_key = ndb.Key(Profile, 'organizer@example.com')
+        # saved before conferences stored organizerDisplayName
+        self.c_key = Conference(parent=p_key, name='Legacy',
+                                organizerUserId=p_key.id(),
+                                maxAttendees=10, seatsAvailable=10).put()
+
+    def tearDown(self):
+        self.env.deactivate()
+
+    def ifNoneMatch(self, tag):
+        """Send If-None-Match on the next calls, as endpoints does."""
+        self.api.initialize_request_state(remote.HttpRequestState(
+            http_method='GET', headers={'If-None-Match': tag}))
+
+    def getConference(self):
+        return self.api.getConference(
+            conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.c_key.urlsafe()))
+
+    def cachedTag(self):
+        return etags.cachedConferenceTagAsync(self.c_key).get_result()
+
+    def testCreatedConferenceHasATag(self):
+        cf = self.api.createConference(conference.ConferenceForm(
+            name='New', startDate='2016-01-01', endDate='2016-01-02',
+            maxAttendees=10))
+        self.assertFalse(cf.notModified)
+        reply = self.api.getConference(
+            conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=cf.websafeKey))
+        self.assertEqual(reply.name, 'New')
+        self.assertTrue(reply.etag)
+
+    def testUnchangedConferenceKeepsItsTag(self):
+        cf = self.getConference()
+        self.assertEqual(self.cachedTag(), cf.etag)
+        self.assertEqual(self.getConference().etag, cf.etag)
+
+    def testRenamedOrganizerChangesTheTag(self):
+        before = self.getConference()
+        self.assertEqual(before.organizerDisplayName, 'Old name')
+
+        self.api.saveProfile(ProfileMiniForm(displayName='New name'))
+        # the tag a client holds no longer matches, before the rename has
+        # been copied onto the conference
+        self.assertNotEqual(self.cachedTag(), before.etag)
+        after = self.getConference()
+        self.assertEqual(after.organizerDisplayName, 'New name')
+        self.assertNotEqual(after.etag, before.etag)
+        self.assertEqual(self.cachedTag(), after.etag)
+
+
+    def testMatchingTagIsNotModified(self):
+        cf = self.getConference()
+        self.ifNoneMatch(cf.etag)
+        self.env.counter.reset()
+        reply = self.getConference()
+        self.assertTrue(reply.notModified)
+        self.assertEqual((reply.etag, reply.name), (cf.etag, None))
+        # answered from memcache alone
+        self.assertEqual(self.env.counter.datastoreCalls(), 0)
+
+        # with the cached tag gone the conference is read again
+        etags.memcache.delete(etags.MEMCACHE_CONFERENCE_UPDATED_KEY
+                              % self.c_key.urlsafe())
+        reply = self.getConference()
+        self.assertTrue(reply.notModified)
+        self.assertEqual((reply.etag, reply.name), (cf.etag, None))
+
+    def testOtherTagGetsTheConference(self):
+        self.getConference()
+        self.ifNoneMatch('"an-old-tag"')
+        reply = self.getConference()
+        self.assertFalse(reply.notModified)
+        self.assertEqual(reply.name, 'Legacy')
+
+    def testMatchingSessionsTagIsNotModified(self):
+        s_key = ndb.Key(Session, 1, parent=self.c_key)
+        Session(key=s_key, sessionName='Session', c_websafeKey=self.c_key.urlsafe(),
+                sessionWebSafeKey=s_key.urlsafe()).put()
+        request = conference.SESSION_LIST_REQUEST.combined_message_class(
+            websafeConferenceKey=self.c_key.urlsafe())
+        sessions = self.api.getConferenceSessions(request)
+        self.assertEqual(len(sessions.items), 1)
+
+        self.ifNoneMatch(sessions.etag)
+        reply = self.api.getConferenceSessions(request)
+        self.assertTrue(reply.notModified)
+        self.assertEqual((reply.etag, reply.items), (sessions.etag, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
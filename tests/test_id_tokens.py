@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+"""test_id_tokens.py
+
+Local id_token verification (id_tokens.verify) and how utils resolves
+bearer tokens with it, against the stub signing keys of
+benchmarks/harness.py.
+
+usage: GAE_SDK=/path/to/google_appengine python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import harness
+
+import id_tokens
+import utils
+from models import Profile
+from settings import WEB_CLIENT_ID
+
+AUDIENCES = (WEB_CLIENT_ID,)
+
+
+class StubKeysTestCase(unittest.TestCase):
+    """Signs tokens with stub keys that id_tokens verifies against."""
+
+    @classmethod
+    def setUpClass(cls):
+        # generating RSA keys is slow; share them between the tests
+        cls.certificates = harness.StubCertificates()
+        cls.otherCertificates = harness.StubCertificates()
+
+    def setUp(self):
+        self.env = harness.Environment()
+        self.certificates.fetches = 0
+        id_tokens.setCertificateSource(self.certificates)
+        utils._tokenUsers.clear()
+
+    def tearDown(self):
+        id_tokens.setCertificateSource(id_tokens.fetchCertificates)
+        self.env.deactivate()
+
+    def token(self, **kwargs):
+        return self.certificates.idToken('sub-1', 'user@example.com', **kwargs)
+
+
+class IdTokenTest(StubKeysTestCase):
+
+    def assertInvalid(self, token):
+        self.assertRaises(id_tokens.InvalidToken,
+                          id_tokens.verify, token, AUDIENCES)
+
+    def testValidToken(self):
+        claims = id_tokens.verify(self.token(), AUDIENCES)
+        self.assertEqual(claims['sub'], 'sub-1')
+
+    def testBadSignature(self):
+        # signed by another key under the same kid
+        self.assertInvalid(self.otherCertificates.idToken(
+            'sub-1', 'user@example.com'))
+
+    def testTamperedClaims(self):
+        header, claims, signature = self.token().split('.')
+        other = self.certificates.idToken('sub-2', 'user@example.com')
+        self.assertInvalid('.'.join((header, other.split('.')[1], signature)))
+
+    def testWrongAudience(self):
+        self.assertInvalid(self.token(aud='someone-else.apps.googleusercontent.com'))
+
+    def testWrongIssuer(self):
+        self.assertInvalid(self.token(iss='https://evil.example.com'))
+
+    def testExpired(self):
+        self.assertInvalid(self.token(lifetime=-id_tokens.CLOCK_SKEW - 60))
+
+    def testUnknownKeyId(self):
+        self.assertInvalid(self.token(kid='rotated-away'))
+        self.assertInvalid(self.token(kid='rotated-away'))
+        # unknown kids refresh the keys at most once every MIN_REFRESH
+        self.assertEqual(self.certificates.fetches, 1)
+        id_tokens._keys['fetched'] -= id_tokens.MIN_REFRESH
+        self.assertInvalid(self.token(kid='rotated-away'))
+        self.assertEqual(self.certificates.fetches, 2)
+
+    def testMalformed(self):
+        self.assertRaises(id_tokens.MalformedToken,
+                          id_tokens.verify, 'ya29.an-access-token', AUDIENCES)
+
+    def testKeysUnavailable(self):
+        def unavailable():
+            raise id_tokens.KeysUnavailable('HTTP 503')
+        id_tokens.setCertificateSource(unavailable)
+        self.assertRaises(id_tokens.KeysUnavailable,
+                          id_tokens.verify, self.token(), AUDIENCES)
+
+
+class ResolveTokenTest(StubKeysTestCase):
+    """utils._resolveToken, with the tokeninfo endpoint replaced."""
+
+    def setUp(self):
+        super(ResolveTokenTest, self).setUp()
+        self.tokenInfoCalls = []
+        self._tokenInfo = utils._tokenInfo
+
+        def tokenInfo(token_type, token):
+            self.tokenInfoCalls.append(token_type)
+            return {'user_id': 'from-tokeninfo', 'expires_in': '600'}
+        utils._tokenInfo = tokenInfo
+
+    def tearDown(self):
+        utils._tokenInfo = self._tokenInfo
+        super(ResolveTokenTest, self).tearDown()
+
+    def testVerifiedLocally(self):
+        self.assertEqual(utils._resolveToken(self.token())[0], 'sub-1')
+        self.assertEqual(self.tokenInfoCalls, [])
+
+    def testInvalidTokenIsRejected(self):
+        self.assertEqual(utils._resolveToken(self.token(kid='rotated-away')),
+                         ('', 0))
+        self.assertEqual(self.tokenInfoCalls, [])
+
+    def testAccessTokenGoesToTokenInfo(self):
+        self.assertEqual(utils._resolveToken('ya29.an-access-token')[0],
+                         'from-tokeninfo')
+        self.assertEqual(self.tokenInfoCalls, ['access_token'])
+
+    def testKeysUnavailableFallsBackToTokenInfo(self):
+        def unavailable():
+            raise id_tokens.KeysUnavailable('HTTP 503')
+        id_tokens.setCertificateSource(unavailable)
+        self.assertEqual(utils._resolveToken(self.token())[0], 'from-tokeninfo')
+        self.assertEqual(self.tokenInfoCalls, ['id_token'])
+
+
+class CustomUserIdTest(unittest.TestCase):
+    """utils._customUserId, the ids of the "custom" id_type."""
+
+    def setUp(self):
+        self.env = harness.Environment()
+        utils._emailUsers.clear()
+
+    def tearDown(self):
+        self.env.deactivate()
+
+    def testSameIdWhateverTheCase(self):
+        user_id = utils._customUserId('Someone@Example.com')
+        utils._emailUsers.clear()
+        self.assertEqual(utils._customUserId('someone@example.com'), user_id)
+
+    def testExistingProfileKeepsItsId(self):
+        # profiles made with "email" ids are keyed by the email; they are
+        # found by key, not by an eventually consistent query on mainEmail
+        Profile(id='Someone@Example.com',
+                mainEmail='Someone@Example.com').put()
+        self.assertEqual(utils._customUserId('Someone@Example.com'),
+                         'Someone@Example.com')
+        utils._emailUsers.clear()
+        self.assertEqual(utils._customUserId('SOMEONE@example.com'),
+                         'Someone@Example.com')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""test_planner.py
+
+queryConferences planning: filters are typed and deduplicated, ranges on
+one property fold into one bound each, contradictions give an empty
+plan, and the datastore only gets what an index in index.yaml (here, a
+fixed list) can serve, the rest being post-filtered or rejected.
+
+usage: GAE_SDK=/path/to/google_appengine python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import harness
+
+import endpoints
+
+from models import ConferenceQueryForm
+import planner
+
+INDEXES = [
+    ('city', 'month', 'topics', 'name'),
+    ('city', 'name'),
+]
+
+
+def filters(*triples):
+    return [ConferenceQueryForm(field=field, operator=operator, value=value)
+            for field, operator, value in triples]
+
+
+class PlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.indexes, planner._indexes = planner._indexes, list(INDEXES)
+
+    def tearDown(self):
+        planner._indexes = self.indexes
+
+    def testValuesAreTypedAndDeduplicated(self):
+        eqs, ranges, nes = planner.normalize(filters(
+            ('MONTH', 'EQ', '6'), ('MONTH', 'EQ', '06'),
+            ('TOPIC', 'EQ', 'Web'), ('TOPIC', 'EQ', 'Web'),
+            ('CITY', 'NE', 'Paris'), ('CITY', 'NE', 'Paris')))
+        self.assertEqual(sorted(eqs), [('month', 6), ('topics', u'Web')])
+        self.assertEqual(ranges, {})
+        self.assertEqual(nes, [('city', u'Paris')])
+
+    def testInvalidFiltersAreRejected(self):
+        for bad in (filters(('MONTH', 'EQ', 'June')),
+                    filters(('COLOR', 'EQ', 'red')),
+                    filters(('CITY', 'LIKE', 'Par')),
+                    filters(*[('CITY', 'NE', str(i))
+                              for i in range(planner.MAX_FILTERS + 1)])):
+            self.assertRaises(endpoints.BadRequestException,
+                              planner.normalize, bad)
+
+    def testRangesFoldToTheTightestBounds(self):
+        eqs, ranges, nes = planner.normalize(filters(
+            ('MAX_ATTENDEES', 'GT', '10'), ('MAX_ATTENDEES', 'GTEQ', '20'),
+            ('MAX_ATTENDEES', 'LTEQ', '100'), ('MAX_ATTENDEES', 'LT', '100'),
+            ('MONTH', 'GTEQ', '3'), ('MONTH', 'GT', '3')))
+        self.assertEqual(ranges['maxAttendees'].bounds(),
+                         [('>=', 20), ('<', 100)])
+        self.assertEqual(ranges['month'].bounds(), [('>', 3)])
+
+    def testEqualitySettlesOtherFiltersOnItsProperty(self):
+        eqs, ranges, nes = planner.normalize(filters(
+            ('MONTH', 'EQ', '6'), ('MONTH', 'GT', '3'), ('MONTH', 'NE', '7')))
+        self.assertEqual((eqs, ranges, nes), ([('month', 6)], {}, []))
+
+    def testContradictionsGiveAnEmptyPlan(self):
+        for contradiction in (
+                [('CITY', 'EQ', 'London'), ('CITY', 'EQ', 'Paris')],
+                [('MONTH', 'GT', '6'), ('MONTH', 'LT', '5')],
+                [('MONTH', 'GT', '5'), ('MONTH', 'LTEQ', '5')],
+                [('MONTH', 'EQ', '6'), ('MONTH', 'NE', '6')],
+                [('MONTH', 'EQ', '6'), ('MONTH', 'GT', '7')]):
+            plan = planner.plan(filters(*contradiction))
+            self.assertTrue(plan.empty, contradiction)
+            self.assertFalse(plan.unfiltered)
+            self.assertTrue(plan.explain().startswith('empty'))
+
+    def testCompatibleFiltersAreNotEmpty(self):
+        for compatible in (
+                # a conference may have both topics
+                [('TOPIC', 'EQ', 'Web'), ('TOPIC', 'EQ', 'Go')],
+                [('MONTH', 'GTEQ', '5'), ('MONTH', 'LTEQ', '5')]):
+            self.assertFalse(planner.plan(filters(*compatible)).empty,
+                             compatible)
+
+    def testNoFiltersSortByName(self):
+        plan = planner.plan([])
+        self.assertTrue(plan.unfiltered)
+        self.assertEqual((plan.filters, plan.order, plan.index),
+                         ([], ['name'], 'built-in'))
+
+    def testCompositeIndexServesEqualitiesSortedByName(self):
+        plan = planner.plan(filters(('CITY', 'EQ', 'London'),
+                                    ('MONTH', 'EQ', '6'),
+                                    ('TOPIC', 'EQ', 'Web')))
+        self.assertEqual(plan.index, ('city', 'month', 'topics', 'name'))
+        self.assertEqual(plan.order, ['name'])
+        self.assertEqual(len(plan.filters), 3)
+        self.assertEqual(plan.postFilters, [])
+
+    def testWithoutAnIndexEqualitiesUseTheBuiltInOnes(self):
+        plan = planner.plan(filters(('CITY', 'EQ', 'London'),
+                                    ('MONTH', 'EQ', '6')))
+        self.assertEqual(plan.index, 'built-in')
+        self.assertEqual(plan.order, [])
+        self.assertEqual(sorted(plan.filters),
+                         [('city', '=', u'London'), ('month', '=', 6)])
+
+    def testRangeSortsByItsPropertyFirst(self):
+        plan = planner.plan(filters(('MAX_ATTENDEES', 'GT', '100')))
+        self.assertEqual(plan.filters, [('maxAttendees', '>', 100)])
+        self.assertEqual(plan.rangeField, 'maxAttendees')
+        self.assertEqual(plan.order, ['maxAttendees'])
+
+    def testNotEqualIsAlwaysPostFiltered(self):
+        plan = planner.plan(filters(('CITY', 'EQ', 'London'),
+                                    ('MONTH', 'NE', '6')))
+        self.assertEqual(plan.filters, [('city', '=', u'London')])
+        self.assertEqual(plan.postFilters, [('month', '!=', 6)])
+        self.assertEqual(plan.index, ('city', 'name'))
+
+    def testMissingIndexIsRejected(self):
+        query = filters(('CITY', 'EQ', 'London'),
+                        ('MONTH', 'GTEQ', '3'), ('MONTH', 'LTEQ', '4'),
+                        ('MAX_ATTENDEES', 'GT', '100'))
+        try:
+            planner.plan(query)
+            self.fail('planned without an index')
+        except endpoints.BadRequestException as e:
+            self.assertIn('Conference(city, month, name)', str(e))
+
+        planner._indexes.append(('city', 'month', 'name'))
+        plan = planner.plan(query)
+        self.assertEqual(plan.index, ('city', 'month', 'name'))
+        self.assertEqual(plan.filters, [('city', '=', u'London'),
+                                        ('month', '>=', 3), ('month', '<=', 4)])
+        self.assertEqual(plan.postFilters, [('maxAttendees', '>', 100)])
+
+
+if __name__ == '__main__':
+    unittest.main()
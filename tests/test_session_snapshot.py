@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""test_session_snapshot.py
+
+The memcache session snapshot, stored in chunks once it outgrows a
+single memcache value.
+
+usage: GAE_SDK=/path/to/google_appengine python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import harness
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference, Session
+import session_snapshot
+
+
+class SnapshotChunksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = harness.Environment()
+        self.chunkBytes = session_snapshot.CHUNK_BYTES
+        # random highlights don't compress, so small chunks make several
+        session_snapshot.CHUNK_BYTES = 4096
+        self.c_key = Conference(name='Big conference').put()
+        self.wsck = self.c_key.urlsafe()
+        self.put(0, 20)
+
+    def tearDown(self):
+        session_snapshot.CHUNK_BYTES = self.chunkBytes
+        self.env.deactivate()
+
+    def put(self, first, n):
+        sessions = []
+        for i in range(first, first + n):
+            s_key = ndb.Key(Session, i + 1, parent=self.c_key)
+            sessions.append(Session(
+                key=s_key, sessionName='Session %d' % i,
+                speaker='Speaker %d' % i,
+                highlights=os.urandom(600).encode('hex'),
+                c_websafeKey=self.wsck, sessionWebSafeKey=s_key.urlsafe()))
+        ndb.put_multi(sessions)
+        return sessions
+
+    def header(self):
+        return memcache.get(session_snapshot.MEMCACHE_SNAPSHOT_KEY % self.wsck)
+
+    def testStoredInChunks(self):
+        built = session_snapshot.get(self.c_key)
+        self.assertTrue(self.header()[1] > 1)
+        self.assertEqual(session_snapshot.get(self.c_key), built)
+        self.assertEqual(len(built['ids']), 20)
+
+    def testLostChunkRebuilds(self):
+        session_snapshot.get(self.c_key)
+        version = self.header()[0]
+        memcache.delete(session_snapshot.MEMCACHE_SNAPSHOT_CHUNK_KEY % (
+            self.wsck, version, 1))
+        self.assertEqual(len(session_snapshot.get(self.c_key)['ids']), 20)
+
+    def testPatchWritesNewChunks(self):
+        session_snapshot.get(self.c_key)
+        session_snapshot.patch(self.c_key, self.put(20, 5))
+        header = self.header()
+        self.assertEqual(header[0], memcache.get(
+            session_snapshot.MEMCACHE_SNAPSHOT_VERSION_KEY % self.wsck))
+        snapshot = session_snapshot.get(self.c_key)
+        self.assertEqual(len(snapshot['ids']), 25)
+        self.assertEqual(snapshot['sessionName'][-1], 'Session 24')
+
+    def testTooLargeIsNotCached(self):
+        session_snapshot.CHUNK_BYTES = 64
+        self.assertEqual(len(session_snapshot.get(self.c_key)['ids']), 20)
+        self.assertEqual(self.header(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
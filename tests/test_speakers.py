@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""test_speakers.py
+
+Per-conference speaker session counts, kept up by every session write.
+
+usage: GAE_SDK=/path/to/google_appengine python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import harness
+
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+import migrations
+from models import ConferenceForm, Session, SessionForm, SpeakerSessionCount
+import speakers
+
+
+class SpeakerCountTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = harness.Environment()
+        self.env.login('organizer@example.com')
+        self.api = ConferenceApi()
+        self.wsck = self.api.createConference(ConferenceForm(
+            name='Conference', startDate='2016-01-01', endDate='2016-01-02',
+            maxAttendees=10)).websafeKey
+        self.c_key = ndb.Key(urlsafe=self.wsck)
+
+    def tearDown(self):
+        self.env.deactivate()
+
+    def storeUncounted(self, speaker, n):
+        """Store sessions the way they were before speakers were counted."""
+        sessions = []
+        for i in range(n):
+            s_key = ndb.Key(Session, '%s %d' % (speaker, i), parent=self.c_key)
+            sessions.append(Session(key=s_key, sessionName='Old %d' % i,
+                                    speaker=speaker, c_websafeKey=self.wsck,
+                                    sessionWebSafeKey=s_key.urlsafe()))
+        ndb.put_multi(sessions)
+
+    def createSession(self, speaker):
+        self.api.createSession(SessionForm(
+            sessionName='New', speaker=speaker, c_websafeKey=self.wsck))
+
+    def count(self, name):
+        counter = ndb.Key(SpeakerSessionCount, speakers.normalize(name),
+                          parent=self.c_key).get()
+        return counter.count if counter else None
+
+    def testCountsAcrossCaseAndSpacing(self):
+        self.createSession('Ada Lovelace')
+        self.createSession('ada  LOVELACE')
+        self.assertEqual(self.count('Ada Lovelace'), 2)
+
+    def testNewCounterStartsFromStoredSessions(self):
+        self.storeUncounted('Ada Lovelace', 3)
+        self.storeUncounted('Grace Hopper', 5)
+        self.env.counter.reset()
+        self.createSession('ada lovelace')
+        self.assertEqual(self.count('Ada Lovelace'), 4)
+        # only the new speaker's sessions are counted, not every session
+        self.assertTrue(self.env.counter.entitiesRead < 5)
+
+    def testNoSeedingOnceBackfilled(self):
+        migrations.finish(speakers.MIGRATION)
+        self.createSession('Grace Hopper')
+        self.assertEqual(self.count('Grace Hopper'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""test_waitlist.py
+
+Waitlists of full conferences: users are promoted in the order they
+joined, a promotion batch stays within the entity groups a cross-group
+transaction may touch, and capacity changes while users wait neither
+promote them early nor leave new seats unused.
+
+usage: GAE_SDK=/path/to/google_appengine python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import harness
+
+import endpoints
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+import conference
+from conference import ConferenceApi
+from models import ConferenceForm, Profile, Registration, WaitlistEntry
+import seats
+
+
+class WaitlistTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = harness.Environment()
+        self.api = ConferenceApi()
+        self.env.login('organizer@example.com')
+        form = self.api.createConference(ConferenceForm(
+            name='Conference', startDate='2016-06-01', endDate='2016-06-01',
+            maxAttendees=2))
+        self.wsck = form.websafeKey
+        self.c_key = ndb.Key(urlsafe=self.wsck)
+
+    def tearDown(self):
+        self.env.deactivate()
+
+    def register(self, *users):
+        """Register users in turn; return whether each got a seat."""
+        got = []
+        for user in users:
+            self.env.login(user)
+            got.append(self.api.registerForConference(
+                conference.CONF_GET_REQUEST.combined_message_class(
+                    websafeConferenceKey=self.wsck)).data)
+        return got
+
+    def unregister(self, user):
+        self.env.login(user)
+        self.api.unregisterFromConference(
+            conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck))
+
+    def position(self, user):
+        """The user's place on the waitlist, or None if not on it."""
+        self.env.login(user)
+        try:
+            return self.api.getWaitlistPosition(
+                conference.CONF_GET_REQUEST.combined_message_class(
+                    websafeConferenceKey=self.wsck)).position
+        except endpoints.NotFoundException:
+            return None
+
+    def setCapacity(self, maxAttendees):
+        self.env.login('organizer@example.com')
+        return self.api.setConferenceCapacity(
+            conference.CAPACITY_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck, maxAttendees=maxAttendees))
+
+    def registered(self, user):
+        return Registration.get_by_id(self.wsck,
+                                      parent=ndb.Key(Profile, user)) is not None
+
+    def waitKeys(self, users):
+        return [ndb.Key(Profile, user, WaitlistEntry, self.wsck)
+                for user in users]
+
+    def shard(self):
+        return seats.loadShardsAsync(self.c_key).get_result()[0]
+
+    def testFullConferenceQueuesInOrder(self):
+        self.assertEqual(self.register('a', 'b', 'c', 'd', 'e'),
+                         [True, True, False, False, False])
+        self.assertEqual([self.position(u) for u in 'abcde'],
+                         [None, None, 1, 2, 3])
+
+    def testBatchPromotesInGivenOrder(self):
+        self.register('a', 'b', 'c', 'd', 'e')
+        shard = self.shard()
+        shard.seatsAvailable = 2
+        shard.put()
+
+        promoted, removed = ConferenceApi._promoteBatch(
+            shard.key, self.waitKeys(['e', 'c', 'd']))
+        self.assertEqual(promoted, [ndb.Key(Profile, 'e'), ndb.Key(Profile, 'c')])
+        self.assertEqual(removed, 2)
+        self.assertEqual(self.shard().seatsAvailable, 0)
+        self.assertEqual([self.registered(u) for u in 'cde'],
+                         [True, False, True])
+        self.assertEqual(self.position('d'), 1)
+
+    def testBatchSkipsEntriesRegisteredMeanwhile(self):
+        self.register('a', 'b', 'c', 'd')
+        shard = self.shard()
+        shard.seatsAvailable = 1
+        shard.put()
+        # c got a seat some other way since joining the waitlist
+        Registration(id=self.wsck, parent=ndb.Key(Profile, 'c'),
+                     conference=self.c_key).put()
+
+        promoted, removed = ConferenceApi._promoteBatch(
+            shard.key, self.waitKeys(['c', 'd']))
+        self.assertEqual(promoted, [ndb.Key(Profile, 'd')])
+        self.assertEqual(removed, 2)
+
+    def testBatchFitsInOneCrossGroupTransaction(self):
+        users = ['user%d' % i for i in range(conference.PROMOTE_BATCH + 1)]
+        self.setCapacity(len(users) + 2)
+        self.register('a', 'b')
+        ndb.put_multi([Profile(id=user, displayName=user) for user in users] +
+                      [WaitlistEntry(key=key, conference=self.c_key)
+                       for key in self.waitKeys(users)])
+        shard_key = max(seats.loadShardsAsync(self.c_key).get_result(),
+                        key=lambda shard: shard.seatsAvailable).key
+
+        # the shard and one Profile per entry: 25 entity groups at most
+        self.assertRaises(datastore_errors.BadRequestError,
+                          ConferenceApi._promoteBatch, shard_key,
+                          self.waitKeys(users))
+        promoted, removed = ConferenceApi._promoteBatch(
+            shard_key, self.waitKeys(users[:conference.PROMOTE_BATCH]))
+        self.assertEqual(len(promoted), conference.PROMOTE_BATCH)
+
+    def testShrinkingLeavesUsersWaiting(self):
+        self.register('a', 'b', 'c', 'd')
+        # b's seat goes to the waitlist by a task, which has not run yet
+        self.unregister('b')
+        self.setCapacity(1)
+        self.env.runTasks()
+        self.assertEqual([self.position(u) for u in 'cd'], [1, 2])
+        self.assertEqual(seats.getSeatsAvailable([self.c_key])[self.c_key], 0)
+
+    def testShrinkingBelowAttendeesConflicts(self):
+        self.register('a', 'b', 'c')
+        self.assertRaises(conference.ConflictException, self.setCapacity, 1)
+        self.assertEqual(self.position('c'), 1)
+
+    def testGrowingPromotesWaitingUsersFirst(self):
+        self.register('a', 'b', 'c', 'd', 'e')
+        form = self.setCapacity(4)
+        self.assertEqual(form.maxAttendees, 4)
+        self.env.runTasks()
+        self.assertEqual([self.registered(u) for u in 'cde'],
+                         [True, True, False])
+        self.assertEqual(self.position('e'), 1)
+        self.assertEqual(seats.getSeatsAvailable([self.c_key])[self.c_key], 0)
+        # a newcomer joins the end of the waitlist
+        self.assertEqual(self.register('f'), [False])
+        self.assertEqual(self.position('f'), 2)
+
+    def testGrowingAddsShards(self):
+        self.assertEqual(seats.shardCount(self.c_key.get()), 1)
+        self.setCapacity(10 * seats.SEATS_PER_SHARD)
+        conf = self.c_key.get()
+        self.assertEqual(seats.shardCount(conf), 10)
+        self.assertEqual(sum(shard.seatsAvailable for shard in
+                             ndb.get_multi(seats.shardKeys(conf))),
+                         10 * seats.SEATS_PER_SHARD)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,71 @@
+import collections
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 
+import endpoints
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
-from models import Profile
+from google.appengine.ext import ndb
+
+import id_tokens
+from models import Profile, UserIdMapping
+from settings import WEB_CLIENT_ID
+
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+TOKENINFO_ATTEMPTS = 2
+TOKENINFO_DEADLINE = 5
+# client ids id_tokens may be issued to
+TOKEN_AUDIENCES = (WEB_CLIENT_ID, endpoints.API_EXPLORER_CLIENT_ID)
+
+MEMCACHE_TOKEN_USER_KEY = "TOKEN_USER:%s"
+# resolved tokens are kept no longer than this, nor past their expiry
+TOKEN_CACHE_TIME = 600
+LOCAL_CACHE_SIZE = 1000
+# email -> user id mappings never change
+EMAIL_CACHE_TIME = 3600
+
+
+class LruCache(object):
+    """Per-instance cache of at most maxsize entries, each expiring after
+    its own ttl; the least recently used entry makes room for new ones."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None."""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or item[1] < time.time():
+                return None
+            self._items[key] = item
+            return item[0]
+
+    def put(self, key, value, ttl=None):
+        """Cache value for ttl seconds (at most the cache's own ttl)."""
+        ttl = min(ttl, self.ttl) if ttl is not None else self.ttl
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, time.time() + ttl)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+# token digest -> user id, and email -> user id for the "custom" ids
+_tokenUsers = LruCache(LOCAL_CACHE_SIZE, TOKEN_CACHE_TIME)
+_emailUsers = LruCache(LOCAL_CACHE_SIZE, EMAIL_CACHE_TIME)
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -13,33 +74,103 @@ def getUserId(user, id_type="email"):
     if id_type == "oauth":
         """A workaround implementation for getting userid."""
         auth = os.getenv('HTTP_AUTHORIZATION')
+        if not auth or len(auth.split()) != 2:
+            return ''
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _tokenUserId(token)
 
     if id_type == "custom":
-        # implement your own user_id creation and getting algorythm
-        # this is just a sample that queries datastore for an existing profile
-        # and generates an id if profile does not exist for an email
-        profile = Conference.query(Conference.mainEmail == user.email())
-        if profile:
-            return profile.id()
-        else:
-            return str(uuid.uuid1().get_hex())
+        return _customUserId(user.email())
+
+
+def _tokenUserId(token):
+    """Return the user id of a bearer token, from this instance's cache,
+    memcache, or by resolving the token."""
+    # tokens are long and secret; cache them under a digest
+    digest = hashlib.sha256(token).hexdigest()
+    user_id = _tokenUsers.get(digest)
+    if user_id is not None:
+        return user_id
+    cached = memcache.get(MEMCACHE_TOKEN_USER_KEY % digest)
+    if cached is not None:
+        user_id, expires = cached
+    else:
+        user_id, expires = _resolveToken(token)
+    ttl = int(min(TOKEN_CACHE_TIME, expires - time.time()))
+    if user_id and ttl > 0:
+        _tokenUsers.put(digest, user_id, ttl)
+        if cached is None:
+            memcache.set(MEMCACHE_TOKEN_USER_KEY % digest, (user_id, expires),
+                         time=ttl)
+    return user_id
+
+
+def _resolveToken(token):
+    """Return (user id, expiry time) of a token; ('', 0) if it is invalid.
+
+    id_tokens are verified locally; access tokens, and id_tokens when the
+    signing keys cannot be fetched, go to the tokeninfo endpoint.
+    """
+    if 'OAUTH_USER_ID' not in os.environ:
+        try:
+            claims = id_tokens.verify(token, TOKEN_AUDIENCES)
+            return claims['sub'], claims['exp']
+        except id_tokens.MalformedToken:
+            # not an id_token; try it as an access token
+            pass
+        except id_tokens.InvalidToken:
+            return '', 0
+        except id_tokens.KeysUnavailable:
+            info = _tokenInfo('id_token', token)
+            if info is not None:
+                return _fromTokenInfo(info)
+    info = _tokenInfo('access_token', token)
+    return _fromTokenInfo(info) if info is not None else ('', 0)
+
+
+def _fromTokenInfo(info):
+    return info.get('user_id', ''), time.time() + int(info.get('expires_in', 0))
+
+
+def _tokenInfo(token_type, token):
+    """Return the tokeninfo of a token, or None if it is invalid or the
+    endpoint could not be reached."""
+    for attempt in range(TOKENINFO_ATTEMPTS):
+        try:
+            resp = urlfetch.fetch(TOKENINFO_URL % (token_type, token),
+                                  deadline=TOKENINFO_DEADLINE)
+        except urlfetch.Error:
+            continue
+        if resp.status_code == 200:
+            return json.loads(resp.content)
+        if resp.status_code == 400:
+            # an invalid token stays invalid
+            return None
+    return None
+
+
+def _emailIds(email):
+    """Return the profile ids an email may have been stored under, the
+    email as given first."""
+    return [email] if email == email.lower() else [email, email.lower()]
+
+
+def _customUserId(email):
+    """Return the user id kept for an email, creating it on first use."""
+    key = email.lower()
+    user_id = _emailUsers.get(key)
+    if user_id is None:
+        mapping = UserIdMapping.get_by_id(key)
+        if mapping is None:
+            # users who already have a profile keep its id; profiles made
+            # with "email" ids are keyed by the email, so a get (strongly
+            # consistent, unlike a query on mainEmail) finds them whatever
+            # the case the email was stored in
+            profiles = ndb.get_multi([ndb.Key(Profile, email_id)
+                                      for email_id in _emailIds(email)])
+            p_keys = [profile.key for profile in profiles if profile]
+            mapping = UserIdMapping.get_or_insert(
+                key, userId=p_keys[0].id() if p_keys else uuid.uuid4().hex)
+        user_id = mapping.userId
+        _emailUsers.put(key, user_id)
+    return user_id
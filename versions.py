@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+
+"""versions.py
+
+Version numbers kept in memcache. A cache stores its entries with the
+current version of what they were built from and makes them all stale
+at once by bumping the version with incr(). A version memcache evicted
+is started again from the clock (in ms) rather than from zero, so it
+never comes back to a value that entries were stored under before.
+
+"""
+
+import time
+
+from google.appengine.ext import ndb
+
+
+@ndb.tasklet
+def getAsync(key):
+    """Return the version kept under a memcache key, starting one if
+    needed; None if memcache lost it meanwhile."""
+    ctx = ndb.get_context()
+    version = int(time.time() * 1000)
+    added = yield ctx.memcache_add(key, version)
+    if not added:
+        version = yield ctx.memcache_get(key)
+    raise ndb.Return(version)